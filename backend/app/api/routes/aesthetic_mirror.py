@@ -3,12 +3,20 @@
 Aesthetic Mirror - AI 驱动的风格迁移系统
 """
 
-from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from uuid import UUID
+from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect, status
 from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
+from app.api.v1.auth import get_current_user_id
+from app.api.v1.tasks import create_batch
+from app.core.database import get_db
+from app.models.task import TaskType
+from app.schemas.task import BatchTaskResponse
 from app.services.gemini_service import gemini_service
 from app.services.nanobana_service import nano_banana_service
 from app.services.websocket_manager import ws_manager
+from app.core.concurrency import gather_stages
 
 router = APIRouter(prefix="/aesthetic-mirror", tags=["Aesthetic Mirror"])
 
@@ -18,6 +26,7 @@ router = APIRouter(prefix="/aesthetic-mirror", tags=["Aesthetic Mirror"])
 class ExtractStyleRequest(BaseModel):
     """风格提取请求"""
     style_image_url: str
+    task_id: Optional[str] = None  # 提供时通过 WebSocket 流式推送DNA字段
 
 
 class FuseStyleRequest(BaseModel):
@@ -29,13 +38,19 @@ class FuseStyleRequest(BaseModel):
     aspect_ratio: str = "1:1"
 
 
+class BatchProduct(BaseModel):
+    """批量风格融合中的单个产品"""
+    image_url: str
+    info: dict = {}  # 产品分析结果
+
+
 class BatchFuseRequest(BaseModel):
     """批量风格融合请求"""
     style_dna: dict
-    products: List[dict]  # [{"info": {...}, "image_url": "..."}]
+    products: List[BatchProduct]
     strength: float = 0.7
     aspect_ratio: str = "1:1"
-    task_id: Optional[str] = None
+    task_id: Optional[str] = None  # 可选：进度同时推送到该 WebSocket 频道
 
 
 class QuickStyleRequest(BaseModel):
@@ -44,6 +59,7 @@ class QuickStyleRequest(BaseModel):
     product_image_url: str
     strength: float = 0.7
     aspect_ratio: str = "1:1"
+    with_product_analysis: bool = False  # 同时返回产品分析（与风格提取并发执行）
 
 
 class BatchQuickStyleRequest(BaseModel):
@@ -52,7 +68,7 @@ class BatchQuickStyleRequest(BaseModel):
     product_image_urls: List[str]
     strength: float = 0.7
     aspect_ratio: str = "1:1"
-    task_id: Optional[str] = None
+    task_id: Optional[str] = None  # 可选：进度同时推送到该 WebSocket 频道
 
 
 # ==================== API 端点 ====================
@@ -70,12 +86,14 @@ async def extract_style(request: ExtractStyleRequest):
     - 装饰DNA（道具、图案、图形元素）
     - 氛围DNA（情感关键词、五感体验）
     - 复刻提示词（英文）
+    
+    提供 task_id 时，各DNA字段生成完毕即通过 WebSocket 推送。
     """
-    try:
-        result = await gemini_service.extract_style_dna(request.style_image_url)
-        return {"success": True, "data": result}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    result = await gemini_service.extract_style_dna(
+        request.style_image_url,
+        on_section=ws_manager.section_relay(request.task_id, "extracting", expected=8),
+    )
+    return {"success": True, "data": result}
 
 
 @router.post("/fuse-style")
@@ -87,193 +105,130 @@ async def fuse_style(request: FuseStyleRequest):
     - 环境、光影、氛围与风格DNA一致
     - 融合自然，无PS痕迹
     """
-    try:
-        # 1. 生成融合提示词
-        fusion_data = await gemini_service.fuse_style_with_product(
-            style_dna=request.style_dna,
-            product_info=request.product_info,
-            product_image_url=request.product_image_url
-        )
-        
-        # 2. 获取融合参数
-        fusion_prompt = fusion_data.get("fusion_prompt", {})
-        main_prompt = fusion_prompt.get("main_prompt", "")
-        negative_prompt = fusion_prompt.get("negative_prompt", "")
-        gen_params = fusion_prompt.get("generation_params", {})
-        
-        # 3. 生成图片
-        result = await nano_banana_service.generate_style_transfer(
-            product_image_url=request.product_image_url,
-            style_prompt=main_prompt,
-            negative_prompt=negative_prompt,
-            strength=gen_params.get("strength", request.strength),
-            aspect_ratio=request.aspect_ratio,
-        )
-        
-        # 4. 添加元数据
-        result["fusion_data"] = fusion_data
-        result["quality_checks"] = fusion_data.get("quality_checks", [])
-        
-        return {"success": True, "data": result}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # 1. 生成融合提示词
+    fusion_data = await gemini_service.fuse_style_with_product(
+        style_dna=request.style_dna,
+        product_info=request.product_info,
+        product_image_url=request.product_image_url
+    )
+    
+    # 2. 获取融合参数
+    fusion_prompt = fusion_data.get("fusion_prompt", {})
+    main_prompt = fusion_prompt.get("main_prompt", "")
+    negative_prompt = fusion_prompt.get("negative_prompt", "")
+    gen_params = fusion_prompt.get("generation_params", {})
+    
+    # 3. 生成图片
+    result = await nano_banana_service.generate_style_transfer(
+        product_image_url=request.product_image_url,
+        style_prompt=main_prompt,
+        negative_prompt=negative_prompt,
+        strength=gen_params.get("strength", request.strength),
+        aspect_ratio=request.aspect_ratio,
+    )
+    
+    # 4. 添加元数据
+    result["fusion_data"] = fusion_data
+    result["quality_checks"] = fusion_data.get("quality_checks", [])
+    
+    return {"success": True, "data": result}
 
 
-@router.post("/batch-fuse")
-async def batch_fuse(request: BatchFuseRequest):
+@router.post(
+    "/batch-fuse", response_model=BatchTaskResponse, status_code=status.HTTP_202_ACCEPTED
+)
+async def batch_fuse(
+    request: BatchFuseRequest,
+    db: AsyncSession = Depends(get_db),
+    user_id: UUID = Depends(get_current_user_id),
+):
     """批量风格融合
     
-    将同一风格DNA应用到多个产品上
+    将同一风格DNA应用到多个产品上。
+    创建一个批量任务及每个产品一个子任务后立即返回 202，由后台执行：
+    融合提示词生成与图片生成两阶段流水线并发执行，每个产品完成即推送进度。
+    进度与结果通过 /tasks/{id}、/tasks/{id}/children 与 WebSocket 获取。
     """
-    results = []
-    total = len(request.products)
-    
-    for i, product in enumerate(request.products):
-        try:
-            # 生成融合提示词
-            fusion_data = await gemini_service.fuse_style_with_product(
-                style_dna=request.style_dna,
-                product_info=product.get("info", {}),
-                product_image_url=product["image_url"]
-            )
-            
-            fusion_prompt = fusion_data.get("fusion_prompt", {})
-            main_prompt = fusion_prompt.get("main_prompt", "")
-            negative_prompt = fusion_prompt.get("negative_prompt", "")
-            gen_params = fusion_prompt.get("generation_params", {})
-            
-            # 生成图片
-            result = await nano_banana_service.generate_style_transfer(
-                product_image_url=product["image_url"],
-                style_prompt=main_prompt,
-                negative_prompt=negative_prompt,
-                strength=gen_params.get("strength", request.strength),
-                aspect_ratio=request.aspect_ratio,
-            )
-            
-            result["order"] = i + 1
-            result["original_image"] = product["image_url"]
-            result["success"] = True
-            results.append(result)
-            
-            # 推送进度
-            if request.task_id:
-                await ws_manager.send_progress(
-                    task_id=request.task_id,
-                    data={
-                        "stage": "fusing",
-                        "progress": int((i + 1) / total * 100),
-                        "current": i + 1,
-                        "total": total,
-                        "image_url": result["url"],
-                    }
-                )
-                
-        except Exception as e:
-            results.append({
-                "order": i + 1,
-                "original_image": product["image_url"],
-                "error": str(e),
-                "url": None,
-                "success": False,
-            })
-            
-            if request.task_id:
-                await ws_manager.send_progress(
-                    task_id=request.task_id,
-                    data={
-                        "stage": "fusing",
-                        "progress": int((i + 1) / total * 100),
-                        "current": i + 1,
-                        "total": total,
-                        "error": str(e),
-                    }
-                )
-    
-    return {"success": True, "data": results}
+    return await create_batch(
+        db,
+        user_id,
+        TaskType.BATCH_FUSE,
+        input_images=None,
+        parameters={
+            "style_dna": request.style_dna,
+            "strength": request.strength,
+            "aspect_ratio": request.aspect_ratio,
+            "channel": request.task_id,
+        },
+        items=[
+            ({"product_image_url": product.image_url}, {"info": product.info})
+            for product in request.products
+        ],
+    )
 
 
 @router.post("/quick-transfer")
 async def quick_style_transfer(request: QuickStyleRequest):
     """快速风格迁移
     
-    一步完成风格提取和应用，适合快速预览效果
+    一步完成风格提取和应用，适合快速预览效果。
+    需要产品分析时，产品分析与风格提取并发执行。
     """
-    try:
-        # 1. 提取风格DNA
-        style_dna = await gemini_service.extract_style_dna(request.style_image_url)
-        
-        # 2. 获取复刻提示词
-        replication_prompt = style_dna.get("replication_master_prompt", {})
-        english_prompt = replication_prompt.get("english_prompt", "")
-        
-        if not english_prompt:
-            # 如果没有生成提示词，使用简化版本
-            english_prompt = f"Product photography in the style of reference image, professional e-commerce photo, high quality"
-        
-        # 3. 生成图片
-        result = await nano_banana_service.generate_style_transfer(
-            product_image_url=request.product_image_url,
-            style_prompt=english_prompt,
-            strength=request.strength,
-            aspect_ratio=request.aspect_ratio,
-        )
-        
-        result["style_dna"] = style_dna
-        
-        return {"success": True, "data": result}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # 1. 提取风格DNA（可选：同时分析产品）
+    stages = {"style": gemini_service.extract_style_dna(request.style_image_url)}
+    if request.with_product_analysis:
+        stages["product"] = gemini_service.analyze_product_deep(request.product_image_url)
+    analyses = await gather_stages(stages)
+    style_dna = analyses["style"]
+    
+    # 2. 获取复刻提示词
+    replication_prompt = style_dna.get("replication_master_prompt", {})
+    english_prompt = replication_prompt.get("english_prompt", "")
+    
+    if not english_prompt:
+        # 如果没有生成提示词，使用简化版本
+        english_prompt = f"Product photography in the style of reference image, professional e-commerce photo, high quality"
+    
+    # 3. 生成图片
+    result = await nano_banana_service.generate_style_transfer(
+        product_image_url=request.product_image_url,
+        style_prompt=english_prompt,
+        strength=request.strength,
+        aspect_ratio=request.aspect_ratio,
+    )
+    
+    result["style_dna"] = style_dna
+    if "product" in analyses:
+        result["product_info"] = analyses["product"]
+    
+    return {"success": True, "data": result}
 
 
-@router.post("/batch-quick-transfer")
-async def batch_quick_style_transfer(request: BatchQuickStyleRequest):
+@router.post(
+    "/batch-quick-transfer", response_model=BatchTaskResponse, status_code=status.HTTP_202_ACCEPTED
+)
+async def batch_quick_style_transfer(
+    request: BatchQuickStyleRequest,
+    db: AsyncSession = Depends(get_db),
+    user_id: UUID = Depends(get_current_user_id),
+):
     """批量快速风格迁移
     
-    使用同一风格参考图快速批量处理多个产品
+    使用同一风格参考图快速批量处理多个产品。
+    创建批量任务后立即返回 202；风格DNA在后台只提取一次，随后逐个产品生成。
     """
-    try:
-        # 1. 提取风格DNA（只需一次）
-        style_dna = await gemini_service.extract_style_dna(request.style_image_url)
-        
-        replication_prompt = style_dna.get("replication_master_prompt", {})
-        english_prompt = replication_prompt.get("english_prompt", "")
-        
-        if not english_prompt:
-            english_prompt = f"Product photography in the style of reference image, professional e-commerce photo, high quality"
-        
-        # 2. 批量生成
-        async def on_progress(progress, current, total, image_url, error=None):
-            if request.task_id:
-                await ws_manager.send_progress(
-                    task_id=request.task_id,
-                    data={
-                        "stage": "transferring",
-                        "progress": progress,
-                        "current": current,
-                        "total": total,
-                        "image_url": image_url,
-                        "error": error,
-                    }
-                )
-        
-        results = await nano_banana_service.batch_style_transfer(
-            product_images=request.product_image_urls,
-            style_prompt=english_prompt,
-            strength=request.strength,
-            aspect_ratio=request.aspect_ratio,
-            on_progress=on_progress if request.task_id else None,
-        )
-        
-        return {
-            "success": True, 
-            "data": {
-                "results": results,
-                "style_dna": style_dna,
-            }
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return await create_batch(
+        db,
+        user_id,
+        TaskType.BATCH_QUICK_TRANSFER,
+        input_images={"style_image_url": request.style_image_url},
+        parameters={
+            "strength": request.strength,
+            "aspect_ratio": request.aspect_ratio,
+            "channel": request.task_id,
+        },
+        items=[({"product_image_url": url}, {}) for url in request.product_image_urls],
+    )
 
 
 @router.websocket("/ws/{task_id}")
@@ -3,11 +3,17 @@
 Studio Genesis - AI 驱动的电商详情图生成
 """
 
-from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
 from typing import Optional, List
+from app.api.v1.auth import get_optional_user
+from app.core.config import settings
+from app.core.deadline import with_deadline
 from app.services.gemini_service import gemini_service
+from app.services.image_dedup_service import product_analysis_dedup
+from app.services.genesis_pipeline import genesis_pipeline
 from app.services.nanobana_service import nano_banana_service
+from app.services.principal_cache import Principal
 from app.services.websocket_manager import ws_manager
 
 router = APIRouter(prefix="/studio-genesis", tags=["Studio Genesis"])
@@ -18,6 +24,7 @@ router = APIRouter(prefix="/studio-genesis", tags=["Studio Genesis"])
 class AnalyzeRequest(BaseModel):
     """产品分析请求"""
     image_url: str
+    task_id: Optional[str] = None  # 提供时通过 WebSocket 流式推送分析字段
 
 
 class PlanRequest(BaseModel):
@@ -62,7 +69,10 @@ class MultilingualCopyRequest(BaseModel):
 # ==================== API 端点 ====================
 
 @router.post("/analyze")
-async def analyze_product(request: AnalyzeRequest):
+async def analyze_product(
+    request: AnalyzeRequest,
+    current_user: Optional[Principal] = Depends(get_optional_user),
+):
     """深度产品分析
     
     对产品图片进行360°全方位分析，提取：
@@ -72,12 +82,18 @@ async def analyze_product(request: AnalyzeRequest):
     - 目标用户画像
     - 详情页蓝图建议
     - 风格推荐
+
+    已登录用户再次上传近似的产品图（重新编码、缩放、改名）时，
+    直接复用之前的分析结果，并在 reuse 字段中说明。
+    提供 task_id 时，各字段生成完毕即通过 WebSocket 推送。
     """
-    try:
-        result = await gemini_service.analyze_product_deep(request.image_url)
-        return {"success": True, "data": result}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    on_section = ws_manager.section_relay(request.task_id, "analyzing", expected=6)
+    result, reuse = await product_analysis_dedup.analyze_with_reuse(
+        scope=str(current_user.id) if current_user else None,
+        image_url=request.image_url,
+        analyze=lambda url: gemini_service.analyze_product_deep(url, on_section=on_section),
+    )
+    return {"success": True, "data": result, "reused": reuse is not None, "reuse": reuse}
 
 
 @router.post("/plan")
@@ -89,55 +105,37 @@ async def generate_plan(request: PlanRequest):
     - 图片序列（角色、目的、构图、光影、文案）
     - 质量检查清单
     """
-    try:
-        result = await gemini_service.generate_detail_page_plan(
-            product_analysis=request.product_analysis,
-            count=request.count,
-            platform=request.platform,
-            aspect_ratio=request.aspect_ratio
-        )
-        return {"success": True, "data": result}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    result = await gemini_service.generate_detail_page_plan(
+        product_analysis=request.product_analysis,
+        count=request.count,
+        platform=request.platform,
+        aspect_ratio=request.aspect_ratio
+    )
+    return {"success": True, "data": result}
 
 
 @router.post("/generate")
 async def generate_images(request: GenerateRequest):
     """批量生成详情图
     
-    根据详情页规划批量生成图片，通过 WebSocket 推送进度
+    根据详情页规划批量生成图片，通过 WebSocket 推送进度。
+    每条提示词生成后立即开始生图，两个阶段流水线并行。
+    超过截止时间时返回已完成的图片，partial 为 True。
     """
-    try:
-        # 1. 生成提示词
-        prompts = await gemini_service.generate_image_prompts(
+    async def on_progress(data: dict):
+        await ws_manager.send_progress(task_id=request.task_id, data=data)
+    
+    with with_deadline(settings.BATCH_REQUEST_DEADLINE_SECONDS):
+        results = await genesis_pipeline.run(
             page_plan=request.page_plan,
-            product_info=request.product_info
-        )
-        
-        # 2. 批量生成图片（带进度回调）
-        async def on_progress(progress, current, total, image_url, error=None):
-            await ws_manager.send_progress(
-                task_id=request.task_id,
-                data={
-                    "stage": "generating",
-                    "progress": progress,
-                    "current": current,
-                    "total": total,
-                    "image_url": image_url,
-                    "error": error,
-                }
-            )
-        
-        results = await nano_banana_service.generate_batch_with_progress(
-            prompts=prompts,
+            product_info=request.product_info,
             base_image_url=request.base_image_url,
             aspect_ratio=request.aspect_ratio,
             on_progress=on_progress
         )
-        
-        return {"success": True, "data": results}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    
+    partial = any(r.get("deadline_exceeded") for r in results)
+    return {"success": True, "data": results, "partial": partial}
 
 
 @router.post("/regenerate")
@@ -146,20 +144,17 @@ async def regenerate_image(request: RegenerateRequest):
     
     当某张图片效果不满意时，可以单独重新生成
     """
-    try:
-        result = await nano_banana_service.generate_image(
-            prompt=request.prompt,
-            image_url=request.base_image_url,
-            negative_prompt=request.negative_prompt,
-            aspect_ratio=request.aspect_ratio,
-        )
-        
-        result["order"] = request.order
-        result["role"] = request.role
-        
-        return {"success": True, "data": result}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    result = await nano_banana_service.generate_image(
+        prompt=request.prompt,
+        image_url=request.base_image_url,
+        negative_prompt=request.negative_prompt,
+        aspect_ratio=request.aspect_ratio,
+    )
+    
+    result["order"] = request.order
+    result["role"] = request.role
+    
+    return {"success": True, "data": result}
 
 
 @router.post("/assess-quality")
@@ -174,14 +169,11 @@ async def assess_quality(request: QualityAssessRequest):
     - 商业可用性
     - 转化潜力
     """
-    try:
-        result = await gemini_service.assess_quality(
-            generated_image_url=request.image_url,
-            original_prompt=request.original_prompt
-        )
-        return {"success": True, "data": result}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    result = await gemini_service.assess_quality(
+        generated_image_url=request.image_url,
+        original_prompt=request.original_prompt
+    )
+    return {"success": True, "data": result}
 
 
 @router.post("/multilingual-copy")
@@ -190,14 +182,11 @@ async def generate_multilingual_copy(request: MultilingualCopyRequest):
     
     根据产品信息生成本地化的多语言文案
     """
-    try:
-        result = await gemini_service.generate_multilingual_copy(
-            product_info=request.product_info,
-            target_languages=request.target_languages
-        )
-        return {"success": True, "data": result}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    result = await gemini_service.generate_multilingual_copy(
+        product_info=request.product_info,
+        target_languages=request.target_languages
+    )
+    return {"success": True, "data": result}
 
 
 @router.websocket("/ws/{task_id}")
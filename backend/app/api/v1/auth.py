@@ -3,43 +3,113 @@ from uuid import UUID
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from app.core.database import get_db
+from sqlalchemy import select, update
+from app.core.database import async_session_maker, get_db
+from app.core.replicas import replica_router
 from app.core.security import (
     create_access_token,
-    verify_password,
+    verify_and_update_password,
     get_password_hash,
     verify_token,
 )
 from app.core.config import settings
 from app.models.user import User
+from app.services.principal_cache import Principal, principal_cache
 from app.schemas.user import UserCreate, UserLogin, UserResponse, Token
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_PREFIX}/auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(
+    tokenUrl=f"{settings.API_V1_PREFIX}/auth/login", auto_error=False
+)
 
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: AsyncSession = Depends(get_db),
-) -> User:
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+async def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_db),
+) -> User:
+    """Load the authenticated user as an ORM object.
+
+    Only needed by endpoints that modify the user (e.g. deduct credits);
+    read-only endpoints should use get_current_principal or get_current_user_id.
+    """
     user_id = verify_token(token)
     if user_id is None:
-        raise credentials_exception
+        raise _credentials_exception()
 
     result = await db.execute(select(User).where(User.id == UUID(user_id)))
     user = result.scalar_one_or_none()
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
+    await principal_cache.put(user)
     return user
 
 
+async def _resolve_principal(user_id: str) -> Principal | None:
+    """Principal from the cache; a session is only opened on a miss.
+
+    Misses read a replica and fall back to the primary when the replica does
+    not have the user yet, e.g. right after registering.
+    """
+    principal = await principal_cache.get(user_id)
+    if principal is not None:
+        return principal
+    async with replica_router.session(user_id) as db:
+        principal = await principal_cache.load(user_id, db)
+    if principal is None and replica_router.enabled:
+        async with async_session_maker() as db:
+            principal = await principal_cache.load(user_id, db)
+    return principal
+
+
+async def get_current_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    """Resolve the authenticated user through the principal cache (replica on a miss)."""
+    user_id = verify_token(token)
+    if user_id is None:
+        raise _credentials_exception()
+
+    principal = await _resolve_principal(user_id)
+    if principal is None:
+        raise _credentials_exception()
+    return principal
+
+
+async def get_current_user_id(
+    principal: Principal = Depends(get_current_principal),
+) -> UUID:
+    """The authenticated user's id, without loading the ORM user on cache hits."""
+    return principal.id
+
+
+async def get_read_db(
+    user_id: UUID = Depends(get_current_user_id),
+) -> AsyncSession:
+    """Read-only session for the current user: a replica, or the primary right after they wrote."""
+    async with replica_router.session(user_id) as session:
+        yield session
+
+
+async def get_optional_user(
+    token: str | None = Depends(optional_oauth2_scheme),
+) -> Principal | None:
+    """Resolve the user when a valid token is present, otherwise None."""
+    if not token:
+        return None
+    user_id = verify_token(token)
+    if user_id is None:
+        return None
+    return await _resolve_principal(user_id)
+
+
 @router.post("/register", response_model=UserResponse)
 async def register(user_in: UserCreate, db: AsyncSession = Depends(get_db)):
     # Check if user exists
@@ -53,25 +123,49 @@ async def register(user_in: UserCreate, db: AsyncSession = Depends(get_db)):
     # Create user
     user = User(
         email=user_in.email,
-        password_hash=get_password_hash(user_in.password),
+        password_hash=await get_password_hash(user_in.password),
         name=user_in.name,
         credits=settings.DEFAULT_CREDITS,
     )
     db.add(user)
     await db.commit()
+    # Replicas may not have the new user yet: read the primary for a while
+    await replica_router.mark_write(user.id)
     await db.refresh(user)
     return user
 
 
+async def authenticate(email: str, password: str, db: AsyncSession) -> User | None:
+    """Check credentials; rehash the stored password when the bcrypt cost changed.
+
+    The lookup goes to a replica and falls back to the primary (db) when the user
+    is not there yet, e.g. logging in right after registering.
+    """
+    async with replica_router.session() as read_db:
+        result = await read_db.execute(select(User).where(User.email == email))
+        user = result.scalar_one_or_none()
+    if user is None and replica_router.enabled:
+        result = await db.execute(select(User).where(User.email == email))
+        user = result.scalar_one_or_none()
+    if not user:
+        return None
+
+    verified, new_hash = await verify_and_update_password(password, user.password_hash)
+    if not verified:
+        return None
+    if new_hash:
+        await db.execute(update(User).where(User.id == user.id).values(password_hash=new_hash))
+        await db.commit()
+    return user
+
+
 @router.post("/login", response_model=Token)
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: AsyncSession = Depends(get_db),
 ):
-    result = await db.execute(select(User).where(User.email == form_data.username))
-    user = result.scalar_one_or_none()
-
-    if not user or not verify_password(form_data.password, user.password_hash):
+    user = await authenticate(form_data.username, form_data.password, db)
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -84,10 +178,8 @@ async def login(
 
 @router.post("/login/json", response_model=Token)
 async def login_json(user_in: UserLogin, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(User).where(User.email == user_in.email))
-    user = result.scalar_one_or_none()
-
-    if not user or not verify_password(user_in.password, user.password_hash):
+    user = await authenticate(user_in.email, user_in.password, db)
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -98,5 +190,5 @@ async def login_json(user_in: UserLogin, db: AsyncSession = Depends(get_db)):
 
 
 @router.get("/me", response_model=UserResponse)
-async def get_me(current_user: User = Depends(get_current_user)):
-    return current_user
+async def get_me(principal: Principal = Depends(get_current_principal)):
+    return principal
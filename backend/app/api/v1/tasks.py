@@ -1,97 +1,531 @@
+import base64
+import uuid
 from uuid import UUID
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
+from fastapi import (
+    APIRouter, Depends, Header, HTTPException, Query, Response, status, WebSocket, WebSocketDisconnect,
+)
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import func, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
 from app.core.database import get_db
-from app.models.task import Task, TaskStatus, TaskType
-from app.models.user import User
-from app.schemas.task import TaskResponse, GenesisRequest, MirrorRequest
-from app.api.v1.auth import get_current_user
+from app.models.task import Task, TaskArtifact, TaskStatus, TaskType
+from app.schemas.task import (
+    TaskResponse, BatchTaskResponse, TaskPage, TaskSummary, TaskStatusRequest, TaskStatusItem,
+    GenesisRequest, MirrorRequest,
+)
+from app.api.v1.auth import get_current_user_id, get_read_db
 from app.services.websocket_manager import ws_manager
 from app.services.gemini_service import gemini_service
 from app.services.nanobana_service import nano_banana_service
+from app.services.image_dedup_service import product_analysis_dedup
+from app.services.credit_ledger import InsufficientCredits, credit_ledger, task_cost
+from app.services.principal_cache import principal_cache
+from app.services.task_archive import task_archive
+from app.services.task_runner import task_runner
+from app.services.task_checkpoints import TaskCheckpoints
+from app.services.upstream import UpstreamError
 from app.core.config import settings
+from app.core.concurrency import gather_bounded, gather_stages, run_two_stage_pipeline
+from app.core.deadline import DeadlineExceeded, expired, with_deadline
+from app.core.replicas import replica_router
 import asyncio
 
 router = APIRouter(prefix="/tasks", tags=["tasks"])
 
+MIRROR_IMAGE_COUNT = 4
+
+
+def _encode_cursor(created_at: datetime, task_id: UUID) -> str:
+    raw = f"{created_at.isoformat()}|{task_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, task_id = raw.split("|")
+        return datetime.fromisoformat(created_at), UUID(task_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/history", response_model=TaskPage)
+async def task_history(
+    db: AsyncSession = Depends(get_read_db),
+    user_id: UUID = Depends(get_current_user_id),
+    cursor: str | None = None,
+    limit: int = Query(20, ge=1, le=100),
+    task_type: TaskType | None = Query(None, alias="type"),
+    task_status: TaskStatus | None = Query(None, alias="status"),
+):
+    """Task history, newest first, paginated by an opaque cursor.
+
+    Seeks on (user_id, created_at, id) so every page costs the same however deep
+    it is; the cover URL and image count come from task_artifacts, not payloads.
+    Batch children are listed under their batch, not here.
+    """
+    cover_url = (
+        select(TaskArtifact.url)
+        .where(TaskArtifact.task_id == Task.id)
+        .order_by(TaskArtifact.position)
+        .limit(1)
+        .scalar_subquery()
+    )
+    image_count = (
+        select(func.count())
+        .select_from(TaskArtifact)
+        .where(TaskArtifact.task_id == Task.id)
+        .scalar_subquery()
+    )
+    query = (
+        select(
+            Task.id,
+            Task.type,
+            Task.status,
+            Task.progress,
+            cover_url.label("cover_url"),
+            image_count.label("image_count"),
+            func.coalesce(
+                Task.parameters["count"].as_integer(), MIRROR_IMAGE_COUNT
+            ).label("requested_count"),
+            Task.credits_used,
+            Task.created_at,
+            Task.completed_at,
+        )
+        .where(Task.user_id == user_id, Task.parent_id.is_(None))
+        .order_by(Task.created_at.desc(), Task.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        query = query.where(tuple_(Task.created_at, Task.id) < tuple_(*_decode_cursor(cursor)))
+    if task_type:
+        query = query.where(Task.type == task_type.value)
+    if task_status:
+        query = query.where(Task.status == task_status.value)
+
+    rows = (await db.execute(query)).all()
+    items = [TaskSummary.model_validate(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = _encode_cursor(last.created_at, last.id)
+    return TaskPage(items=items, next_cursor=next_cursor)
+
+
+def requested_images(task: Task) -> int:
+    """Images (or batch items) the task's credits were reserved for."""
+    return (task.parameters or {}).get("count") or MIRROR_IMAGE_COUNT
+
+
+def output_images(parameters: dict | None, artifacts: dict[int, str]) -> dict | None:
+    """Positional output_images: one slot per requested image, None where none was delivered."""
+    if not artifacts:
+        return None
+    count = max((parameters or {}).get("count") or MIRROR_IMAGE_COUNT, max(artifacts) + 1)
+    return {"images": [artifacts.get(position) for position in range(count)]}
+
+
+async def task_responses(db: AsyncSession, tasks: list[Task]) -> list[TaskResponse]:
+    """Rebuild TaskResponse for narrow task rows: output_images comes from task_artifacts."""
+    artifacts: dict[UUID, dict[int, str]] = {}
+    if tasks:
+        result = await db.execute(
+            select(TaskArtifact.task_id, TaskArtifact.position, TaskArtifact.url)
+            .where(TaskArtifact.task_id.in_([task.id for task in tasks]))
+        )
+        for task_id, position, url in result:
+            artifacts.setdefault(task_id, {})[position] = url
+    return [
+        TaskResponse.model_validate(task).model_copy(
+            update={"output_images": output_images(task.parameters, artifacts.get(task.id, {}))}
+        )
+        for task in tasks
+    ]
+
+
+def _task_version(updated_at: datetime | None) -> str:
+    """Opaque version derived from updated_at (microsecond resolution)."""
+    return format(int(updated_at.timestamp() * 1_000_000), "x") if updated_at else "0"
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+@router.post("/status", response_model=list[TaskStatusItem])
+async def tasks_status(
+    request: TaskStatusRequest,
+    db: AsyncSession = Depends(get_read_db),
+    user_id: UUID = Depends(get_current_user_id),
+):
+    """Status, progress and version of many tasks in one query; unknown ids are omitted."""
+    result = await db.execute(
+        select(Task.id, Task.status, Task.progress, Task.updated_at)
+        .where(Task.id.in_(set(request.task_ids)), Task.user_id == user_id)
+    )
+    return [
+        TaskStatusItem(
+            id=row.id,
+            status=row.status,
+            progress=row.progress,
+            version=_task_version(row.updated_at),
+        )
+        for row in result
+    ]
+
 
 @router.get("/{task_id}", response_model=TaskResponse)
 async def get_task(
+    task_id: UUID,
+    response: Response,
+    db: AsyncSession = Depends(get_read_db),
+    user_id: UUID = Depends(get_current_user_id),
+    if_none_match: str | None = Header(None),
+):
+    """Full task; answers 304 when If-None-Match carries the current ETag."""
+    result = await db.execute(
+        select(Task.updated_at).where(Task.id == task_id, Task.user_id == user_id)
+    )
+    updated_at = result.one_or_none()
+    if updated_at is None:
+        # Old finished tasks are moved to cold storage; read them from there
+        archived = await task_archive.restore(db, task_id, user_id)
+        if archived is None:
+            raise HTTPException(status_code=404, detail="Task not found")
+        artifacts = {artifact["position"]: artifact["url"] for artifact in archived["artifacts"]}
+        return TaskResponse.model_validate({
+            **archived["task"],
+            "output_images": output_images(archived["task"].get("parameters"), artifacts),
+            "archived": True,
+        })
+    etag = f'"{_task_version(updated_at[0])}"'
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    result = await db.execute(select(Task).where(Task.id == task_id))
+    task = result.scalar_one_or_none()
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    response.headers["ETag"] = f'"{_task_version(task.updated_at)}"'
+    return (await task_responses(db, [task]))[0]
+
+
+@router.post("/{task_id}/cancel", response_model=TaskResponse, status_code=status.HTTP_202_ACCEPTED)
+async def cancel_task(
     task_id: UUID,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    user_id: UUID = Depends(get_current_user_id),
 ):
+    """Cancel a running task; in-flight generations are aborted and unused credits refunded."""
     result = await db.execute(
-        select(Task).where(Task.id == task_id, Task.user_id == current_user.id)
+        select(Task).where(Task.id == task_id, Task.user_id == user_id)
     )
     task = result.scalar_one_or_none()
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
-    return task
+    if task.parent_id is not None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Cancel the batch instead")
+    if task.status not in (TaskStatus.PENDING.value, TaskStatus.PROCESSING.value):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Task is not running")
+
+    if not await task_runner.cancel(str(task_id), reason="user"):
+        # No worker owns the task (never started, or its worker is gone): settle it here
+        await settle_cancelled(str(task_id), str(user_id), "Cancelled (user)", db)
+        await db.refresh(task)
+    return (await task_responses(db, [task]))[0]
+
+
+@router.post("/{task_id}/resume", response_model=TaskResponse, status_code=status.HTTP_202_ACCEPTED)
+async def resume_task(
+    task_id: UUID,
+    db: AsyncSession = Depends(get_db),
+    user_id: UUID = Depends(get_current_user_id),
+):
+    """Resume a failed task from its checkpoints; finished steps are not re-run or re-charged."""
+    result = await db.execute(
+        select(Task).where(Task.id == task_id, Task.user_id == user_id)
+    )
+    task = result.scalar_one_or_none()
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task.parent_id is not None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Resume the batch instead")
+    if task.status != TaskStatus.FAILED.value or task_runner.is_running(str(task_id)):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Only failed tasks can be resumed")
+
+    # Re-reserve the credits refunded when the task failed
+    try:
+        reserved = await credit_ledger.reserve_remaining(db, task)
+    except InsufficientCredits:
+        raise HTTPException(
+            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+            detail="Insufficient credits",
+        )
+    task.status = TaskStatus.PENDING.value
+    task.error_message = None
+    await db.commit()
+    await replica_router.mark_write(user_id)
+    await db.refresh(task)
+    if reserved:
+        await principal_cache.invalidate(user_id)
+
+    start_task(task)
+    return (await task_responses(db, [task]))[0]
 
 
 @router.get("/", response_model=list[TaskResponse])
 async def list_tasks(
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db),
+    user_id: UUID = Depends(get_current_user_id),
     limit: int = 20,
     offset: int = 0,
 ):
+    """Full task rows by offset; prefer /tasks/history for the history view."""
     result = await db.execute(
         select(Task)
-        .where(Task.user_id == current_user.id)
-        .order_by(Task.created_at.desc())
+        .where(Task.user_id == user_id, Task.parent_id.is_(None))
+        .order_by(Task.created_at.desc(), Task.id.desc())
         .limit(limit)
         .offset(offset)
     )
-    return result.scalars().all()
+    return await task_responses(db, list(result.scalars()))
+
+
+@router.get("/{task_id}/children", response_model=list[TaskResponse])
+async def list_children(
+    task_id: UUID,
+    db: AsyncSession = Depends(get_read_db),
+    user_id: UUID = Depends(get_current_user_id),
+):
+    """Per-product tasks of a batch, in input order."""
+    result = await db.execute(
+        select(Task)
+        .where(Task.parent_id == task_id, Task.user_id == user_id)
+        .order_by(Task.parameters["index"].as_integer())
+    )
+    return await task_responses(db, list(result.scalars()))
 
 
 @router.websocket("/ws/{task_id}")
 async def websocket_endpoint(websocket: WebSocket, task_id: str):
     await ws_manager.connect(task_id, websocket)
+    task_runner.watcher_joined(task_id)
     try:
         while True:
             # Keep connection alive
             await websocket.receive_text()
     except WebSocketDisconnect:
         ws_manager.disconnect(task_id, websocket)
+        if not ws_manager.active_connections.get(task_id):
+            task_runner.watchers_left(task_id)
+
+
+# 未完成结束时推送给前端的提示
+_UNFINISHED_MESSAGES = {
+    TaskStatus.PARTIAL_COMPLETED: "已超时",
+    TaskStatus.CANCELLED: "已取消",
+}
+
+
+async def settle_unfinished(
+    task_id: str,
+    user_id: str,
+    images: list,
+    status: TaskStatus,
+    reason: str,
+    db: AsyncSession,
+):
+    """任务未全部完成就结束（超时或取消）：保存已完成的图片，按未交付的比例退还积分"""
+    # 取消可能发生在任意一次数据库操作中途
+    await db.rollback()
+    delivered = [url for url in images if url]
+    result = await db.execute(select(Task).where(Task.id == UUID(task_id)))
+    task = result.scalar_one()
+    requested = requested_images(task)
+    refund = await credit_ledger.refund_undelivered(db, task, len(delivered), requested, reason)
+    task.status = status.value
+    if status == TaskStatus.PARTIAL_COMPLETED:
+        task.progress = 100
+    task.error_message = f"{reason}: {len(delivered)}/{requested} images generated"
+    task.completed_at = datetime.utcnow()
+    await db.commit()
+    await replica_router.mark_write(user_id)
+    if refund:
+        await principal_cache.invalidate(user_id)
+
+    await ws_manager.send_progress(task_id, {
+        "status": status.value,
+        "progress": task.progress,
+        "message": f"{_UNFINISHED_MESSAGES[status]}，完成 {len(delivered)}/{requested} 张",
+        "output_images": images,
+        "credits_refunded": refund,
+    })
+
+
+async def mark_failed(
+    task_id: str, user_id: str, images: list, error: str, db: AsyncSession, retry: bool = False
+):
+    """标记任务失败并退还未交付部分的积分；已完成步骤保留在检查点中，可通过 resume 继续
+
+    retry 为 True 且运行器还会自动重试时，任务保持处理中、积分不退，只推送 retrying 状态
+    """
+    await db.rollback()
+    result = await db.execute(select(Task).where(Task.id == UUID(task_id)))
+    task = result.scalar_one()
+    delay = task_runner.retry_delay(task_id) if retry else None
+    if delay is not None:
+        task.error_message = error
+        await db.commit()
+        await ws_manager.send_progress(task_id, {
+            "status": "retrying",
+            "progress": task.progress,
+            "message": f"生成失败，{int(delay)} 秒后自动重试: {error}",
+            "output_images": images,
+            "retry_in": delay,
+        })
+        return
+
+    # Settled against the reserved count, like every other exit path
+    delivered = sum(1 for url in images if url)
+    refund = await credit_ledger.refund_undelivered(
+        db, task, delivered, requested_images(task), f"Failed: {error}"
+    )
+    task.status = TaskStatus.FAILED.value
+    task.error_message = error
+    await db.commit()
+    await replica_router.mark_write(user_id)
+    if refund:
+        await principal_cache.invalidate(user_id)
+
+    await ws_manager.send_progress(task_id, {
+        "status": "failed",
+        "progress": 0,
+        "message": f"生成失败: {error}",
+        "output_images": images,
+        "credits_refunded": refund,
+    })
+
+
+def _resumable(error: Exception) -> bool:
+    return not isinstance(error, UpstreamError) or error.retryable
+
+
+async def generate_missing_images(
+    task_id: str,
+    checkpoints: TaskCheckpoints,
+    prompts: list[str],
+    base_image_url: str,
+    start: int,
+    message: str,
+    role: str | None = None,
+) -> list:
+    """只为还没有产物的序号生成图片，每张完成即写入 task_artifacts"""
+    images = checkpoints.images(len(prompts))
+    pending = [i for i, url in enumerate(images) if not url]
+    if not pending:
+        return images
+
+    async def on_progress(
+        progress: int, current: int, total: int, image_url: str, result: dict, elapsed: float
+    ):
+        index = pending[current - 1]
+        images[index] = image_url
+        done = sum(1 for url in images if url)
+        overall_progress = start + int((100 - start) * done / len(images))
+        # Persisted with the checkpoint so polling clients (POST /tasks/status) see it too
+        await checkpoints.db.execute(
+            update(Task).where(Task.id == UUID(task_id)).values(progress=overall_progress)
+        )
+        await checkpoints.save_image(
+            index,
+            image_url,
+            role=role,
+            width=result.get("width"),
+            height=result.get("height"),
+            seconds=round(elapsed, 3),
+        )
+        await ws_manager.send_progress(task_id, {
+            "status": "processing",
+            "progress": overall_progress,
+            "message": f"{message} {done}/{len(images)}...",
+            "output_images": [url for url in images if url],
+        })
+
+    await nano_banana_service.generate_batch(
+        prompts=[prompts[i] for i in pending],
+        base_image_url=base_image_url,
+        on_progress=on_progress,
+    )
+    return images
 
 
 async def run_genesis_task(
     task_id: str,
+    user_id: str,
     image_url: str,
     count: int,
     style: str,
     db: AsyncSession,
-):
-    """Background task for Studio Genesis."""
+) -> bool:
+    """Background task for Studio Genesis.
+
+    Every step is checkpointed, so a resumed or retried run only redoes the
+    missing steps. Returns False when the task failed but can be resumed.
+    """
+    checkpoints = TaskCheckpoints(db, task_id)
     try:
         # Update status to processing
         result = await db.execute(select(Task).where(Task.id == UUID(task_id)))
         task = result.scalar_one()
         task.status = TaskStatus.PROCESSING.value
+        # A retry first re-reserves the share refunded when the last attempt failed
+        reserved = await credit_ledger.reserve_remaining(db, task)
         await db.commit()
+        await replica_router.mark_write(user_id)
+        if reserved:
+            await principal_cache.invalidate(user_id)
+        await checkpoints.load()
 
         await ws_manager.send_progress(task_id, {
             "status": "processing",
             "progress": 5,
             "message": "分析产品图片...",
+            "resumed_steps": sorted(checkpoints.steps),
         })
 
-        # Step 1: Analyze product
-        product_info = await gemini_service.analyze_product(image_url)
+        # Step 1: Analyze product (reuse a near-duplicate analysis when possible)
+        # Sections are pushed over the task channel as they stream in
+        product_info = checkpoints.get("analysis")
+        reuse = None
+        if product_info is None:
+            on_section = ws_manager.section_relay(
+                task_id, "analysis", expected=6, start=5, end=20, status="processing"
+            )
+            product_info, reuse = await product_analysis_dedup.analyze_with_reuse(
+                user_id,
+                image_url,
+                lambda url: gemini_service.analyze_product(url, on_section=on_section),
+            )
+            await checkpoints.save("analysis", product_info)
 
         await ws_manager.send_progress(task_id, {
             "status": "processing",
             "progress": 20,
             "message": "生成创意文案...",
+            "analysis_reused": reuse is not None,
         })
 
         # Step 2: Generate prompts
-        prompts = await gemini_service.generate_copywriting(product_info, style, count)
+        saved_prompts = checkpoints.get("prompts")
+        if saved_prompts is None:
+            prompts = await gemini_service.generate_copywriting(product_info, style, count)
+            await checkpoints.save("prompts", {"prompts": prompts})
+        else:
+            prompts = saved_prompts["prompts"]
 
         await ws_manager.send_progress(task_id, {
             "status": "processing",
@@ -99,223 +533,671 @@ async def run_genesis_task(
             "message": "开始生成图片...",
         })
 
-        # Step 3: Generate images
-        output_images = []
-
-        async def on_image_progress(progress: int, current: int, total: int, image_url: str):
-            output_images.append(image_url)
-            overall_progress = 30 + int(progress * 0.7)
-            await ws_manager.send_progress(task_id, {
-                "status": "processing",
-                "progress": overall_progress,
-                "message": f"生成图片 {current}/{total}...",
-                "output_images": output_images,
-            })
-
-        generated_images = await nano_banana_service.generate_batch(
-            prompts=prompts,
-            base_image_url=image_url,
-            on_progress=on_image_progress,
+        # Step 3: Generate the images that are not checkpointed yet
+        images = await generate_missing_images(
+            task_id, checkpoints, prompts, image_url, start=30, message="生成图片"
         )
 
+        if expired() and not all(images):
+            await settle_unfinished(
+                task_id, user_id, images,
+                TaskStatus.PARTIAL_COMPLETED, "Deadline exceeded", db,
+            )
+            return True
+        if not all(images):
+            missing = sum(1 for url in images if not url)
+            await mark_failed(
+                task_id, user_id, images, f"{missing} of {len(images)} images failed", db, retry=True
+            )
+            return False
+
         # Update task
         task.status = TaskStatus.COMPLETED.value
         task.progress = 100
-        task.output_images = {"images": generated_images}
+        task.error_message = None
         task.completed_at = datetime.utcnow()
         await db.commit()
+        await replica_router.mark_write(user_id)
 
         await ws_manager.send_progress(task_id, {
             "status": "completed",
             "progress": 100,
             "message": "生成完成！",
-            "output_images": generated_images,
-        })
-
-    except Exception as e:
-        result = await db.execute(select(Task).where(Task.id == UUID(task_id)))
-        task = result.scalar_one()
-        task.status = TaskStatus.FAILED.value
-        task.error_message = str(e)
-        await db.commit()
-
-        await ws_manager.send_progress(task_id, {
-            "status": "failed",
-            "progress": 0,
-            "message": f"生成失败: {str(e)}",
+            "output_images": images,
         })
+        return True
 
-
-@router.post("/studio-genesis", response_model=TaskResponse)
-async def create_genesis_task(
-    request: GenesisRequest,
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
-):
-    # Check credits
-    cost = settings.CREDIT_COST_GENESIS
-    if current_user.credits < cost:
-        raise HTTPException(
-            status_code=status.HTTP_402_PAYMENT_REQUIRED,
-            detail="Insufficient credits",
+    except asyncio.CancelledError:
+        # Aborts in-flight upstream calls; only finished images are charged
+        await settle_unfinished(
+            task_id, user_id, checkpoints.images(count),
+            TaskStatus.CANCELLED, f"Cancelled ({task_runner.cancel_reason(task_id)})", db,
         )
-
-    # Deduct credits
-    current_user.credits -= cost
-    await db.commit()
-
-    # Create task
-    task = Task(
-        user_id=current_user.id,
-        type=TaskType.GENESIS.value,
-        status=TaskStatus.PENDING.value,
-        input_images={"image_url": request.image_url},
-        parameters={"count": request.count, "style": request.style},
-        credits_used=cost,
-    )
-    db.add(task)
-    await db.commit()
-    await db.refresh(task)
-
-    # Start background task
-    asyncio.create_task(
-        run_genesis_task(
-            str(task.id),
-            request.image_url,
-            request.count,
-            request.style,
-            db,
+        raise
+    except DeadlineExceeded:
+        await settle_unfinished(
+            task_id, user_id, checkpoints.images(count),
+            TaskStatus.PARTIAL_COMPLETED, "Deadline exceeded", db,
         )
-    )
-
-    return task
+        return True
+    except InsufficientCredits:
+        await mark_failed(task_id, user_id, checkpoints.images(count), "Insufficient credits", db)
+        return True
+    except Exception as e:
+        await mark_failed(task_id, user_id, checkpoints.images(count), str(e), db, retry=_resumable(e))
+        return not _resumable(e)
 
 
 async def run_mirror_task(
     task_id: str,
+    user_id: str,
     product_image_url: str,
     style_image_url: str,
     db: AsyncSession,
-):
-    """Background task for Aesthetic Mirror."""
+) -> bool:
+    """Background task for Aesthetic Mirror.
+
+    Checkpointed like run_genesis_task; returns False when the task failed
+    but can be resumed.
+    """
+    checkpoints = TaskCheckpoints(db, task_id)
     try:
         result = await db.execute(select(Task).where(Task.id == UUID(task_id)))
         task = result.scalar_one()
         task.status = TaskStatus.PROCESSING.value
+        # A retry first re-reserves the share refunded when the last attempt failed
+        reserved = await credit_ledger.reserve_remaining(db, task)
         await db.commit()
+        await replica_router.mark_write(user_id)
+        if reserved:
+            await principal_cache.invalidate(user_id)
+        await checkpoints.load()
 
         await ws_manager.send_progress(task_id, {
             "status": "processing",
             "progress": 10,
-            "message": "提取配色方案...",
+            "message": "提取风格与分析产品...",
+            "resumed_steps": sorted(checkpoints.steps),
         })
 
-        # Extract style
-        style_info = await gemini_service.extract_style(style_image_url)
-
-        await ws_manager.send_progress(task_id, {
-            "status": "processing",
-            "progress": 25,
-            "message": "分析布局结构...",
-        })
+        # Style extraction and product analysis are independent: run them together.
+        # Both section streams share one relay over 10-30, so progress never goes back
+        relay = ws_manager.section_relay(
+            task_id, "analysis", expected=14, start=10, end=30, status="processing"
+        )
+        stage_messages = {
+            "style": "风格提取完成",
+            "product": "产品分析完成",
+        }
 
-        # Analyze product
-        product_info = await gemini_service.analyze_product(product_image_url)
+        async def on_stage_done(name: str, stage_result, finished: int):
+            data = stage_result if name == "style" else stage_result[0]
+            await checkpoints.save(name, data)
+            await ws_manager.send_progress(task_id, {
+                "status": "processing",
+                "progress": 30 if finished == len(stages) else relay.progress,
+                "message": stage_messages[name],
+                "stage": name,
+            })
 
-        await ws_manager.send_progress(task_id, {
-            "status": "processing",
-            "progress": 50,
-            "message": "识别装饰元素...",
-        })
+        stages = {}
+        if checkpoints.get("style") is None:
+            stages["style"] = gemini_service.extract_style(
+                style_image_url,
+                on_section=lambda section, value: relay(section, value, stage="style"),
+            )
+        if checkpoints.get("product") is None:
+            stages["product"] = product_analysis_dedup.analyze_with_reuse(
+                user_id,
+                product_image_url,
+                lambda url: gemini_service.analyze_product(
+                    url,
+                    on_section=lambda section, value: relay(section, value, stage="product"),
+                ),
+            )
+        await gather_stages(stages, on_stage_done=on_stage_done)
+        style_info = checkpoints.get("style")
 
         # Generate 4 images with style transfer
         prompts = [
             f"Product photography, {style_info}, professional e-commerce image, variant {i + 1}"
-            for i in range(4)
+            for i in range(MIRROR_IMAGE_COUNT)
         ]
 
-        output_images = []
-
-        async def on_progress(progress: int, current: int, total: int, image_url: str):
-            output_images.append(image_url)
-            overall_progress = 50 + int(progress * 0.5)
-            await ws_manager.send_progress(task_id, {
-                "status": "processing",
-                "progress": overall_progress,
-                "message": f"生成新图片 {current}/{total}...",
-                "output_images": output_images,
-            })
-
-        generated_images = await nano_banana_service.generate_batch(
-            prompts=prompts,
-            base_image_url=product_image_url,
-            on_progress=on_progress,
+        images = await generate_missing_images(
+            task_id, checkpoints, prompts, product_image_url,
+            start=50, message="生成新图片", role="style_variant",
         )
 
+        if expired() and not all(images):
+            await settle_unfinished(
+                task_id, user_id, images,
+                TaskStatus.PARTIAL_COMPLETED, "Deadline exceeded", db,
+            )
+            return True
+        if not all(images):
+            missing = sum(1 for url in images if not url)
+            await mark_failed(
+                task_id, user_id, images, f"{missing} of {len(images)} images failed", db, retry=True
+            )
+            return False
+
         task.status = TaskStatus.COMPLETED.value
         task.progress = 100
-        task.output_images = {"images": generated_images}
+        task.error_message = None
         task.completed_at = datetime.utcnow()
         await db.commit()
+        await replica_router.mark_write(user_id)
 
         await ws_manager.send_progress(task_id, {
             "status": "completed",
             "progress": 100,
             "message": "风格复刻完成！",
-            "output_images": generated_images,
+            "output_images": images,
         })
+        return True
 
+    except asyncio.CancelledError:
+        await settle_unfinished(
+            task_id, user_id, checkpoints.images(MIRROR_IMAGE_COUNT),
+            TaskStatus.CANCELLED, f"Cancelled ({task_runner.cancel_reason(task_id)})", db,
+        )
+        raise
+    except DeadlineExceeded:
+        await settle_unfinished(
+            task_id, user_id, checkpoints.images(MIRROR_IMAGE_COUNT),
+            TaskStatus.PARTIAL_COMPLETED, "Deadline exceeded", db,
+        )
+        return True
+    except InsufficientCredits:
+        await mark_failed(
+            task_id, user_id, checkpoints.images(MIRROR_IMAGE_COUNT), "Insufficient credits", db
+        )
+        return True
     except Exception as e:
+        await mark_failed(
+            task_id, user_id, checkpoints.images(MIRROR_IMAGE_COUNT), str(e), db, retry=_resumable(e)
+        )
+        return not _resumable(e)
+
+
+BATCH_TASK_TYPES = (TaskType.BATCH_FUSE.value, TaskType.BATCH_QUICK_TRANSFER.value)
+
+DEFAULT_STYLE_PROMPT = (
+    "Product photography in the style of reference image, professional e-commerce photo, high quality"
+)
+
+# 批量任务结束时推送给前端的提示
+_BATCH_MESSAGES = {
+    TaskStatus.COMPLETED: "批量处理完成！",
+    TaskStatus.PARTIAL_COMPLETED: "已超时",
+    TaskStatus.CANCELLED: "已取消",
+    TaskStatus.FAILED: "部分处理失败",
+}
+
+
+def _batch_channels(task: Task) -> list[str]:
+    """WebSocket channels of a batch: its id, plus the client-chosen id when one was given."""
+    channel = (task.parameters or {}).get("channel")
+    return [str(task.id)] + ([channel] if channel else [])
+
+
+def _batch_artifact(task_id: UUID, position: int, result: dict):
+    stmt = insert(TaskArtifact).values(
+        task_id=task_id,
+        position=position,
+        role="batch_item",
+        url=result["url"],
+        width=result.get("width"),
+        height=result.get("height"),
+    )
+    return stmt.on_conflict_do_nothing(index_elements=[TaskArtifact.task_id, TaskArtifact.position])
+
+
+async def settle_batch(
+    task_id: str,
+    user_id: str,
+    status: TaskStatus,
+    error: str | None,
+    db: AsyncSession,
+    retry: bool = False,
+):
+    """结束批量任务：仍在等待或处理中的子任务随之结束（超时记为失败），推送汇总结果
+
+    output_images 按子任务序号排列，未完成的位置为 None。
+    失败且运行器还会自动重试时（retry 为 True），批量任务保持处理中，只推送 retrying 状态。
+    """
+    await db.rollback()
+    delay = task_runner.retry_delay(task_id) if retry and status == TaskStatus.FAILED else None
+    if delay is not None:
         result = await db.execute(select(Task).where(Task.id == UUID(task_id)))
         task = result.scalar_one()
-        task.status = TaskStatus.FAILED.value
-        task.error_message = str(e)
+        task.error_message = error
         await db.commit()
+        for channel in _batch_channels(task):
+            await ws_manager.send_progress(channel, {
+                "status": "retrying",
+                "progress": task.progress,
+                "message": f"{error}，{int(delay)} 秒后自动重试",
+                "retry_in": delay,
+            })
+        return
 
-        await ws_manager.send_progress(task_id, {
-            "status": "failed",
-            "progress": 0,
-            "message": f"生成失败: {str(e)}",
+    if status != TaskStatus.COMPLETED:
+        child_status = TaskStatus.FAILED if status == TaskStatus.PARTIAL_COMPLETED else status
+        await db.execute(
+            update(Task)
+            .where(
+                Task.parent_id == UUID(task_id),
+                Task.status.in_([TaskStatus.PENDING.value, TaskStatus.PROCESSING.value]),
+            )
+            .values(status=child_status.value, error_message=error)
+        )
+    result = await db.execute(select(Task).where(Task.id == UUID(task_id)))
+    task = result.scalar_one()
+    task.status = status.value
+    task.error_message = error
+    if status in (TaskStatus.COMPLETED, TaskStatus.PARTIAL_COMPLETED):
+        task.progress = 100
+    if status != TaskStatus.FAILED:
+        task.completed_at = datetime.utcnow()
+    await db.commit()
+    await replica_router.mark_write(user_id)
+
+    result = await db.execute(
+        select(TaskArtifact.position, TaskArtifact.url).where(TaskArtifact.task_id == task.id)
+    )
+    artifacts = dict(result.all())
+    data = {
+        "status": status.value,
+        "progress": task.progress,
+        "message": f"{_BATCH_MESSAGES[status]}，完成 {len(artifacts)}/{task.parameters['count']} 个",
+        "output_images": (output_images(task.parameters, artifacts) or {"images": []})["images"],
+    }
+    for channel in _batch_channels(task):
+        await ws_manager.send_progress(channel, data)
+
+
+async def _fuse_children(params: dict, children: list[Task], on_child_done) -> None:
+    """Batch fusion: fusion prompts and renders run as a two-stage pipeline."""
+    style_dna = params["style_dna"]
+    # The style DNA is the same for the whole batch: serialize it once
+    style_dna_json = gemini_service.serialize_style_dna(style_dna)
+
+    async def fuse_prompt(child: Task) -> dict:
+        return await gemini_service.fuse_style_with_product(
+            style_dna=style_dna,
+            product_info=child.parameters.get("info", {}),
+            product_image_url=child.input_images["product_image_url"],
+            style_dna_json=style_dna_json,
+        )
+
+    async def render(child: Task, fusion_data: dict) -> dict:
+        fusion_prompt = fusion_data.get("fusion_prompt", {})
+        gen_params = fusion_prompt.get("generation_params", {})
+        return await nano_banana_service.generate_style_transfer(
+            product_image_url=child.input_images["product_image_url"],
+            style_prompt=fusion_prompt.get("main_prompt", ""),
+            negative_prompt=fusion_prompt.get("negative_prompt", ""),
+            strength=gen_params.get("strength", params["strength"]),
+            aspect_ratio=params["aspect_ratio"],
+        )
+
+    async def on_item_done(index: int, result, error):
+        await on_child_done(children[index], result, error)
+
+    await run_two_stage_pipeline(
+        children,
+        first_stage=fuse_prompt,
+        second_stage=render,
+        first_concurrency=settings.BATCH_FUSE_PROMPT_CONCURRENCY,
+        second_concurrency=settings.BATCH_FUSE_IMAGE_CONCURRENCY,
+        queue_size=settings.BATCH_FUSE_QUEUE_SIZE,
+        on_item_done=on_item_done,
+    )
+
+
+async def _transfer_children(params: dict, style_dna: dict, children: list[Task], on_child_done) -> None:
+    """Batch quick transfer: one style prompt applied to every product, a few at a time."""
+    replication_prompt = style_dna.get("replication_master_prompt", {})
+    style_prompt = replication_prompt.get("english_prompt", "") or DEFAULT_STYLE_PROMPT
+
+    async def transfer(child: Task) -> dict:
+        return await nano_banana_service.generate_style_transfer(
+            product_image_url=child.input_images["product_image_url"],
+            style_prompt=style_prompt,
+            strength=params["strength"],
+            aspect_ratio=params["aspect_ratio"],
+        )
+
+    async def on_item_done(index: int, result, error):
+        await on_child_done(children[index], result, error)
+
+    await gather_bounded(
+        children, transfer, settings.BATCH_IMAGE_CONCURRENCY, on_item_done=on_item_done
+    )
+
+
+async def run_batch_task(task_id: str, user_id: str, db: AsyncSession) -> bool:
+    """Background task for a batch: processes the children that are not completed yet.
+
+    Each child is written as soon as it finishes (status, error, image), and the
+    parent aggregates them: progress counts finished children and output_images
+    holds each child's image at the child's index. Returns False when some
+    children failed but the batch can be resumed.
+    """
+    # Both batch paths finish children concurrently on this one session
+    lock = asyncio.Lock()
+    try:
+        await db.execute(
+            update(Task)
+            .where(Task.parent_id == UUID(task_id), Task.status != TaskStatus.COMPLETED.value)
+            .values(status=TaskStatus.PROCESSING.value, error_message=None)
+        )
+        result = await db.execute(select(Task).where(Task.id == UUID(task_id)))
+        task = result.scalar_one()
+        task.status = TaskStatus.PROCESSING.value
+        await db.commit()
+        await replica_router.mark_write(user_id)
+
+        result = await db.execute(
+            select(Task)
+            .where(Task.parent_id == task.id)
+            .order_by(Task.parameters["index"].as_integer())
+        )
+        children = list(result.scalars())
+        pending = [child for child in children if child.status != TaskStatus.COMPLETED.value]
+        completed = finished = len(children) - len(pending)
+        channels = _batch_channels(task)
+
+        for channel in channels:
+            await ws_manager.send_progress(channel, {
+                "status": "processing",
+                "progress": task.progress,
+                "message": f"开始处理 {len(pending)}/{len(children)} 个产品...",
+            })
+
+        async def on_child_done(child: Task, result: dict | None, error: Exception | None):
+            nonlocal completed, finished
+            index = child.parameters["index"]
+            async with lock:
+                if error is None:
+                    child.status = TaskStatus.COMPLETED.value
+                    child.progress = 100
+                    child.completed_at = datetime.utcnow()
+                    await db.execute(_batch_artifact(child.id, 0, result))
+                    await db.execute(_batch_artifact(task.id, index, result))
+                    completed += 1
+                else:
+                    child.status = TaskStatus.FAILED.value
+                    child.error_message = str(error)
+                finished += 1
+                task.progress = int(finished / len(children) * 100)
+                await db.commit()
+
+            data = {
+                "status": "processing",
+                "progress": task.progress,
+                "current": index + 1,
+                "completed": completed,
+                "total": len(children),
+            }
+            if error is None:
+                data["image_url"] = result["url"]
+            else:
+                data["error"] = str(error)
+            for channel in channels:
+                await ws_manager.send_progress(channel, data)
+
+        params = task.parameters
+        if task.type == TaskType.BATCH_FUSE.value:
+            await _fuse_children(params, pending, on_child_done)
+        else:
+            # The style is extracted once per batch and checkpointed on the parent
+            checkpoints = TaskCheckpoints(db, task_id)
+            await checkpoints.load()
+            style_dna = checkpoints.get("style")
+            if style_dna is None:
+                style_dna = await gemini_service.extract_style_dna(task.input_images["style_image_url"])
+                await checkpoints.save("style", style_dna)
+            await _transfer_children(params, style_dna, pending, on_child_done)
+
+        failed = len(children) - completed
+        if not failed:
+            await settle_batch(task_id, user_id, TaskStatus.COMPLETED, None, db)
+            return True
+        if expired():
+            await settle_batch(
+                task_id, user_id, TaskStatus.PARTIAL_COMPLETED,
+                f"Deadline exceeded: {completed}/{len(children)} items completed", db,
+            )
+            return True
+        await settle_batch(
+            task_id, user_id, TaskStatus.FAILED, f"{failed} of {len(children)} items failed", db,
+            retry=True,
+        )
+        return False
+
+    except asyncio.CancelledError:
+        await settle_batch(
+            task_id, user_id, TaskStatus.CANCELLED,
+            f"Cancelled ({task_runner.cancel_reason(task_id)})", db,
+        )
+        raise
+    except DeadlineExceeded:
+        await settle_batch(task_id, user_id, TaskStatus.PARTIAL_COMPLETED, "Deadline exceeded", db)
+        return True
+    except Exception as e:
+        await settle_batch(task_id, user_id, TaskStatus.FAILED, str(e), db, retry=_resumable(e))
+        return not _resumable(e)
+
+
+async def settle_cancelled(task_id: str, user_id: str, reason: str, db: AsyncSession) -> bool:
+    """Settle a cancelled task that no attempt is running for.
+
+    That is a task waiting for an automatic retry, or one no worker owns. Only a
+    pending or processing task moves to cancelled, and the undelivered share of
+    its credits is refunded in the same transaction. Returns False when the task
+    had already finished.
+    """
+    await db.rollback()
+    result = await db.execute(
+        update(Task)
+        .where(
+            Task.id == UUID(task_id),
+            Task.status.in_([TaskStatus.PENDING.value, TaskStatus.PROCESSING.value]),
+        )
+        .values(status=TaskStatus.CANCELLED.value, completed_at=datetime.utcnow())
+        .returning(Task.id)
+    )
+    if result.scalar_one_or_none() is None:
+        await db.rollback()
+        return False
+
+    result = await db.execute(select(Task).where(Task.id == UUID(task_id)))
+    task = result.scalar_one()
+    batch = task.type in BATCH_TASK_TYPES
+    if batch:
+        await db.execute(
+            update(Task)
+            .where(
+                Task.parent_id == task.id,
+                Task.status.in_([TaskStatus.PENDING.value, TaskStatus.PROCESSING.value]),
+            )
+            .values(status=TaskStatus.CANCELLED.value, error_message=reason)
+        )
+    requested = requested_images(task)
+    # A batch parent holds one artifact per completed child
+    delivered = await db.scalar(
+        select(func.count())
+        .select_from(TaskArtifact)
+        .where(TaskArtifact.task_id == task.id, TaskArtifact.position < requested)
+    )
+    refund = await credit_ledger.refund_undelivered(db, task, delivered, requested, reason)
+    task.error_message = f"{reason}: {delivered}/{requested} {'items completed' if batch else 'images generated'}"
+    await db.commit()
+    await replica_router.mark_write(user_id)
+    if refund:
+        await principal_cache.invalidate(user_id)
+
+    unit = "个" if batch else "张"
+    for channel in _batch_channels(task) if batch else [task_id]:
+        await ws_manager.send_progress(channel, {
+            "status": TaskStatus.CANCELLED.value,
+            "progress": task.progress,
+            "message": f"已取消，完成 {delivered}/{requested} {unit}",
+            "credits_refunded": refund,
         })
+    return True
 
 
-@router.post("/aesthetic-mirror", response_model=TaskResponse)
-async def create_mirror_task(
-    request: MirrorRequest,
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
-):
-    cost = settings.CREDIT_COST_MIRROR
-    if current_user.credits < cost:
+def start_task(task: Task) -> None:
+    """Run (or resume) a task in the background.
+
+    The task gets its own session and deadline, and is retried from its
+    checkpoints up to TASK_AUTO_RETRY_ATTEMPTS times when it fails.
+    """
+    task_id, user_id = str(task.id), str(task.user_id)
+    inputs, params = task.input_images or {}, task.parameters or {}
+    if task.type in BATCH_TASK_TYPES:
+        def run(db: AsyncSession):
+            return run_batch_task(task_id, user_id, db)
+    elif task.type == TaskType.GENESIS.value:
+        def run(db: AsyncSession):
+            return run_genesis_task(
+                task_id, user_id, inputs["image_url"], params["count"], params["style"], db
+            )
+    else:
+        def run(db: AsyncSession):
+            return run_mirror_task(
+                task_id, user_id, inputs["product_image_url"], inputs["style_image_url"], db
+            )
+
+    def on_cancelled(db: AsyncSession):
+        # Cancelled while waiting to retry: no attempt is running to settle it
+        return settle_cancelled(
+            task_id, user_id, f"Cancelled ({task_runner.cancel_reason(task_id)})", db
+        )
+
+    with with_deadline(settings.TASK_DEADLINE_SECONDS):
+        task_runner.start(
+            task_id, run,
+            max_attempts=settings.TASK_AUTO_RETRY_ATTEMPTS + 1,
+            on_cancelled=on_cancelled,
+        )
+
+
+async def reserve_and_create(task: Task, db: AsyncSession) -> None:
+    """Reserve the task's credits and insert it in a single transaction (402 if the balance is short)."""
+    try:
+        await credit_ledger.reserve(db, task.user_id, task_cost(task.type), task)
+    except InsufficientCredits:
         raise HTTPException(
             status_code=status.HTTP_402_PAYMENT_REQUIRED,
             detail="Insufficient credits",
         )
+    await db.commit()
+    await replica_router.mark_write(task.user_id)
+    await db.refresh(task)
+    await principal_cache.invalidate(task.user_id)
 
-    current_user.credits -= cost
+
+async def create_batch(
+    db: AsyncSession,
+    user_id: UUID,
+    task_type: TaskType,
+    input_images: dict | None,
+    parameters: dict,
+    items: list[tuple[dict, dict]],
+) -> BatchTaskResponse:
+    """Insert a batch task and one child per item, then start the batch in the background.
+
+    items holds (input_images, parameters) of each child, in order. The parent
+    and all children go in as a single multi-row INSERT in one transaction.
+    """
+    if not 1 <= len(items) <= settings.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"A batch takes 1 to {settings.BATCH_MAX_ITEMS} products",
+        )
+    parent_id = uuid.uuid4()
+    common = {
+        "user_id": user_id,
+        "type": task_type.value,
+        "status": TaskStatus.PENDING.value,
+        "progress": 0,
+        "credits_used": 0,
+    }
+    rows = [{
+        **common,
+        "id": parent_id,
+        "parent_id": None,
+        "input_images": input_images,
+        "parameters": {**parameters, "count": len(items)},
+    }]
+    rows += [
+        {
+            **common,
+            "id": uuid.uuid4(),
+            "parent_id": parent_id,
+            "input_images": inputs,
+            "parameters": {**params, "index": index},
+        }
+        for index, (inputs, params) in enumerate(items)
+    ]
+    await db.execute(insert(Task), rows)
     await db.commit()
+    await replica_router.mark_write(user_id)
+
+    result = await db.execute(select(Task).where(Task.id == parent_id))
+    task = result.scalar_one()
+    start_task(task)
+    return BatchTaskResponse.model_validate(task).model_copy(
+        update={"child_ids": [row["id"] for row in rows[1:]]}
+    )
+
+
+@router.post("/studio-genesis", response_model=TaskResponse)
+async def create_genesis_task(
+    request: GenesisRequest,
+    db: AsyncSession = Depends(get_db),
+    user_id: UUID = Depends(get_current_user_id),
+):
+    task = Task(
+        user_id=user_id,
+        type=TaskType.GENESIS.value,
+        status=TaskStatus.PENDING.value,
+        input_images={"image_url": request.image_url},
+        parameters={"count": request.count, "style": request.style},
+        credits_used=0,
+    )
+    # Reserve credits and insert the task in one transaction
+    await reserve_and_create(task, db)
+
+    # Start background task in its own session
+    start_task(task)
+
+    return task
+
 
+@router.post("/aesthetic-mirror", response_model=TaskResponse)
+async def create_mirror_task(
+    request: MirrorRequest,
+    db: AsyncSession = Depends(get_db),
+    user_id: UUID = Depends(get_current_user_id),
+):
     task = Task(
-        user_id=current_user.id,
+        user_id=user_id,
         type=TaskType.MIRROR.value,
         status=TaskStatus.PENDING.value,
         input_images={
             "product_image_url": request.product_image_url,
             "style_image_url": request.style_image_url,
         },
-        credits_used=cost,
+        credits_used=0,
     )
-    db.add(task)
-    await db.commit()
-    await db.refresh(task)
+    await reserve_and_create(task, db)
 
-    asyncio.create_task(
-        run_mirror_task(
-            str(task.id),
-            request.product_image_url,
-            request.style_image_url,
-            db,
-        )
-    )
+    start_task(task)
 
     return task
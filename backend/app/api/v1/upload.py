@@ -1,7 +1,9 @@
+import asyncio
 import uuid
+from uuid import UUID
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
-from app.api.v1.auth import get_current_user
-from app.models.user import User
+from app.api.v1.auth import get_current_user_id
+from app.services.image_dedup_service import compute_dhash, product_analysis_dedup
 
 router = APIRouter(prefix="/upload", tags=["upload"])
 
@@ -9,7 +11,7 @@ router = APIRouter(prefix="/upload", tags=["upload"])
 @router.post("/image")
 async def upload_image(
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
+    user_id: UUID = Depends(get_current_user_id),
 ):
     """Upload an image and return its URL."""
     # Validate file type
@@ -39,6 +41,13 @@ async def upload_image(
     # Mock URL for development
     mock_url = f"https://storage.example.com/uploads/{filename}"
 
+    # Remember the perceptual hash so later analyses can skip the download
+    try:
+        image_hash = await asyncio.to_thread(compute_dhash, contents)
+        product_analysis_dedup.remember_upload(mock_url, image_hash)
+    except Exception as e:
+        print(f"Perceptual hash failed for upload {filename}: {e}")
+
     return {
         "url": mock_url,
         "filename": filename,
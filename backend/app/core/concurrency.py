@@ -0,0 +1,168 @@
+"""
+XC AI Design - 并发工具
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+
+
+async def gather_stages(
+    stages: dict[str, Awaitable],
+    on_stage_done: Optional[Callable[[str, Any, int], Awaitable]] = None,
+) -> dict[str, Any]:
+    """并发执行互不依赖的阶段
+
+    每个阶段完成时立即回调 on_stage_done(name, result, finished_count)，
+    任一阶段失败时取消其余阶段并抛出该异常。
+
+    Returns:
+        阶段名 → 结果
+    """
+    tasks = {asyncio.ensure_future(coro): name for name, coro in stages.items()}
+    results: dict[str, Any] = {}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = tasks[task]
+                results[name] = task.result()
+                if on_stage_done:
+                    await on_stage_done(name, results[name], len(results))
+    finally:
+        for task in pending:
+            task.cancel()
+    return results
+
+
+async def gather_bounded(
+    items: list,
+    fn: Callable[[Any], Awaitable],
+    concurrency: int,
+    on_item_done: Optional[Callable[[int, Any, Optional[Exception]], Awaitable]] = None,
+) -> list[tuple[Any, Optional[Exception]]]:
+    """以有限并发对每一项执行 fn，单项失败不影响其他项
+
+    Args:
+        items: 输入列表
+        fn: fn(item) -> 结果
+        concurrency: 同时进行的项数上限
+        on_item_done: 某项结束时回调 (index, 结果, 异常)，按完成顺序调用
+
+    Returns:
+        与输入顺序一致的 (结果, 异常) 列表
+    """
+    total = len(items)
+    outcomes: list[tuple[Any, Optional[Exception]]] = [(None, None)] * total
+    todo: asyncio.Queue = asyncio.Queue()
+    for index in range(total):
+        todo.put_nowait(index)
+
+    async def worker():
+        while True:
+            try:
+                index = todo.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                outcomes[index] = (await fn(items[index]), None)
+            except Exception as e:
+                outcomes[index] = (None, e)
+            if on_item_done:
+                await on_item_done(index, *outcomes[index])
+
+    if total:
+        await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, total)))))
+    return outcomes
+
+
+_DONE = object()
+
+
+async def run_two_stage_pipeline(
+    items: list,
+    first_stage: Callable[[Any], Awaitable],
+    second_stage: Callable[[Any, Any], Awaitable],
+    first_concurrency: int,
+    second_concurrency: int,
+    queue_size: int,
+    on_first_done: Optional[Callable[[int, Any], Awaitable]] = None,
+    on_item_done: Optional[Callable[[int, Any, Optional[Exception]], Awaitable]] = None,
+) -> list[tuple[Any, Optional[Exception]]]:
+    """两阶段生产者/消费者流水线
+
+    第一阶段的 worker 处理完一项后立即放入有界队列，由第二阶段的 worker
+    消费；队列满时第一阶段阻塞（背压）。单项失败不影响其他项。
+
+    Args:
+        items: 输入列表
+        first_stage: first_stage(item) -> 中间结果
+        second_stage: second_stage(item, 中间结果) -> 最终结果
+        first_concurrency / second_concurrency: 两个阶段的并发数
+        queue_size: 阶段间队列容量
+        on_first_done: 第一阶段成功时回调 (index, 中间结果)
+        on_item_done: 某项结束（成功或任一阶段失败）时回调 (index, 结果, 异常)
+
+    Returns:
+        与输入顺序一致的 (结果, 异常) 列表
+    """
+    total = len(items)
+    outcomes: list[tuple[Any, Optional[Exception]]] = [(None, None)] * total
+    if total == 0:
+        return outcomes
+
+    todo: asyncio.Queue = asyncio.Queue()
+    for index, item in enumerate(items):
+        todo.put_nowait(index)
+    handoff: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+
+    async def finish(index: int, result: Any, error: Optional[Exception]):
+        outcomes[index] = (result, error)
+        if on_item_done:
+            await on_item_done(index, result, error)
+
+    async def first_worker():
+        while True:
+            try:
+                index = todo.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                value = await first_stage(items[index])
+            except Exception as e:
+                await finish(index, None, e)
+                continue
+            if on_first_done:
+                await on_first_done(index, value)
+            await handoff.put((index, value))
+
+    async def second_worker():
+        while True:
+            entry = await handoff.get()
+            if entry is _DONE:
+                return
+            index, value = entry
+            try:
+                result = await second_stage(items[index], value)
+            except Exception as e:
+                await finish(index, None, e)
+                continue
+            await finish(index, result, None)
+
+    second_workers = max(1, min(second_concurrency, total))
+
+    async def produce():
+        await asyncio.gather(*(
+            first_worker() for _ in range(max(1, min(first_concurrency, total)))
+        ))
+        for _ in range(second_workers):
+            await handoff.put(_DONE)
+
+    tasks = [asyncio.ensure_future(produce())]
+    tasks += [asyncio.ensure_future(second_worker()) for _ in range(second_workers)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return outcomes
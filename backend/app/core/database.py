@@ -1,12 +1,88 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+import time
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .config import settings
+from .metrics import metrics
 
-engine = create_async_engine(
-    settings.DATABASE_URL,
-    echo=settings.DEBUG,
-    future=True,
-)
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that reports how long each checkout waited for a connection."""
+
+    _metric_labels: dict = {}
+
+    def recreate(self):
+        pool = super().recreate()
+        pool._metric_labels = self._metric_labels
+        return pool
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.observe(
+                "db.pool.checkout_wait_seconds", time.perf_counter() - started, **self._metric_labels
+            )
+
+
+def _instrument(engine: AsyncEngine, name: str) -> None:
+    """Pool gauges and per-statement latency through SQLAlchemy event hooks."""
+    engine.sync_engine.pool._metric_labels = {"db": name}
+    # Looked up on each read: dispose() replaces the pool
+    metrics.set_gauge("db.pool.in_use", lambda: engine.sync_engine.pool.checkedout(), db=name)
+    metrics.set_gauge("db.pool.idle", lambda: engine.sync_engine.pool.checkedin(), db=name)
+    metrics.set_gauge("db.pool.overflow", lambda: engine.sync_engine.pool.overflow(), db=name)
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        metrics.observe("db.statement_seconds", elapsed, db=name, statement=verb)
+        if elapsed >= settings.DB_SLOW_QUERY_SECONDS:
+            metrics.inc("db.slow_statements", db=name, statement=verb)
+            print(f"Slow query on {name} ({elapsed:.2f}s): {statement[:200]}")
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def _on_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+
+def create_engine(url: str, name: str) -> AsyncEngine:
+    connect_args = {
+        # asyncpg's and SQLAlchemy's prepared statement caches; 0 behind pgbouncer
+        "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+    }
+    if settings.DB_STATEMENT_TIMEOUT_MS:
+        connect_args["server_settings"] = {
+            "statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)
+        }
+
+    engine = create_async_engine(
+        url,
+        echo=settings.DB_ECHO,
+        future=True,
+        poolclass=TimedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+        connect_args=connect_args,
+    )
+    _instrument(engine, name)
+    return engine
+
+
+engine = create_engine(settings.DATABASE_URL, "primary")
 
 async_session_maker = async_sessionmaker(
     engine,
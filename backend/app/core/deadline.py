@@ -0,0 +1,79 @@
+"""
+XC AI Design - 端到端截止时间
+截止时间经 contextvar 从 API 请求或后台任务传递到每一次上游调用
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Iterator, Optional
+from app.services.upstream import UpstreamError
+
+# time.monotonic() 表示的截止时刻；None 表示不限
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(UpstreamError):
+    """整体截止时间已到（不可重试）"""
+
+    def __init__(self, message: str = "Deadline exceeded"):
+        super().__init__(message, status_code=504, retryable=False)
+
+
+@contextmanager
+def with_deadline(seconds: Optional[float]) -> Iterator[None]:
+    """在当前上下文内设置截止时间；已有更早的截止时间时保持不变
+
+    asyncio 任务创建时复制上下文，截止时间会随之传递到子任务。
+    """
+    if seconds is None:
+        yield
+        return
+    current = _deadline.get()
+    target = time.monotonic() + seconds
+    token = _deadline.set(target if current is None else min(current, target))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """剩余秒数；未设置截止时间时返回 None"""
+    current = _deadline.get()
+    return None if current is None else current - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def call_timeout(default: float) -> float:
+    """单次调用的超时：默认值与剩余时间取较小者，已超时则抛出 DeadlineExceeded"""
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise DeadlineExceeded()
+    return min(default, left)
+
+
+@asynccontextmanager
+async def within_deadline() -> AsyncIterator[None]:
+    """截止时间到达时取消内部操作并抛出 DeadlineExceeded"""
+    left = remaining()
+    if left is None:
+        yield
+        return
+    if left <= 0:
+        raise DeadlineExceeded()
+    scope = asyncio.timeout(left)
+    try:
+        async with scope:
+            yield
+    except TimeoutError:
+        if scope.expired():
+            raise DeadlineExceeded() from None
+        raise
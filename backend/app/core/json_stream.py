@@ -0,0 +1,97 @@
+"""
+XC AI Design - 增量 JSON 解析
+流式补全过程中，顶层对象的每个字段一完成就立即解析出来
+"""
+
+import json
+from typing import Any
+
+
+class IncrementalJSONParser:
+    """增量解析顶层 JSON 对象的字段
+
+    可以逐段 feed 模型输出（允许前面带有 ```json 代码块标记或说明文字），
+    每当顶层对象的某个字段值完整出现时，feed 返回 (key, value)。
+    解析器只做结构扫描，不替代最终的完整解析。
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self._finished = False
+        self._key_start: int | None = None
+        self._key: str | None = None
+        self._value_start: int | None = None
+
+    def feed(self, chunk: str) -> list[tuple[str, Any]]:
+        self._buffer += chunk
+        sections: list[tuple[str, Any]] = []
+        buffer = self._buffer
+
+        while self._pos < len(buffer) and not self._finished:
+            i = self._pos
+            ch = buffer[i]
+            self._pos += 1
+
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._key_start is not None and self._key is None:
+                        self._key = self._load(buffer[self._key_start:i + 1])
+                        self._key_start = None
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._key is None and self._value_start is None:
+                    self._key_start = i
+            elif ch == ":" and self._depth == 1 and self._key is not None and self._value_start is None:
+                self._value_start = i + 1
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._value_start is not None:
+                    # 容器类型的字段值刚刚闭合
+                    self._emit(buffer[self._value_start:i + 1], sections)
+                elif self._depth == 0:
+                    if self._value_start is not None:
+                        self._emit(buffer[self._value_start:i], sections)
+                    self._finished = True
+            elif ch == "," and self._depth == 1 and self._value_start is not None:
+                # 标量类型的字段值以逗号结束
+                self._emit(buffer[self._value_start:i], sections)
+
+        return sections
+
+    def _emit(self, raw: str, sections: list) -> None:
+        key = self._key
+        self._key = None
+        self._value_start = None
+        if not raw.strip():
+            return
+        try:
+            sections.append((key, json.loads(raw)))
+        except json.JSONDecodeError:
+            pass
+
+    @staticmethod
+    def _load(raw: str) -> str | None:
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError:
+            return None
@@ -0,0 +1,93 @@
+"""
+XC AI Design - 进程内指标
+计数器、仪表盘与直方图（保留最近样本计算分位数），通过 /metrics 暴露
+"""
+
+import time
+from collections import deque
+from typing import Callable
+
+
+def _key(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    label_str = ",".join(f"{k}={labels[k]}" for k in sorted(labels))
+    return f"{name}{{{label_str}}}"
+
+
+class Histogram:
+    """保留最近 N 个样本的直方图"""
+
+    def __init__(self, reservoir: int = 1024):
+        self.count = 0
+        self.total = 0.0
+        self.samples: deque[float] = deque(maxlen=reservoir)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def quantile(self, q: float) -> float | None:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.total, 4),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """进程内指标注册表"""
+
+    def __init__(self):
+        self.counters: dict[str, float] = {}
+        self.gauges: dict[str, float | Callable[[], float]] = {}
+        self.histograms: dict[str, Histogram] = {}
+        self.events: dict[str, deque] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = _key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float | Callable[[], float], **labels) -> None:
+        """设置仪表盘数值；传入可调用对象时在读取时求值"""
+        self.gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def histogram(self, name: str, **labels) -> Histogram | None:
+        return self.histograms.get(_key(name, labels))
+
+    def record_event(self, name: str, data: dict, keep: int = 200) -> None:
+        """记录最近的明细事件（如单次调用的输入输出大小）"""
+        log = self.events.get(name)
+        if log is None:
+            log = self.events[name] = deque(maxlen=keep)
+        log.append({"ts": time.time(), **data})
+
+    def snapshot(self) -> dict:
+        return {
+            "counters": dict(self.counters),
+            "gauges": {
+                key: value() if callable(value) else value
+                for key, value in self.gauges.items()
+            },
+            "histograms": {key: h.summary() for key, h in self.histograms.items()},
+            "events": {name: list(log) for name, log in self.events.items()},
+        }
+
+
+metrics = Metrics()
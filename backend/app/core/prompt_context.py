@@ -0,0 +1,177 @@
+"""
+XC AI Design - 提示词上下文构建
+按模板裁剪分析结果、紧凑序列化，并用本地估算器控制 token 预算
+"""
+
+import json
+from typing import Any
+from app.core.config import settings
+from app.core.metrics import metrics
+
+# 各模板需要的产品分析字段，按优先级从高到低；超出预算时从末尾开始丢弃
+PRODUCT_CONTEXT_FIELDS: dict[str, list[str]] = {
+    "detail_page_plan": [
+        "basic_info",
+        "selling_points",
+        "detail_page_blueprint",
+        "style_recommendations",
+        "visual_identity",
+        "target_audience",
+    ],
+    "image_prompt": [
+        "basic_info.product_name",
+        "basic_info.category",
+        "visual_identity",
+        "selling_points.core_usp",
+        "style_recommendations.primary_style",
+        "style_recommendations.mood_keywords",
+    ],
+    "style_fusion": [
+        "basic_info",
+        "visual_identity",
+        "selling_points.core_usp",
+    ],
+    "multilingual_copy": [
+        "basic_info",
+        "selling_points",
+        "target_audience",
+        "style_recommendations.mood_keywords",
+    ],
+    "copywriting": [
+        "basic_info",
+        "visual_identity",
+        "selling_points.core_usp",
+        "style_recommendations",
+    ],
+}
+
+STYLE_CONTEXT_FIELDS: dict[str, list[str]] = {
+    "style_fusion": [
+        "style_fingerprint",
+        "replication_master_prompt",
+        "color_dna",
+        "lighting_dna",
+        "composition_dna",
+        "mood_atmosphere",
+        "texture_material_dna",
+        "decorative_dna",
+    ],
+}
+
+# 超预算时逐级收紧：列表最多保留的元素数、字符串最大长度
+_SHRINK_STEPS = [(5, 400), (3, 200), (1, 80)]
+
+
+def estimate_tokens(text: str) -> int:
+    """本地 token 估算：CJK 等非 ASCII 字符约 1 token/字，ASCII 约 4 字符/token"""
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + (len(text) - non_ascii + 3) // 4
+
+
+def dumps_compact(data: Any) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _walk(data: dict, keys: list[str]) -> tuple[list[str], Any] | None:
+    node: Any = data
+    for key in keys:
+        if not isinstance(node, dict) or key not in node:
+            return None
+        node = node[key]
+    return keys, node
+
+
+def _pick(data: dict, path: str) -> tuple[list[str], Any] | None:
+    """按点分路径取值；找不到时去掉首段再试一次
+
+    前端可能只传 basic_info 这一段（product_name 等在顶层），
+    因此 basic_info.product_name 也匹配顶层的 product_name。
+    """
+    keys = path.split(".")
+    picked = _walk(data, keys)
+    if picked is None and len(keys) > 1:
+        picked = _walk(data, keys[1:])
+    return picked
+
+
+def prune(data: dict, fields: list[str]) -> dict:
+    """只保留 fields 中列出的（点分）路径"""
+    pruned: dict = {}
+    for path in fields:
+        picked = _pick(data, path)
+        if picked is None:
+            continue
+        keys, value = picked
+        node = pruned
+        for key in keys[:-1]:
+            node = node.setdefault(key, {})
+        node[keys[-1]] = value
+    return pruned
+
+
+def _shrink(value: Any, max_items: int, max_chars: int) -> Any:
+    if isinstance(value, dict):
+        return {k: _shrink(v, max_items, max_chars) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_shrink(v, max_items, max_chars) for v in value[:max_items]]
+    if isinstance(value, str) and len(value) > max_chars:
+        return value[:max_chars] + "…"
+    return value
+
+
+def fit_to_budget(data: dict, fields: list[str], budget: int) -> str:
+    """裁剪、紧凑序列化并压缩到 budget 个 token 以内"""
+    pruned = prune(data, fields)
+    if not pruned:
+        # 解析失败的结果只有 raw_response，此时它就是唯一可用的信息；
+        # 其他结构未知的输入（如批量融合的自由格式 info）整体保留，再按预算压缩
+        pruned = {"raw_response": data.get("raw_response", "")} if "raw_response" in data else dict(data)
+
+    text = dumps_compact(pruned)
+    if estimate_tokens(text) <= budget:
+        return text
+
+    # 1. 轻度截断列表和长字符串
+    max_items, max_chars = _SHRINK_STEPS[0]
+    text = dumps_compact(_shrink(pruned, max_items, max_chars))
+    if estimate_tokens(text) <= budget:
+        return text
+
+    # 2. 依优先级从低到高整段丢弃（至少保留一段）
+    kept = [path for path in fields if _pick(data, path) is not None]
+    while len(kept) > 1 and estimate_tokens(text) > budget:
+        kept.pop()
+        text = dumps_compact(_shrink(prune(data, kept), max_items, max_chars))
+    if estimate_tokens(text) <= budget:
+        return text
+
+    # 3. 进一步截断
+    current = prune(data, kept) if kept else pruned
+    for max_items, max_chars in _SHRINK_STEPS[1:]:
+        text = dumps_compact(_shrink(current, max_items, max_chars))
+        if estimate_tokens(text) <= budget:
+            return text
+
+    # 4. 兜底：直接截断文本
+    while estimate_tokens(text) > budget and len(text) > 16:
+        text = text[: int(len(text) * 0.9)]
+    return text + "…"
+
+
+def build_context(kind: str, template: str, data: dict) -> str:
+    """为指定模板构建上下文字符串，并记录裁剪前后的大小
+
+    Args:
+        kind: "product" 或 "style"
+        template: 模板名（见 PRODUCT_CONTEXT_FIELDS / STYLE_CONTEXT_FIELDS）
+        data: 分析结果
+    """
+    table = PRODUCT_CONTEXT_FIELDS if kind == "product" else STYLE_CONTEXT_FIELDS
+    budget = settings.PROMPT_CONTEXT_BUDGETS.get(template, settings.PROMPT_CONTEXT_DEFAULT_BUDGET)
+    text = fit_to_budget(data, table[template], budget)
+
+    full_tokens = estimate_tokens(json.dumps(data, ensure_ascii=False, indent=2))
+    context_tokens = estimate_tokens(text)
+    metrics.observe("prompt_context.tokens_saved", full_tokens - context_tokens, template=template, kind=kind)
+    metrics.observe("prompt_context.tokens", context_tokens, template=template, kind=kind)
+    return text
@@ -0,0 +1,22 @@
+"""
+XC AI Design - Redis 连接
+跨进程共享的状态（限流、熔断等）统一使用这里的客户端
+"""
+
+import redis.asyncio as redis
+from app.core.config import settings
+
+_client: redis.Redis | None = None
+
+
+def get_redis() -> redis.Redis:
+    """返回进程内共享的 Redis 客户端（惰性创建）"""
+    global _client
+    if _client is None:
+        _client = redis.from_url(
+            settings.REDIS_URL,
+            decode_responses=True,
+            socket_timeout=2.0,
+            socket_connect_timeout=2.0,
+        )
+    return _client
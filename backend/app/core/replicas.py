@@ -0,0 +1,142 @@
+"""
+XC AI Design - 只读副本路由
+只读查询轮询分发到健康的副本；用户刚写入后的一段时间内读主库，保证读到自己的写入
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+from .config import settings
+from .database import async_session_maker, create_engine
+from .metrics import metrics
+from .redis import get_redis
+
+# 非副本（如本地测试用的第二个实例）两个 LSN 函数都返回 NULL，延迟按 0 计
+_LAG_QUERY = text(
+    "SELECT COALESCE(CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END, 0)"
+)
+
+
+def _write_key(user_id: str) -> str:
+    return f"ryw:{user_id}"
+
+
+@dataclass
+class Replica:
+    name: str
+    engine: AsyncEngine
+    session_maker: async_sessionmaker
+    healthy: bool = True
+    lag: Optional[float] = None
+    last_error: Optional[str] = field(default=None, repr=False)
+
+
+class ReplicaRouter:
+    """只读会话路由
+
+    - 未配置副本时所有会话都走主库
+    - 副本按轮询选择；健康检查失败或复制延迟超过 REPLICA_MAX_LAG_SECONDS 的副本被跳过，
+      全部不可用时回退主库
+    - mark_write 之后 READ_YOUR_WRITES_SECONDS 内，该用户的读请求走主库；
+      标记同时写入 Redis，其他进程同样生效
+    """
+
+    def __init__(self):
+        self.replicas: list[Replica] = []
+        for i, url in enumerate(settings.DATABASE_REPLICA_URLS):
+            name = f"replica{i}"
+            engine = create_engine(url, name)
+            maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+            self.replicas.append(Replica(name, engine, maker))
+        self.window = settings.READ_YOUR_WRITES_SECONDS
+        self._next = 0
+        self._recent_writes: dict[str, float] = {}
+        self._health_task: Optional[asyncio.Task] = None
+        for replica in self.replicas:
+            metrics.set_gauge("db.replica.healthy", lambda r=replica: int(r.healthy), db=replica.name)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    def _pick(self) -> Optional[Replica]:
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[self._next % len(self.replicas)]
+            self._next += 1
+            if replica.healthy:
+                return replica
+        return None
+
+    async def mark_write(self, user_id) -> None:
+        """用户刚写入：窗口期内其读请求走主库"""
+        if not self.enabled:
+            return
+        user_id = str(user_id)
+        self._recent_writes[user_id] = time.monotonic() + self.window
+        try:
+            await get_redis().set(_write_key(user_id), 1, px=int(self.window * 1000))
+        except Exception:
+            pass
+
+    async def _wrote_recently(self, user_id: str) -> bool:
+        until = self._recent_writes.get(user_id)
+        if until is not None:
+            if until > time.monotonic():
+                return True
+            del self._recent_writes[user_id]
+        try:
+            return bool(await get_redis().exists(_write_key(user_id)))
+        except Exception:
+            return False
+
+    @asynccontextmanager
+    async def session(self, user_id=None) -> AsyncIterator[AsyncSession]:
+        """只读会话：副本可用且用户没有刚写入时连副本，否则连主库"""
+        maker = async_session_maker
+        target = "primary"
+        if self.enabled:
+            self._ensure_health_checks()
+            if user_id is None or not await self._wrote_recently(str(user_id)):
+                replica = self._pick()
+                if replica is not None:
+                    maker, target = replica.session_maker, replica.name
+        metrics.inc("db.read_sessions", db=target)
+        async with maker() as session:
+            yield session
+
+    def _ensure_health_checks(self) -> None:
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.gather(*(self._check(replica) for replica in self.replicas))
+            await asyncio.sleep(settings.REPLICA_HEALTH_CHECK_SECONDS)
+
+    async def _check(self, replica: Replica) -> None:
+        try:
+            async with asyncio.timeout(settings.REPLICA_HEALTH_CHECK_SECONDS):
+                async with replica.engine.connect() as conn:
+                    replica.lag = float(await conn.scalar(_LAG_QUERY))
+            healthy = replica.lag <= settings.REPLICA_MAX_LAG_SECONDS
+            replica.last_error = None if healthy else f"lag {replica.lag:.1f}s"
+        except Exception as e:
+            healthy = False
+            replica.last_error = str(e) or type(e).__name__
+        if healthy != replica.healthy:
+            print(f"Replica {replica.name} is now {'healthy' if healthy else 'unhealthy'}: {replica.last_error}")
+        replica.healthy = healthy
+
+    def status(self) -> dict:
+        return {
+            replica.name: {"healthy": replica.healthy, "lag": replica.lag, "error": replica.last_error}
+            for replica in self.replicas
+        }
+
+
+replica_router = ReplicaRouter()
@@ -1,10 +1,33 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Any
+from typing import Any, Callable, TypeVar
+from fastapi import HTTPException, status
 from jose import jwt, JWTError
 from passlib.context import CryptContext
 from .config import settings
+from .metrics import metrics
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+T = TypeVar("T")
+
+# min == max == default: hashes with any other cost are flagged by needs_update
+# and transparently rehashed on the next successful login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.BCRYPT_ROUNDS,
+)
+
+# bcrypt costs 100-300 ms of CPU; run it off the event loop in a dedicated pool
+_password_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+)
+_password_slots = asyncio.Semaphore(settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE_SIZE)
+_password_pending = 0
+metrics.set_gauge("password_hash.pending", lambda: _password_pending)
 
 
 def create_access_token(subject: str | Any, expires_delta: timedelta | None = None) -> str:
@@ -27,9 +50,38 @@ def verify_token(token: str) -> str | None:
         return None
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def _run_password_op(op: str, func: Callable[..., T], *args) -> T:
+    """Run a bcrypt operation in the password pool; fail fast with 503 when its queue is full."""
+    global _password_pending
+    if _password_slots.locked():
+        metrics.inc("password_hash.rejected", op=op)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent sign-ins, please retry",
+            headers={"Retry-After": "1"},
+        )
+    async with _password_slots:
+        _password_pending += 1
+        started = time.monotonic()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(_password_executor, func, *args)
+        finally:
+            _password_pending -= 1
+            metrics.observe("password_hash.seconds", time.monotonic() - started, op=op)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run_password_op("verify", pwd_context.verify, plain_password, hashed_password)
+
+
+async def verify_and_update_password(
+    plain_password: str, hashed_password: str
+) -> tuple[bool, str | None]:
+    """Verify a password; also returns a new hash when the stored one uses another bcrypt cost."""
+    return await _run_password_op(
+        "verify", pwd_context.verify_and_update, plain_password, hashed_password
+    )
 
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+async def get_password_hash(password: str) -> str:
+    return await _run_password_op("hash", pwd_context.hash, password)
@@ -1,11 +1,32 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.replicas import replica_router
 from app.api.v1 import auth, tasks, upload
 from app.api.routes import studio_genesis, aesthetic_mirror
+from app.services.circuit_breaker import circuit_breaker
+from app.services.provider_pool import provider_pool
+from app.services.task_archive import task_archive
+from app.services.upstream import UpstreamError
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Task inserts need a partition: create this month's, the next ones and the
+    # DEFAULT partition before serving
+    await task_archive.ensure_partitions()
+    # Keeps creating upcoming monthly task partitions and archives old tasks
+    task_archive.start()
+    yield
+    task_archive.stop()
+
 
 app = FastAPI(
     title=settings.APP_NAME,
+    lifespan=lifespan,
     openapi_url=f"{settings.API_V1_PREFIX}/openapi.json",
     docs_url=f"{settings.API_V1_PREFIX}/docs",
     redoc_url=f"{settings.API_V1_PREFIX}/redoc",
@@ -20,6 +41,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.exception_handler(UpstreamError)
+async def upstream_error_handler(request: Request, exc: UpstreamError):
+    headers = {}
+    if exc.retry_after is not None:
+        headers["Retry-After"] = str(int(exc.retry_after + 0.999))
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc), "retryable": exc.retryable},
+        headers=headers,
+    )
+
+
+@app.exception_handler(Exception)
+async def unhandled_error_handler(request: Request, exc: Exception):
+    # Routes used to wrap every body in try/except to turn errors into this response
+    return JSONResponse(status_code=500, content={"detail": str(exc)})
+
+
 # Include routers
 app.include_router(auth.router, prefix=settings.API_V1_PREFIX)
 app.include_router(tasks.router, prefix=settings.API_V1_PREFIX)
@@ -37,4 +77,16 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    upstream = await circuit_breaker.status()
+    degraded = any(state["state"] != "closed" for state in upstream.values())
+    return {
+        "status": "degraded" if degraded else "healthy",
+        "upstream": upstream,
+        "providers": provider_pool.usage(),
+        "replicas": replica_router.status(),
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
@@ -1,7 +1,7 @@
 import uuid
 from datetime import datetime
 from enum import Enum
-from sqlalchemy import String, Integer, DateTime, ForeignKey, func, Text
+from sqlalchemy import String, Integer, Float, DateTime, ForeignKey, Index, func, Text, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import Mapped, mapped_column
 from app.core.database import Base
@@ -11,35 +11,115 @@ class TaskType(str, Enum):
     GENESIS = "genesis"
     MIRROR = "mirror"
     REFINEMENT = "refinement"
+    # Batch parents and their per-product children share the type
+    BATCH_FUSE = "batch_fuse"
+    BATCH_QUICK_TRANSFER = "batch_quick_transfer"
 
 
 class TaskStatus(str, Enum):
     PENDING = "pending"
     PROCESSING = "processing"
     COMPLETED = "completed"
+    PARTIAL_COMPLETED = "partial_completed"  # deadline hit; unused credits refunded
     FAILED = "failed"
+    CANCELLED = "cancelled"  # unused credits refunded
 
 
 class Task(Base):
     __tablename__ = "tasks"
+    # Monthly range partitions on created_at (created by the task archiver), so
+    # old months can be archived and dropped instead of growing indexes forever.
+    # Keyset pagination of a user's history: (user_id, created_at, id) scanned backwards
+    __table_args__ = (
+        Index("ix_tasks_user_created_id", "user_id", "created_at", "id"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
     id: Mapped[uuid.UUID] = mapped_column(
         UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
     )
     user_id: Mapped[uuid.UUID] = mapped_column(
-        UUID(as_uuid=True), ForeignKey("users.id"), nullable=False, index=True
+        UUID(as_uuid=True), ForeignKey("users.id"), nullable=False
+    )
+    # Set on the children of a batch task (no foreign key, see below)
+    parent_id: Mapped[uuid.UUID | None] = mapped_column(
+        UUID(as_uuid=True), nullable=True, index=True
     )
     type: Mapped[str] = mapped_column(String(50), nullable=False)
     status: Mapped[str] = mapped_column(String(50), default=TaskStatus.PENDING.value)
     progress: Mapped[int] = mapped_column(Integer, default=0)
     input_images: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
-    output_images: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
     parameters: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
     error_message: Mapped[str | None] = mapped_column(Text, nullable=True)
     credits_used: Mapped[int] = mapped_column(Integer, default=0)
+    # Part of the primary key: a partitioned table's keys must include the partition key
     created_at: Mapped[datetime] = mapped_column(
-        DateTime(timezone=True), server_default=func.now()
+        DateTime(timezone=True), primary_key=True, server_default=func.now()
     )
     completed_at: Mapped[datetime | None] = mapped_column(
         DateTime(timezone=True), nullable=True
     )
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+
+# Tables keyed by task_id carry no foreign key to the partitioned tasks table
+# (it would have to include created_at); the archiver deletes their rows with the task.
+
+
+class TaskCheckpoint(Base):
+    """Result of one completed step of a task (analysis, prompts)."""
+
+    __tablename__ = "task_checkpoints"
+    __table_args__ = (UniqueConstraint("task_id", "step"),)
+
+    id: Mapped[uuid.UUID] = mapped_column(
+        UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
+    )
+    task_id: Mapped[uuid.UUID] = mapped_column(
+        UUID(as_uuid=True), nullable=False, index=True
+    )
+    step: Mapped[str] = mapped_column(String(50), nullable=False)
+    data: Mapped[dict] = mapped_column(JSONB, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+
+
+class TaskArtifact(Base):
+    """One generated image of a task; rows are only ever inserted.
+
+    Kept out of the tasks table so status and progress updates rewrite a narrow row.
+    """
+
+    __tablename__ = "task_artifacts"
+    __table_args__ = (UniqueConstraint("task_id", "position"),)
+
+    id: Mapped[uuid.UUID] = mapped_column(
+        UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
+    )
+    task_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
+    position: Mapped[int] = mapped_column(Integer, nullable=False)
+    role: Mapped[str | None] = mapped_column(String(50), nullable=True)
+    url: Mapped[str] = mapped_column(Text, nullable=False)
+    width: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    height: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    generation_seconds: Mapped[float | None] = mapped_column(Float, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+
+
+class ArchivedTask(Base):
+    """Where an archived task's row and artifacts live in cold storage."""
+
+    __tablename__ = "archived_tasks"
+
+    task_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True)
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    object_key: Mapped[str] = mapped_column(String(500), nullable=False)
+    archived_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
@@ -1,6 +1,6 @@
 from datetime import datetime
 from uuid import UUID
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from app.models.task import TaskType, TaskStatus
 
 
@@ -13,21 +13,66 @@ class TaskCreate(BaseModel):
 class TaskResponse(BaseModel):
     id: UUID
     user_id: UUID
+    parent_id: UUID | None = None  # set on the items of a batch
     type: str
     status: str
     progress: int
     input_images: dict | None
-    output_images: dict | None
+    output_images: dict | None = None  # rebuilt from task_artifacts
     parameters: dict | None
     error_message: str | None
     credits_used: int
     created_at: datetime
     completed_at: datetime | None
+    updated_at: datetime | None = None
+    archived: bool = False  # served from cold storage
 
     class Config:
         from_attributes = True
 
 
+class BatchTaskResponse(TaskResponse):
+    """Parent batch task; progress and output_images aggregate its children."""
+
+    child_ids: list[UUID] = []
+
+
+class TaskSummary(BaseModel):
+    """Task history row without the JSONB payloads."""
+
+    id: UUID
+    type: str
+    status: str
+    progress: int
+    cover_url: str | None
+    image_count: int
+    requested_count: int
+    credits_used: int
+    created_at: datetime
+    completed_at: datetime | None
+
+    class Config:
+        from_attributes = True
+
+
+class TaskPage(BaseModel):
+    items: list[TaskSummary]
+    next_cursor: str | None = None
+
+
+class TaskStatusRequest(BaseModel):
+    task_ids: list[UUID] = Field(..., min_length=1, max_length=100)
+
+
+class TaskStatusItem(BaseModel):
+    """Status of one task; version changes whenever the task row changes."""
+
+    id: UUID
+    status: str
+    progress: int
+    version: str
+
+
 class TaskProgress(BaseModel):
     task_id: UUID
     status: str
@@ -0,0 +1,131 @@
+"""
+XC AI Design - 自适应并发控制
+AIMD：上游健康时并发上限逐步加一，出现 429、超时或排队变长时按比例收缩
+"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+import httpx
+from app.core.metrics import metrics
+from app.services.upstream import UpstreamRateLimited
+
+
+def _is_overload(error: BaseException) -> bool:
+    """上游或本地配额已饱和的信号"""
+    return isinstance(error, (UpstreamRateLimited, httpx.TimeoutException))
+
+
+class AdaptiveLimiter:
+    """进程内的 AIMD 并发限制器
+
+    - 加性增：成功且耗时未超出基线 × latency_tolerance 时，上限增加 1/limit
+      （约每轮满并发加 1）；只有并发确实用到一半以上时才增长，避免空闲时虚涨
+    - 乘性减：429、超时、耗时超出容忍度时上限乘以 backoff_ratio；
+      一个基线耗时内最多收缩一次，避免同一波失败把上限压到底
+    - 基线为成功调用耗时的慢速指数滑动平均，耗时包含限流排队，排队变长同样触发收缩
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial: int,
+        min_limit: int,
+        max_limit: int,
+        backoff_ratio: float = 0.7,
+        latency_tolerance: float = 2.0,
+        max_wait: Optional[float] = None,
+        enabled: bool = True,
+    ):
+        self.enabled = enabled
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.baseline: Optional[float] = None
+        self._last_decrease = 0.0
+        self._waiters: deque[asyncio.Future] = deque()
+        metrics.set_gauge("adaptive_limiter.limit", lambda: int(self.limit), limiter=name)
+        metrics.set_gauge("adaptive_limiter.in_flight", lambda: self.in_flight, limiter=name)
+        metrics.set_gauge("adaptive_limiter.waiting", lambda: len(self._waiters), limiter=name)
+
+    def _wake(self) -> None:
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    async def _enter(self) -> None:
+        deadline = time.monotonic() + self.max_wait if self.max_wait else None
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            timeout = None if deadline is None else deadline - time.monotonic()
+            try:
+                await asyncio.wait_for(waiter, timeout=timeout)
+            except asyncio.TimeoutError:
+                metrics.inc("adaptive_limiter.rejected", limiter=self.name)
+                raise UpstreamRateLimited(f"{self.name} concurrency wait exceeded", retry_after=5)
+            except asyncio.CancelledError:
+                # 已被唤醒却被取消：把名额让给下一个等待者
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def _exit(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[None]:
+        """在当前并发上限内执行一次调用"""
+        if not self.enabled:
+            yield
+            return
+
+        await self._enter()
+        started = time.monotonic()
+        try:
+            yield
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            if _is_overload(e) or self._too_slow(time.monotonic() - started):
+                self._decrease()
+            raise
+        else:
+            self._on_success(time.monotonic() - started)
+        finally:
+            self._exit()
+
+    def _too_slow(self, elapsed: float) -> bool:
+        return self.baseline is not None and elapsed > self.baseline * self.latency_tolerance
+
+    def _on_success(self, elapsed: float) -> None:
+        if self._too_slow(elapsed):
+            self._decrease()
+        elif self.in_flight * 2 >= int(self.limit):
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._wake()
+        self.baseline = elapsed if self.baseline is None else 0.05 * elapsed + 0.95 * self.baseline
+
+    def _decrease(self) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < (self.baseline or 5.0):
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+        metrics.inc("adaptive_limiter.decreases", limiter=self.name)
+        print(f"Adaptive limiter {self.name} -> {int(self.limit)}")
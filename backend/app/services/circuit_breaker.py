@@ -0,0 +1,305 @@
+"""
+XC AI Design - 熔断器
+上游劣化时快速失败，避免 worker 和连接被超时请求长时间占用；状态经 Redis 跨进程共享
+"""
+
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+import httpx
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.redis import get_redis
+from app.services.upstream import UpstreamError
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# 统计窗口切成若干个桶，按桶过期
+_BUCKETS = 6
+
+# open 冷却结束或 half_open 探测超时（探测进程可能已退出）时，重新开始一轮探测；
+# half_open 状态下 opened_until 记录本轮探测开始时间
+_TRY_HALF_OPEN_LUA = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local probe_timeout = tonumber(ARGV[2])
+local state = redis.call('HGET', key, 'state')
+local opened_until = tonumber(redis.call('HGET', key, 'opened_until') or '0')
+if (state == 'open' and now >= opened_until)
+    or (state == 'half_open' and now >= opened_until + probe_timeout) then
+  redis.call('HSET', key, 'state', 'half_open', 'probes', 0, 'opened_until', now)
+  return 1
+end
+return 0
+"""
+
+
+class CircuitOpenError(UpstreamError):
+    """熔断器打开，请求被快速拒绝（可稍后重试）"""
+
+    def __init__(self, endpoint: str, retry_after: float):
+        super().__init__(
+            f"{endpoint} is temporarily unavailable (circuit open)",
+            status_code=503,
+            retryable=True,
+            retry_after=retry_after,
+        )
+        self.endpoint = endpoint
+
+
+def _is_failure(error: BaseException) -> bool:
+    """只有上游劣化类错误计入失败；客户端错误和本地限流不计入"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, UpstreamError):
+        return error.upstream_status is not None and error.upstream_status >= 500
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError))
+
+
+class _LocalStore:
+    """Redis 不可用时的进程内状态"""
+
+    def __init__(self):
+        self.states: dict[str, dict] = {}
+        self.buckets: dict[str, dict[int, list[int]]] = {}
+
+    async def get_state(self, endpoint: str) -> dict:
+        return self.states.setdefault(endpoint, {"state": CLOSED, "opened_until": 0.0, "probes": 0})
+
+    async def set_state(self, endpoint: str, state: str, opened_until: float = 0.0) -> None:
+        self.states[endpoint] = {"state": state, "opened_until": opened_until, "probes": 0}
+        if state == CLOSED:
+            self.buckets.pop(endpoint, None)
+
+    async def try_half_open(self, endpoint: str, now: float, probe_timeout: float) -> bool:
+        current = await self.get_state(endpoint)
+        if (current["state"] == OPEN and now >= current["opened_until"]) or (
+            current["state"] == HALF_OPEN and now >= current["opened_until"] + probe_timeout
+        ):
+            current.update(state=HALF_OPEN, probes=0, opened_until=now)
+            return True
+        return False
+
+    async def incr_probe(self, endpoint: str, amount: int = 1) -> int:
+        current = await self.get_state(endpoint)
+        current["probes"] += amount
+        return current["probes"]
+
+    async def record(self, endpoint: str, bucket: int, failure: bool, slow: bool) -> None:
+        buckets = self.buckets.setdefault(endpoint, {})
+        counts = buckets.setdefault(bucket, [0, 0, 0])
+        counts[0] += 1
+        counts[1] += int(failure)
+        counts[2] += int(slow)
+        for old in [b for b in buckets if b <= bucket - _BUCKETS]:
+            del buckets[old]
+
+    async def window(self, endpoint: str, bucket: int) -> tuple[int, int, int]:
+        buckets = self.buckets.get(endpoint, {})
+        totals = [0, 0, 0]
+        for b in range(bucket - _BUCKETS + 1, bucket + 1):
+            for i, value in enumerate(buckets.get(b, [0, 0, 0])):
+                totals[i] += value
+        return totals[0], totals[1], totals[2]
+
+
+class _RedisStore:
+    """跨进程共享的状态"""
+
+    def __init__(self, window_seconds: float):
+        self.ttl = int(window_seconds * 2) + 1
+
+    @staticmethod
+    def _key(endpoint: str) -> str:
+        return f"breaker:{endpoint}"
+
+    async def get_state(self, endpoint: str) -> dict:
+        data = await get_redis().hgetall(self._key(endpoint))
+        return {
+            "state": data.get("state", CLOSED),
+            "opened_until": float(data.get("opened_until", 0)),
+            "probes": int(data.get("probes", 0)),
+        }
+
+    async def set_state(self, endpoint: str, state: str, opened_until: float = 0.0) -> None:
+        redis = get_redis()
+        await redis.hset(
+            self._key(endpoint),
+            mapping={"state": state, "opened_until": opened_until, "probes": 0},
+        )
+        if state == CLOSED:
+            keys = [k async for k in redis.scan_iter(f"{self._key(endpoint)}:b:*")]
+            if keys:
+                await redis.delete(*keys)
+
+    async def try_half_open(self, endpoint: str, now: float, probe_timeout: float) -> bool:
+        return bool(int(await get_redis().eval(
+            _TRY_HALF_OPEN_LUA, 1, self._key(endpoint), now, probe_timeout
+        )))
+
+    async def incr_probe(self, endpoint: str, amount: int = 1) -> int:
+        return int(await get_redis().hincrby(self._key(endpoint), "probes", amount))
+
+    async def record(self, endpoint: str, bucket: int, failure: bool, slow: bool) -> None:
+        key = f"{self._key(endpoint)}:b:{bucket}"
+        pipe = get_redis().pipeline()
+        pipe.hincrby(key, "total", 1)
+        if failure:
+            pipe.hincrby(key, "failures", 1)
+        if slow:
+            pipe.hincrby(key, "slow", 1)
+        pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+    async def window(self, endpoint: str, bucket: int) -> tuple[int, int, int]:
+        pipe = get_redis().pipeline()
+        for b in range(bucket - _BUCKETS + 1, bucket + 1):
+            pipe.hgetall(f"{self._key(endpoint)}:b:{b}")
+        totals = [0, 0, 0]
+        for data in await pipe.execute():
+            totals[0] += int(data.get("total", 0))
+            totals[1] += int(data.get("failures", 0))
+            totals[2] += int(data.get("slow", 0))
+        return totals[0], totals[1], totals[2]
+
+
+class CallHandle:
+    """单次受保护调用；进入限流排队后调用 start() 让延迟只统计上游耗时"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.is_probe = False
+
+    def start(self) -> None:
+        self.started = time.monotonic()
+
+
+class CircuitBreaker:
+    """按 endpoint 的熔断器
+
+    - closed：正常放行，按时间窗口统计错误率与慢调用率
+    - open：错误率或慢调用率超过阈值后打开，直接抛出 CircuitOpenError
+    - half_open：冷却结束后只放行少量探测请求，成功则关闭，失败则重新打开
+    """
+
+    def __init__(self):
+        self.enabled = settings.CIRCUIT_BREAKER_ENABLED
+        self.window_seconds = settings.CIRCUIT_WINDOW_SECONDS
+        self.bucket_seconds = self.window_seconds / _BUCKETS
+        self._redis_store = _RedisStore(self.window_seconds)
+        self._local_store = _LocalStore()
+        # 本地缓存状态，避免每次调用都访问 Redis
+        self._cache: dict[str, tuple[float, dict]] = {}
+        self._cache_seconds = 1.0
+        self._redis_retry_at = 0.0
+
+    async def _store_call(self, method: str, *args):
+        if time.monotonic() >= self._redis_retry_at:
+            try:
+                return await getattr(self._redis_store, method)(*args)
+            except Exception as e:
+                metrics.inc("circuit_breaker.redis_errors")
+                print(f"Circuit breaker falling back to in-process state: {e}")
+                self._redis_retry_at = time.monotonic() + 30
+        return await getattr(self._local_store, method)(*args)
+
+    async def _state(self, endpoint: str) -> dict:
+        cached = self._cache.get(endpoint)
+        now = time.monotonic()
+        if cached and now - cached[0] < self._cache_seconds:
+            return cached[1]
+        state = await self._store_call("get_state", endpoint)
+        self._cache[endpoint] = (now, state)
+        return state
+
+    async def _transition(self, endpoint: str, state: str, opened_until: float = 0.0) -> None:
+        await self._store_call("set_state", endpoint, state, opened_until)
+        self._cache.pop(endpoint, None)
+        metrics.inc("circuit_breaker.transitions", endpoint=endpoint, to=state)
+        print(f"Circuit breaker {endpoint} -> {state}")
+
+    async def _before(self, endpoint: str, handle: CallHandle) -> None:
+        state = await self._state(endpoint)
+        now = time.time()
+        if state["state"] == CLOSED:
+            return
+        if state["state"] == OPEN:
+            if now < state["opened_until"]:
+                metrics.inc("circuit_breaker.rejected", endpoint=endpoint)
+                raise CircuitOpenError(endpoint, retry_after=state["opened_until"] - now)
+        await self._store_call(
+            "try_half_open", endpoint, now, settings.CIRCUIT_PROBE_TIMEOUT_SECONDS
+        )
+        self._cache.pop(endpoint, None)
+        # half_open：限制探测请求数量
+        probes = await self._store_call("incr_probe", endpoint)
+        if probes > settings.CIRCUIT_HALF_OPEN_PROBES:
+            metrics.inc("circuit_breaker.rejected", endpoint=endpoint)
+            raise CircuitOpenError(endpoint, retry_after=settings.CIRCUIT_OPEN_SECONDS / 2)
+        handle.is_probe = True
+
+    async def _after(self, endpoint: str, handle: CallHandle, error: BaseException | None) -> None:
+        elapsed = time.monotonic() - handle.started
+        slow_threshold = settings.CIRCUIT_SLOW_CALL_SECONDS.get(endpoint)
+        slow = slow_threshold is not None and elapsed > slow_threshold
+        failure = error is not None and _is_failure(error)
+        if error is not None and not failure and not handle.is_probe:
+            return
+
+        if handle.is_probe:
+            if failure or slow:
+                await self._transition(endpoint, OPEN, time.time() + settings.CIRCUIT_OPEN_SECONDS)
+            elif error is None or isinstance(error, (UpstreamError, httpx.HTTPStatusError)):
+                # 上游正常应答（包括 4xx），说明已恢复
+                await self._transition(endpoint, CLOSED)
+            else:
+                # 探测被取消等与上游无关的情况：归还探测名额
+                await self._store_call("incr_probe", endpoint, -1)
+            return
+
+        bucket = int(time.time() // self.bucket_seconds)
+        await self._store_call("record", endpoint, bucket, failure, slow)
+        if not (failure or slow):
+            return
+
+        total, failures, slow_calls = await self._store_call("window", endpoint, bucket)
+        if total < settings.CIRCUIT_MIN_REQUESTS:
+            return
+        if (
+            failures / total >= settings.CIRCUIT_ERROR_RATE
+            or slow_calls / total >= settings.CIRCUIT_SLOW_RATE
+        ):
+            await self._transition(endpoint, OPEN, time.time() + settings.CIRCUIT_OPEN_SECONDS)
+
+    @asynccontextmanager
+    async def guard(self, endpoint: str) -> AsyncIterator[CallHandle]:
+        """保护一次上游调用；熔断打开时立即抛出 CircuitOpenError"""
+        handle = CallHandle()
+        if not self.enabled:
+            yield handle
+            return
+
+        await self._before(endpoint, handle)
+        try:
+            yield handle
+        except BaseException as e:
+            await self._after(endpoint, handle, e)
+            raise
+        await self._after(endpoint, handle, None)
+
+    async def status(self) -> dict:
+        """各 endpoint 当前状态（用于健康检查）"""
+        result = {}
+        for endpoint in ("chat", "image"):
+            state = await self._store_call("get_state", endpoint)
+            result[endpoint] = {
+                "state": state["state"],
+                "retry_after": max(0.0, round(state["opened_until"] - time.time(), 1))
+                if state["state"] == OPEN else 0.0,
+            }
+        return result
+
+
+circuit_breaker = CircuitBreaker()
@@ -0,0 +1,113 @@
+"""
+XC AI Design - 积分账本
+预扣与退还都是单条条件 UPDATE ... RETURNING，不在 Python 中读改写余额；
+每次变动记录一条流水，由调用方在同一事务内提交
+"""
+
+import uuid
+from uuid import UUID
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.models.credit import CreditEntryKind, CreditLedgerEntry
+from app.models.task import Task, TaskType
+from app.models.user import User
+
+
+class InsufficientCredits(Exception):
+    """余额不足以预扣"""
+
+
+def task_cost(task_type: str) -> int:
+    """任务类型的完整积分价格"""
+    return {
+        TaskType.GENESIS.value: settings.CREDIT_COST_GENESIS,
+        TaskType.MIRROR.value: settings.CREDIT_COST_MIRROR,
+        TaskType.REFINEMENT.value: settings.CREDIT_COST_REFINEMENT,
+        # Batch endpoints have never been charged
+        TaskType.BATCH_FUSE.value: 0,
+        TaskType.BATCH_QUICK_TRANSFER.value: 0,
+    }[task_type]
+
+
+class CreditLedger:
+    """任务积分的预扣与退还
+
+    - reserve：余额充足时原子扣减并把任务加入同一事务，并发提交不会超扣
+    - refund：退还任务持有积分中未交付的部分，task.credits_used 同步减少，
+      因此退还总额不会超过预扣总额
+    - 任务完成时预扣的积分即为最终扣费，无需额外操作
+    """
+
+    async def reserve(self, db: AsyncSession, user_id: UUID, amount: int, task: Task) -> int:
+        """预扣 amount 积分并登记到 task；返回扣减后的余额，余额不足时抛出 InsufficientCredits"""
+        result = await db.execute(
+            update(User)
+            .where(User.id == user_id, User.credits >= amount)
+            .values(credits=User.credits - amount)
+            .returning(User.credits)
+            .execution_options(synchronize_session=False)
+        )
+        balance = result.scalar_one_or_none()
+        if balance is None:
+            metrics.inc("credits.rejected")
+            raise InsufficientCredits()
+
+        if task.id is None:
+            task.id = uuid.uuid4()
+            db.add(task)
+        task.credits_used = (task.credits_used or 0) + amount
+        db.add(CreditLedgerEntry(
+            user_id=user_id,
+            task_id=task.id,
+            kind=CreditEntryKind.RESERVE.value,
+            amount=-amount,
+            balance_after=balance,
+        ))
+        metrics.inc("credits.reserved", amount)
+        return balance
+
+    async def refund(self, db: AsyncSession, task: Task, amount: int, reason: str) -> int:
+        """退还任务持有的 amount 积分（以持有量为上限）；返回实际退还的积分"""
+        amount = min(amount, task.credits_used)
+        if amount <= 0:
+            return 0
+
+        result = await db.execute(
+            update(User)
+            .where(User.id == task.user_id)
+            .values(credits=User.credits + amount)
+            .returning(User.credits)
+            .execution_options(synchronize_session=False)
+        )
+        task.credits_used -= amount
+        db.add(CreditLedgerEntry(
+            user_id=task.user_id,
+            task_id=task.id,
+            kind=CreditEntryKind.REFUND.value,
+            amount=amount,
+            balance_after=result.scalar_one(),
+            reason=reason[:255],
+        ))
+        metrics.inc("credits.refunded", amount)
+        return amount
+
+    async def refund_undelivered(
+        self, db: AsyncSession, task: Task, delivered: int, requested: int, reason: str
+    ) -> int:
+        """只保留已交付图片对应的费用，其余全部退还"""
+        cost = task_cost(task.type)
+        charge = cost - cost * (requested - delivered) // max(requested, 1)
+        return await self.refund(db, task, task.credits_used - charge, reason)
+
+    async def reserve_remaining(self, db: AsyncSession, task: Task) -> int:
+        """重新执行前补齐此前退还的积分；返回补扣的积分"""
+        missing = task_cost(task.type) - task.credits_used
+        if missing <= 0:
+            return 0
+        await self.reserve(db, task.user_id, missing, task)
+        return missing
+
+
+credit_ledger = CreditLedger()
@@ -5,8 +5,18 @@ XC AI Design - Gemini 服务层
 
 import httpx
 import json
-from typing import Optional
-from app.core.config import settings
+import time
+from typing import Awaitable, Callable, Optional
+from app.core.deadline import call_timeout, within_deadline
+from app.core.json_stream import IncrementalJSONParser
+from app.core.metrics import metrics
+from app.core.prompt_context import build_context, estimate_tokens
+from app.services.circuit_breaker import circuit_breaker
+from app.services.model_router import ModelRoute, model_router
+from app.services.provider_pool import provider_pool
+from app.services.rate_limiter import rate_limiter
+from app.services.resilience import resilience
+from app.services.upstream import raise_for_upstream
 from app.core.prompts import (
     ECOMMERCE_VISUAL_MASTER,
     STYLE_DNA_ANALYST,
@@ -24,35 +34,180 @@ from app.core.prompts import (
 class GeminiService:
     """增强版 Gemini 服务"""
 
-    def __init__(self):
-        self.api_url = settings.YUNWU_API_URL
-        self.api_key = settings.YUNWU_API_KEY
-        self.model = "gemini-2.5-pro-exp-03-25"
-
     async def _call_api(
         self, 
         messages: list, 
-        max_tokens: int = 4000,
-        temperature: float = 0.7
+        method: str = "chat",
+        temperature: Optional[float] = 0.7
     ) -> str:
-        """统一的 API 调用方法"""
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                f"{self.api_url}/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "model": self.model,
-                    "messages": messages,
-                    "max_tokens": max_tokens,
-                    "temperature": temperature,
-                },
+        """统一的 API 调用方法
+        
+        method 决定模型、max_tokens 与超时（见 MODEL_ROUTES），
+        同时用于指标标签，记录每次调用的模型、输入/输出大小与耗时
+        """
+        route = model_router.route(method)
+        payload = self._build_payload(route, messages, temperature)
+
+        started = time.monotonic()
+        # 每次尝试的超时不超过整体截止时间的剩余部分
+        async with within_deadline():
+            result = await self._routed(
+                route,
+                lambda: resilience.call(
+                    "chat", lambda: self._post_completion(payload, call_timeout(route.timeout))
+                ),
             )
-            response.raise_for_status()
-            result = response.json()
-            return result.get("choices", [{}])[0].get("message", {}).get("content", "")
+        content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
+
+        self._record_call(route, messages, content, result.get("usage") or {}, time.monotonic() - started)
+        return content
+
+    def _build_payload(self, route: ModelRoute, messages: list, temperature: Optional[float]) -> dict:
+        payload = {
+            "model": route.model,
+            "messages": messages,
+            "max_tokens": route.max_tokens,
+        }
+        if temperature is not None:
+            payload["temperature"] = temperature
+        return payload
+
+    async def _routed(self, route: ModelRoute, call: Callable[[], Awaitable]):
+        """执行调用并把耗时计入该模型的延迟统计（超时也计入，以便及时切换）"""
+        started = time.monotonic()
+        try:
+            result = await call()
+        except httpx.TimeoutException:
+            model_router.observe(route, time.monotonic() - started)
+            raise
+        model_router.observe(route, time.monotonic() - started)
+        return result
+
+    async def _post_completion(self, payload: dict, timeout: float) -> dict:
+        """单次 chat/completions 请求（受熔断与限流控制）"""
+        async with (
+            circuit_breaker.guard("chat") as call,
+            provider_pool.lease("chat") as provider,
+            rate_limiter.acquire("chat", scope=provider.name),
+        ):
+            call.start()
+            async with httpx.AsyncClient(timeout=timeout) as client:
+                response = await client.post(
+                    f"{provider.api_url}/chat/completions",
+                    headers=provider.headers({"Content-Type": "application/json"}),
+                    json=payload,
+                )
+                raise_for_upstream(response, "chat")
+                return response.json()
+
+    async def _call_api_stream(
+        self,
+        messages: list,
+        on_section: Callable[[str, object], Awaitable],
+        method: str = "chat",
+        temperature: Optional[float] = 0.7
+    ) -> str:
+        """流式调用（SSE），顶层 JSON 字段一完成即回调 on_section(key, value)
+        
+        返回完整的输出文本，与 _call_api 一致
+        """
+        route = model_router.route(method)
+        payload = self._build_payload(route, messages, temperature)
+        payload["stream"] = True
+
+        started = time.monotonic()
+        # 流式输出无法对冲；重试时已推送的字段会再推送一次，最终结果不受影响
+        async with within_deadline():
+            content, usage = await self._routed(
+                route,
+                lambda: resilience.call(
+                    "chat_stream",
+                    lambda: self._stream_completion(payload, call_timeout(route.timeout), on_section),
+                    hedge=False,
+                ),
+            )
+        self._record_call(route, messages, content, usage, time.monotonic() - started)
+        return content
+
+    async def _stream_completion(
+        self,
+        payload: dict,
+        timeout: float,
+        on_section: Callable[[str, object], Awaitable]
+    ) -> tuple[str, dict]:
+        """单次流式请求，返回 (完整文本, usage)"""
+        parser = IncrementalJSONParser()
+        parts: list[str] = []
+        usage: dict = {}
+        async with (
+            circuit_breaker.guard("chat") as call,
+            provider_pool.lease("chat") as provider,
+            rate_limiter.acquire("chat", scope=provider.name),
+        ):
+            call.start()
+            async with httpx.AsyncClient(timeout=timeout) as client:
+                async with client.stream(
+                    "POST",
+                    f"{provider.api_url}/chat/completions",
+                    headers=provider.headers({
+                        "Content-Type": "application/json",
+                        "Accept": "text/event-stream",
+                    }),
+                    json=payload,
+                ) as response:
+                    raise_for_upstream(response, "chat")
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        try:
+                            chunk = json.loads(data)
+                        except json.JSONDecodeError:
+                            continue
+                        usage = chunk.get("usage") or usage
+                        choices = chunk.get("choices") or [{}]
+                        delta = (choices[0].get("delta") or {}).get("content")
+                        if not delta:
+                            continue
+                        parts.append(delta)
+                        for key, value in parser.feed(delta):
+                            await on_section(key, value)
+
+        return "".join(parts), usage
+
+    def _record_call(
+        self,
+        route: ModelRoute,
+        messages: list,
+        content: str,
+        usage: dict,
+        elapsed: float
+    ) -> None:
+        """记录单次调用的输入输出大小与耗时"""
+        prompt_text = "".join(
+            m["content"] if isinstance(m["content"], str)
+            else "".join(part.get("text", "") for part in m["content"])
+            for m in messages
+        )
+        method = route.method
+        stats = {
+            "method": method,
+            "model": route.model,
+            "fallback": route.fallback,
+            "input_chars": len(prompt_text),
+            "input_tokens_est": estimate_tokens(prompt_text),
+            "output_chars": len(content),
+            "output_tokens_est": estimate_tokens(content),
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens"),
+            "latency_ms": int(elapsed * 1000),
+        }
+        metrics.record_event("llm_call", stats)
+        metrics.observe("llm.input_tokens", stats["prompt_tokens"] or stats["input_tokens_est"], method=method)
+        metrics.observe("llm.output_tokens", stats["completion_tokens"] or stats["output_tokens_est"], method=method)
+        metrics.observe("llm.latency_seconds", elapsed, method=method, model=route.model)
 
     def _parse_json_response(self, result: str) -> dict:
         """健壮的 JSON 解析"""
@@ -69,8 +224,16 @@ class GeminiService:
             # 如果解析失败，返回原始结果
             return {"raw_response": result}
 
-    async def analyze_product_deep(self, image_url: str) -> dict:
-        """深度产品分析 - 360°全方位分析"""
+    async def analyze_product_deep(
+        self,
+        image_url: str,
+        on_section: Optional[Callable[[str, object], Awaitable]] = None
+    ) -> dict:
+        """深度产品分析 - 360°全方位分析
+        
+        on_section: 提供时使用流式输出，basic_info、selling_points 等
+        顶层字段一完成即回调，最终仍返回完整结果
+        """
         messages = [
             {"role": "system", "content": ECOMMERCE_VISUAL_MASTER},
             {
@@ -82,7 +245,12 @@ class GeminiService:
             }
         ]
         
-        result = await self._call_api(messages, max_tokens=4000)
+        if on_section:
+            result = await self._call_api_stream(
+                messages, on_section, method="analyze_product_deep"
+            )
+        else:
+            result = await self._call_api(messages, method="analyze_product_deep")
         return self._parse_json_response(result)
 
     async def generate_detail_page_plan(
@@ -94,7 +262,7 @@ class GeminiService:
     ) -> dict:
         """生成详情页结构规划"""
         prompt = DETAIL_PAGE_STRUCTURE.format(
-            product_analysis=json.dumps(product_analysis, ensure_ascii=False, indent=2),
+            product_analysis=build_context("product", "detail_page_plan", product_analysis),
             count=count,
             platform=platform,
             aspect_ratio=aspect_ratio
@@ -105,9 +273,45 @@ class GeminiService:
             {"role": "user", "content": prompt}
         ]
         
-        result = await self._call_api(messages, max_tokens=6000)
+        result = await self._call_api(messages, method="generate_detail_page_plan")
         return self._parse_json_response(result)
 
+    async def generate_image_prompt(self, img: dict, product_info: dict) -> dict:
+        """为详情页规划中的单张图片生成提示词"""
+        prompt_request = IMAGE_GENERATION_PROMPT_TEMPLATE.format(
+            role=img.get("role", "产品展示"),
+            purpose=img.get("purpose", "展示产品"),
+            composition=img.get("visual_composition", "中心构图"),
+            mood=img.get("lighting_mood", "专业商业"),
+            product_info=build_context("product", "image_prompt", product_info)
+        )
+        
+        messages = [
+            {"role": "system", "content": ECOMMERCE_VISUAL_MASTER},
+            {"role": "user", "content": prompt_request}
+        ]
+        
+        result = await self._call_api(messages, method="generate_image_prompt", temperature=0.8)
+        
+        prompt_data = {
+            "order": img.get("order", 0),
+            "role": img.get("role", ""),
+            "prompt": "",
+            "negative_prompt": "",
+            "text_overlay": img.get("text_overlay", {})
+        }
+        
+        # 解析 Prompt 和 Negative
+        if "Prompt:" in result:
+            parts = result.split("Negative:")
+            prompt_data["prompt"] = parts[0].replace("Prompt:", "").strip()
+            if len(parts) > 1:
+                prompt_data["negative_prompt"] = parts[1].strip()
+        else:
+            prompt_data["prompt"] = result.strip()
+        
+        return prompt_data
+
     async def generate_image_prompts(
         self,
         page_plan: dict,
@@ -118,44 +322,19 @@ class GeminiService:
         image_sequence = page_plan.get("image_sequence", [])
         
         for img in image_sequence:
-            prompt_request = IMAGE_GENERATION_PROMPT_TEMPLATE.format(
-                role=img.get("role", "产品展示"),
-                purpose=img.get("purpose", "展示产品"),
-                composition=img.get("visual_composition", "中心构图"),
-                mood=img.get("lighting_mood", "专业商业"),
-                product_info=json.dumps(product_info, ensure_ascii=False)
-            )
-            
-            messages = [
-                {"role": "system", "content": ECOMMERCE_VISUAL_MASTER},
-                {"role": "user", "content": prompt_request}
-            ]
-            
-            result = await self._call_api(messages, max_tokens=1000, temperature=0.8)
-            
-            prompt_data = {
-                "order": img.get("order", 0),
-                "role": img.get("role", ""),
-                "prompt": "",
-                "negative_prompt": "",
-                "text_overlay": img.get("text_overlay", {})
-            }
-            
-            # 解析 Prompt 和 Negative
-            if "Prompt:" in result:
-                parts = result.split("Negative:")
-                prompt_data["prompt"] = parts[0].replace("Prompt:", "").strip()
-                if len(parts) > 1:
-                    prompt_data["negative_prompt"] = parts[1].strip()
-            else:
-                prompt_data["prompt"] = result.strip()
-            
-            prompts.append(prompt_data)
+            prompts.append(await self.generate_image_prompt(img, product_info))
         
         return prompts
 
-    async def extract_style_dna(self, style_image_url: str) -> dict:
-        """深度风格DNA提取"""
+    async def extract_style_dna(
+        self,
+        style_image_url: str,
+        on_section: Optional[Callable[[str, object], Awaitable]] = None
+    ) -> dict:
+        """深度风格DNA提取
+        
+        on_section: 提供时使用流式输出，color_dna 等顶层字段一完成即回调
+        """
         messages = [
             {"role": "system", "content": STYLE_DNA_ANALYST},
             {
@@ -167,19 +346,32 @@ class GeminiService:
             }
         ]
         
-        result = await self._call_api(messages, max_tokens=5000)
+        if on_section:
+            result = await self._call_api_stream(
+                messages, on_section, method="extract_style_dna"
+            )
+        else:
+            result = await self._call_api(messages, method="extract_style_dna")
         return self._parse_json_response(result)
 
+    def serialize_style_dna(self, style_dna: dict) -> str:
+        """序列化风格DNA，批量融合时只需执行一次"""
+        return build_context("style", "style_fusion", style_dna)
+
     async def fuse_style_with_product(
         self,
         style_dna: dict,
         product_info: dict,
-        product_image_url: str
+        product_image_url: str,
+        style_dna_json: Optional[str] = None
     ) -> dict:
-        """风格融合"""
+        """风格融合
+        
+        style_dna_json: 预先序列化的风格DNA（批量场景复用，避免重复序列化）
+        """
         prompt = STYLE_FUSION_PROMPT.format(
-            style_dna=json.dumps(style_dna, ensure_ascii=False, indent=2),
-            product_info=json.dumps(product_info, ensure_ascii=False, indent=2),
+            style_dna=style_dna_json or self.serialize_style_dna(style_dna),
+            product_info=build_context("product", "style_fusion", product_info),
             product_image_url=product_image_url
         )
         
@@ -188,7 +380,7 @@ class GeminiService:
             {"role": "user", "content": prompt}
         ]
         
-        result = await self._call_api(messages, max_tokens=2000)
+        result = await self._call_api(messages, method="fuse_style_with_product")
         return self._parse_json_response(result)
 
     async def assess_quality(self, generated_image_url: str, original_prompt: str) -> dict:
@@ -204,7 +396,7 @@ class GeminiService:
             }
         ]
         
-        result = await self._call_api(messages, max_tokens=2000)
+        result = await self._call_api(messages, method="assess_quality")
         return self._parse_json_response(result)
 
     async def generate_multilingual_copy(
@@ -217,7 +409,7 @@ class GeminiService:
             target_languages = ["en", "ja", "ko", "de", "fr"]
             
         prompt = MULTILINGUAL_COPY.format(
-            product_info=json.dumps(product_info, ensure_ascii=False, indent=2),
+            product_info=build_context("product", "multilingual_copy", product_info),
             target_languages=", ".join(target_languages)
         )
         
@@ -226,14 +418,18 @@ class GeminiService:
             {"role": "user", "content": prompt}
         ]
         
-        result = await self._call_api(messages, max_tokens=4000)
+        result = await self._call_api(messages, method="generate_multilingual_copy")
         return self._parse_json_response(result)
 
     # ========== 兼容旧版方法 ==========
     
-    async def analyze_product(self, image_url: str) -> dict:
+    async def analyze_product(
+        self,
+        image_url: str,
+        on_section: Optional[Callable[[str, object], Awaitable]] = None
+    ) -> dict:
         """兼容旧版 - 产品分析（简化版）"""
-        return await self.analyze_product_deep(image_url)
+        return await self.analyze_product_deep(image_url, on_section=on_section)
 
     async def generate_copywriting(
         self, 
@@ -242,43 +438,33 @@ class GeminiService:
         count: int
     ) -> list[str]:
         """兼容旧版 - 生成文案提示词"""
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                f"{self.api_url}/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "model": self.model,
-                    "messages": [
-                        {"role": "system", "content": ECOMMERCE_VISUAL_MASTER},
-                        {
-                            "role": "user",
-                            "content": f"""基于以下产品信息，生成{count}条用于AI图片生成的英文提示词。
+        messages = [
+            {"role": "system", "content": ECOMMERCE_VISUAL_MASTER},
+            {
+                "role": "user",
+                "content": f"""基于以下产品信息，生成{count}条用于AI图片生成的英文提示词。
 风格要求：{style}
 
-产���信息：
-{json.dumps(product_info, ensure_ascii=False)}
+产品信息：
+{build_context("product", "copywriting", product_info)}
 
 要求：
 1. 每条提示词用换行分隔
 2. 提示词要详细描述场景、光线、角度、氛围
 3. 适合电商产品展示
 4. 用英文输出""",
-                        }
-                    ],
-                    "max_tokens": 2000,
-                },
-            )
-            response.raise_for_status()
-            result = response.json()
-            content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
-            return [p.strip() for p in content.split("\n") if p.strip()][:count]
+            }
+        ]
+        content = await self._call_api(messages, method="generate_copywriting", temperature=None)
+        return [p.strip() for p in content.split("\n") if p.strip()][:count]
 
-    async def extract_style(self, style_image_url: str) -> dict:
+    async def extract_style(
+        self,
+        style_image_url: str,
+        on_section: Optional[Callable[[str, object], Awaitable]] = None
+    ) -> dict:
         """兼容旧版 - 风格提取（简化版）"""
-        return await self.extract_style_dna(style_image_url)
+        return await self.extract_style_dna(style_image_url, on_section=on_section)
 
 
 gemini_service = GeminiService()
@@ -0,0 +1,142 @@
+"""
+XC AI Design - Studio Genesis 流水线
+提示词生成与图片生成并行推进：每条提示词写好后立即进入生图队列
+"""
+
+from typing import Awaitable, Callable, Optional
+from app.core.config import settings
+from app.core.concurrency import run_two_stage_pipeline
+from app.core.deadline import DeadlineExceeded
+from app.services.gemini_service import gemini_service
+from app.services.nanobana_service import nano_banana_service
+
+# 整体进度中提示词阶段所占权重，其余归图片生成
+PROMPT_STAGE_WEIGHT = 0.2
+
+
+class GenesisPipeline:
+    """提示词 → 图片 的生产者/消费者流水线
+
+    - 提示词 worker 并发调用 generate_image_prompt，结果写入有界队列
+    - 图片 worker 从队列取出提示词立即生成图片
+    - 队列满时提示词 worker 阻塞，避免提示词远远跑在生图前面（背压）
+    - 最终结果按 order 排序返回
+    """
+
+    def __init__(
+        self,
+        prompt_concurrency: int | None = None,
+        image_concurrency: int | None = None,
+        queue_size: int | None = None,
+    ):
+        self.prompt_concurrency = prompt_concurrency or settings.GENESIS_PROMPT_CONCURRENCY
+        self.image_concurrency = image_concurrency or settings.GENESIS_IMAGE_CONCURRENCY
+        self.queue_size = queue_size or settings.GENESIS_PIPELINE_QUEUE_SIZE
+
+    async def run(
+        self,
+        page_plan: dict,
+        product_info: dict,
+        base_image_url: Optional[str] = None,
+        aspect_ratio: str = "3:4",
+        on_progress: Optional[Callable[[dict], Awaitable]] = None,
+    ) -> list[dict]:
+        """执行流水线
+
+        Args:
+            page_plan: 详情页规划（含 image_sequence）
+            product_info: 产品分析结果
+            base_image_url: 基础产品图URL
+            aspect_ratio: 默认宽高比
+            on_progress: 进度回调，接收一个进度事件字典
+
+        Returns:
+            按 order 排序的生成结果列表；截止时间到达时未完成的项带 deadline_exceeded 标记
+        """
+        image_sequence = page_plan.get("image_sequence", [])
+        total = len(image_sequence)
+        if total == 0:
+            return []
+
+        items = [(img.get("order") or i + 1, img) for i, img in enumerate(image_sequence)]
+        prompted: set[int] = set()
+        counters = {"prompts": 0, "images": 0}
+
+        async def report(stage: str, order: int, image_url=None, error=None):
+            if not on_progress:
+                return
+            overall = (
+                counters["prompts"] * PROMPT_STAGE_WEIGHT
+                + counters["images"] * (1 - PROMPT_STAGE_WEIGHT)
+            ) / total
+            await on_progress({
+                "stage": stage,
+                "progress": int(overall * 100),
+                "current": order,
+                "total": total,
+                "prompts_ready": counters["prompts"],
+                "images_done": counters["images"],
+                "image_url": image_url,
+                "error": error,
+            })
+
+        async def write_prompt(item):
+            _, img = item
+            return await gemini_service.generate_image_prompt(img, product_info)
+
+        async def render_image(item, prompt_data):
+            order, _ = item
+            return await nano_banana_service.generate_from_prompt(
+                prompt_data,
+                order=order,
+                base_image_url=base_image_url,
+                aspect_ratio=aspect_ratio,
+            )
+
+        async def on_prompt_done(index: int, _prompt_data):
+            prompted.add(index)
+            counters["prompts"] += 1
+            await report("prompting", items[index][0])
+
+        async def on_item_done(index: int, result, error):
+            order = items[index][0]
+            if index not in prompted:
+                # 提示词失败的图片两个阶段都算完成
+                counters["prompts"] += 1
+                counters["images"] += 1
+                await report("prompting", order, error=str(error))
+                return
+            counters["images"] += 1
+            if error:
+                await report("generating", order, error=str(error))
+            else:
+                await report("generating", order, image_url=result["url"])
+
+        outcomes = await run_two_stage_pipeline(
+            items,
+            first_stage=write_prompt,
+            second_stage=render_image,
+            first_concurrency=self.prompt_concurrency,
+            second_concurrency=self.image_concurrency,
+            queue_size=self.queue_size,
+            on_first_done=on_prompt_done,
+            on_item_done=on_item_done,
+        )
+
+        results = []
+        for (order, img), (result, error) in zip(items, outcomes):
+            if error is None:
+                results.append(result)
+            else:
+                results.append({
+                    "order": order,
+                    "role": img.get("role", ""),
+                    "error": str(error),
+                    "url": None,
+                    "success": False,
+                    "deadline_exceeded": isinstance(error, DeadlineExceeded),
+                })
+        return sorted(results, key=lambda r: r["order"])
+
+
+genesis_pipeline = GenesisPipeline()
@@ -0,0 +1,242 @@
+"""
+XC AI Design - 产品图近似去重服务
+基于感知哈希 (dHash) 复用已经分析过的产品图结果；
+进程内只保存哈希索引，分析结果存放在 Redis
+"""
+
+import asyncio
+import io
+import json
+from array import array
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+from urllib.parse import urlsplit
+import httpx
+from PIL import Image
+from app.core.config import settings
+from app.core.redis import get_redis
+
+HASH_BITS = 64
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+
+
+def compute_dhash(data: bytes) -> int:
+    """计算 64 位 dHash（差值哈希）
+
+    缩放为 9x8 灰度图后比较相邻像素，对重新编码、缩放、改名都不敏感。
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        img = img.convert("L").resize((9, 8), Image.Resampling.LANCZOS)
+        pixels = list(img.getdata())
+
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+class HammingIndex:
+    """紧凑的 64 位哈希索引，支持按汉明距离查找近似项
+
+    哈希按插入顺序存放在 array('Q') 中，不保存其他数据。查找采用 multi-index hashing：
+    将 64 位切成 threshold + 1 段，距离不超过 threshold 的两个哈希
+    至少有一段完全相同，因此只需校验同段的候选项。
+    """
+
+    def __init__(self, threshold: int, max_entries: int):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._hashes = array("Q")
+        self._bands = self._build_bands(threshold)
+        self._buckets: list[dict[int, array]] = [{} for _ in self._bands]
+
+    @staticmethod
+    def _build_bands(threshold: int) -> list[tuple[int, int]]:
+        """返回每段的 (shift, mask)；阈值过大时退化为线性扫描"""
+        count = threshold + 1
+        if count > 16:
+            return []
+        bands = []
+        shift = 0
+        for i in range(count):
+            width = HASH_BITS // count + (1 if i < HASH_BITS % count else 0)
+            bands.append((shift, (1 << width) - 1))
+            shift += width
+        return bands
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def add(self, value: int) -> None:
+        if len(self._hashes) >= self.max_entries:
+            self._evict_oldest(max(1, self.max_entries // 10))
+        self._index(len(self._hashes), value)
+        self._hashes.append(value)
+
+    def find(self, value: int) -> Optional[tuple[int, int]]:
+        """返回距离最近且不超过阈值的 (已索引的哈希, distance)"""
+        if self._bands:
+            candidates = set()
+            for (shift, mask), buckets in zip(self._bands, self._buckets):
+                bucket = buckets.get((value >> shift) & mask)
+                if bucket:
+                    candidates.update(bucket)
+        else:
+            candidates = range(len(self._hashes))
+
+        best_idx, best_distance = -1, self.threshold + 1
+        for idx in candidates:
+            distance = (self._hashes[idx] ^ value).bit_count()
+            if distance > self.threshold:
+                continue
+            # 距离相同时优先最新的结果
+            if distance < best_distance or (distance == best_distance and idx > best_idx):
+                best_idx, best_distance = idx, distance
+        if best_idx < 0:
+            return None
+        return self._hashes[best_idx], best_distance
+
+    def _index(self, idx: int, value: int) -> None:
+        for (shift, mask), buckets in zip(self._bands, self._buckets):
+            key = (value >> shift) & mask
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = array("I")
+            bucket.append(idx)
+
+    def _evict_oldest(self, count: int) -> None:
+        """丢弃最旧的 count 项并重建分段索引"""
+        self._hashes = self._hashes[count:]
+        self._buckets = [{} for _ in self._bands]
+        for idx, value in enumerate(self._hashes):
+            self._index(idx, value)
+
+
+def _analysis_key(scope: str, image_hash: int) -> str:
+    return f"product_analysis:{scope}:{image_hash:016x}"
+
+
+class ProductAnalysisDedup:
+    """按用户隔离的产品分析复用缓存
+
+    - 进程内每个用户一个哈希索引，用户数按 LRU 限制在 PRODUCT_DEDUP_MAX_USERS 以内
+    - 分析结果按 (用户, 哈希) 存入 Redis，带 TTL；Redis 中已过期的命中按未命中处理
+    - 索引只在本进程内：其他 worker 或重启前分析过的图片不会命中（结果仍在 Redis，
+      但本进程没有对应的哈希），复用率随 worker 数下降，这是有意的取舍
+    - 只下载我们自己的上传域名（UPLOAD_PUBLIC_HOSTS）下的图片，不跟随重定向，
+      流式读取并在超过 MAX_IMAGE_BYTES 时中止
+    """
+
+    def __init__(self):
+        self.enabled = settings.PRODUCT_DEDUP_ENABLED
+        self.threshold = settings.PRODUCT_DEDUP_MAX_DISTANCE
+        self.max_entries = settings.PRODUCT_DEDUP_MAX_ENTRIES_PER_USER
+        self.max_users = settings.PRODUCT_DEDUP_MAX_USERS
+        self.ttl = settings.PRODUCT_DEDUP_TTL_SECONDS
+        self._indexes: OrderedDict[str, HammingIndex] = OrderedDict()
+        # 上传时已计算过的哈希，避免分析时重复下载
+        self._url_hashes: OrderedDict[str, int] = OrderedDict()
+        self._url_hash_limit = 4096
+
+    def remember_upload(self, image_url: str, image_hash: int) -> None:
+        self._url_hashes[image_url] = image_hash
+        self._url_hashes.move_to_end(image_url)
+        while len(self._url_hashes) > self._url_hash_limit:
+            self._url_hashes.popitem(last=False)
+
+    async def hash_image_url(self, image_url: str) -> int:
+        cached = self._url_hashes.get(image_url)
+        if cached is not None:
+            return cached
+
+        parts = urlsplit(image_url)
+        if parts.scheme not in ("http", "https") or parts.hostname not in settings.UPLOAD_PUBLIC_HOSTS:
+            raise ValueError(f"Not an uploaded image: {image_url}")
+
+        async with httpx.AsyncClient(timeout=30.0, follow_redirects=False) as client:
+            async with client.stream("GET", image_url) as response:
+                response.raise_for_status()
+                chunks, size = [], 0
+                async for chunk in response.aiter_bytes():
+                    size += len(chunk)
+                    if size > MAX_IMAGE_BYTES:
+                        raise ValueError("Image too large for hashing")
+                    chunks.append(chunk)
+        image_hash = await asyncio.to_thread(compute_dhash, b"".join(chunks))
+
+        self.remember_upload(image_url, image_hash)
+        return image_hash
+
+    def _index_for(self, scope: str, create: bool = False) -> Optional[HammingIndex]:
+        index = self._indexes.get(scope)
+        if index is None and create:
+            index = self._indexes[scope] = HammingIndex(self.threshold, self.max_entries)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        if index is not None:
+            self._indexes.move_to_end(scope)
+        return index
+
+    async def _load(self, scope: str, image_hash: int) -> Optional[dict]:
+        try:
+            raw = await get_redis().get(_analysis_key(scope, image_hash))
+        except Exception as e:
+            print(f"Failed to load cached product analysis: {e}")
+            return None
+        return json.loads(raw) if raw else None
+
+    async def _store(self, scope: str, image_hash: int, image_url: str, analysis: dict) -> bool:
+        try:
+            await get_redis().set(
+                _analysis_key(scope, image_hash),
+                json.dumps({"source_image_url": image_url, "analysis": analysis}),
+                ex=self.ttl,
+            )
+            return True
+        except Exception as e:
+            print(f"Failed to cache product analysis: {e}")
+            return False
+
+    async def analyze_with_reuse(
+        self,
+        scope: Optional[str],
+        image_url: str,
+        analyze: Callable[[str], Awaitable[dict]],
+    ) -> tuple[dict, Optional[dict]]:
+        """命中近似图片时直接返回缓存的分析结果
+
+        Returns:
+            (分析结果, 复用信息)；未复用时复用信息为 None
+        """
+        if not self.enabled or not scope:
+            return await analyze(image_url), None
+
+        try:
+            image_hash = await self.hash_image_url(image_url)
+        except Exception as e:
+            print(f"Perceptual hash failed for {image_url}: {e}")
+            return await analyze(image_url), None
+
+        index = self._index_for(scope)
+        if index is not None:
+            match = index.find(image_hash)
+            if match is not None:
+                matched_hash, distance = match
+                cached = await self._load(scope, matched_hash)
+                if cached is not None:
+                    return cached["analysis"], {
+                        "reused": True,
+                        "distance": distance,
+                        "source_image_url": cached["source_image_url"],
+                    }
+
+        analysis = await analyze(image_url)
+        # 解析失败的结果不入库，避免反复复用坏数据
+        if "raw_response" not in analysis and await self._store(scope, image_hash, image_url, analysis):
+            self._index_for(scope, create=True).add(image_hash)
+        return analysis, None
+
+
+product_analysis_dedup = ProductAnalysisDedup()
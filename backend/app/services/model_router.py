@@ -0,0 +1,89 @@
+"""
+XC AI Design - 模型路由
+按服务方法选择模型、max_tokens 与超时；主模型近期 p95 超出延迟预算时切换到快速模型
+"""
+
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+from app.core.config import settings
+from app.core.metrics import metrics
+
+
+@dataclass
+class ModelRoute:
+    """一次调用使用的模型参数"""
+
+    method: str
+    model: str
+    max_tokens: int
+    timeout: float
+    fallback: bool = False
+
+
+class _LatencyWindow:
+    """时间窗口内的延迟样本；样本过期后自然回到主模型"""
+
+    def __init__(self, window_seconds: float):
+        self.window = window_seconds
+        self.samples: deque[tuple[float, float]] = deque(maxlen=512)
+
+    def observe(self, value: float) -> None:
+        self.samples.append((time.monotonic(), value))
+
+    def p95(self, min_samples: int) -> Optional[float]:
+        cutoff = time.monotonic() - self.window
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+        if len(self.samples) < min_samples:
+            return None
+        ordered = sorted(value for _, value in self.samples)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+
+class ModelRouter:
+    """按 MODEL_ROUTES 为每个服务方法选择模型
+
+    延迟按 (方法, 模型) 统计，不同方法的输出长度差异很大，不能共用一个分位数。
+    """
+
+    def __init__(self):
+        self._latency: dict[tuple[str, str], _LatencyWindow] = {}
+
+    def _window(self, method: str, model: str) -> _LatencyWindow:
+        window = self._latency.get((method, model))
+        if window is None:
+            window = self._latency[(method, model)] = _LatencyWindow(
+                settings.MODEL_LATENCY_WINDOW_SECONDS
+            )
+        return window
+
+    def route(self, method: str) -> ModelRoute:
+        """确定本次调用的模型"""
+        config = settings.MODEL_ROUTES.get(method, {})
+        model = config.get("model", settings.GEMINI_MODEL)
+        route = ModelRoute(
+            method=method,
+            model=model,
+            max_tokens=config.get("max_tokens", settings.GEMINI_DEFAULT_MAX_TOKENS),
+            timeout=config.get("timeout", settings.GEMINI_DEFAULT_TIMEOUT_SECONDS),
+        )
+
+        budget = config.get("latency_budget")
+        fallback_model = config.get("fallback_model", settings.GEMINI_FAST_MODEL)
+        if budget is None or fallback_model == model:
+            return route
+        p95 = self._window(method, model).p95(settings.MODEL_LATENCY_MIN_SAMPLES)
+        if p95 is not None and p95 > budget:
+            route.model = fallback_model
+            route.fallback = True
+            metrics.inc("llm.model_fallbacks", method=method, model=model)
+        return route
+
+    def observe(self, route: ModelRoute, elapsed: float) -> None:
+        """记录一次调用的耗时（包括超时失败）"""
+        self._window(route.method, route.model).observe(elapsed)
+
+
+model_router = ModelRouter()
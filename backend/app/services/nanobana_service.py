@@ -5,16 +5,34 @@ XC AI Design - 图片生成服务
 
 import httpx
 import asyncio
+import time
 from typing import Optional, Callable, List
 from app.core.config import settings
+from app.core.concurrency import gather_bounded
+from app.core.deadline import DeadlineExceeded, call_timeout, expired, within_deadline
+from app.services.adaptive_limiter import AdaptiveLimiter
+from app.services.circuit_breaker import circuit_breaker
+from app.services.provider_pool import Provider, provider_pool
+from app.services.rate_limiter import rate_limiter
+from app.services.resilience import is_retryable, resilience
+from app.services.upstream import UpstreamError, raise_for_upstream
 
 
 class NanoBananaService:
     """增强版图片生成服务"""
 
     def __init__(self):
-        self.api_url = settings.NANO_BANANA_API_URL
-        self.api_key = settings.YUNWU_API_KEY
+        # 并发上限随上游状态自适应调整（AIMD）
+        self.limiter = AdaptiveLimiter(
+            "image",
+            initial=settings.ADAPTIVE_IMAGE_INITIAL_LIMIT,
+            min_limit=settings.ADAPTIVE_IMAGE_MIN_LIMIT,
+            max_limit=settings.ADAPTIVE_IMAGE_MAX_LIMIT,
+            backoff_ratio=settings.ADAPTIVE_BACKOFF_RATIO,
+            latency_tolerance=settings.ADAPTIVE_LATENCY_TOLERANCE,
+            max_wait=settings.RATE_LIMIT_MAX_WAIT_SECONDS,
+            enabled=settings.ADAPTIVE_IMAGE_ENABLED,
+        )
 
     def _calculate_dimensions(self, aspect_ratio: str) -> tuple[int, int]:
         """根据宽高比计算尺寸"""
@@ -65,74 +83,114 @@ class NanoBananaService:
         if aspect_ratio:
             width, height = self._calculate_dimensions(aspect_ratio)
         
-        async with httpx.AsyncClient(timeout=180.0) as client:
-            payload = {
-                "prompt": prompt,
-                "negative_prompt": negative_prompt or "blurry, low quality, distorted, ugly, deformed, watermark, text, logo, signature, bad anatomy, bad proportions",
-                "num_inference_steps": num_inference_steps,
-                "guidance_scale": guidance_scale,
-                "width": width,
-                "height": height,
-            }
+        payload = {
+            "prompt": prompt,
+            "negative_prompt": negative_prompt or "blurry, low quality, distorted, ugly, deformed, watermark, text, logo, signature, bad anatomy, bad proportions",
+            "num_inference_steps": num_inference_steps,
+            "guidance_scale": guidance_scale,
+            "width": width,
+            "height": height,
+        }
 
-            if image_url:
-                payload["image_url"] = image_url
-                payload["strength"] = strength
+        if image_url:
+            payload["image_url"] = image_url
+            payload["strength"] = strength
 
-            response = await client.post(
-                self.api_url,
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json",
-                },
-                json=payload,
+        # 提交生图任务不是幂等的：只在确定上游未受理时重试；上游受理后
+        # （已拿到 request_id）轮询失败不会回到这里重新提交；
+        # 整体截止时间到达时连同轮询一起取消
+        async with within_deadline():
+            return await resilience.call(
+                "image",
+                lambda: self._generate_once(payload, width, height),
+                idempotent=False,
+                hedge=False,
             )
-            response.raise_for_status()
-            result = response.json()
 
-            # 异步轮询模式
-            if "request_id" in result:
-                image_url_result = await self._poll_result(client, result["request_id"])
-                return {
-                    "url": image_url_result,
-                    "request_id": result["request_id"],
-                    "params": payload,
-                    "width": width,
-                    "height": height,
-                }
+    async def _generate_once(self, payload: dict, width: int, height: int) -> dict:
+        """提交一次生图请求并等待结果"""
+        # 熔断打开时快速失败；并发租约覆盖提交与轮询全过程，轮询必须使用提交时的 Key
+        async with (
+            self.limiter.acquire(),
+            circuit_breaker.guard("image") as call,
+            provider_pool.lease("image") as provider,
+            rate_limiter.acquire("image", scope=provider.name),
+        ):
+            call.start()
+            async with httpx.AsyncClient(timeout=call_timeout(180.0)) as client:
+                response = await client.post(
+                    provider.image_api_url,
+                    headers=provider.headers({"Content-Type": "application/json"}),
+                    json=payload,
+                )
+                raise_for_upstream(response, "image")
+                result = response.json()
+
+                # 异步轮询模式
+                if "request_id" in result:
+                    try:
+                        image_url_result = await self._poll_result(client, result["request_id"], provider)
+                    except DeadlineExceeded:
+                        raise
+                    except (UpstreamError, httpx.HTTPError) as e:
+                        # 任务已被上游受理（并计费）：转为不可重试，外层不会重复提交
+                        raise UpstreamError(
+                            f"Image request {result['request_id']} failed: {e}",
+                            status_code=getattr(e, "status_code", 502),
+                        ) from e
+                    return {
+                        "url": image_url_result,
+                        "request_id": result["request_id"],
+                        "params": payload,
+                        "width": width,
+                        "height": height,
+                    }
 
-            # 直接返回结果
-            if "images" in result and len(result["images"]) > 0:
-                return {
-                    "url": result["images"][0]["url"],
-                    "params": payload,
-                    "width": width,
-                    "height": height,
-                }
+                # 直接返回结果
+                if "images" in result and len(result["images"]) > 0:
+                    return {
+                        "url": result["images"][0]["url"],
+                        "params": payload,
+                        "width": width,
+                        "height": height,
+                    }
 
-            if "image" in result:
-                return {
-                    "url": result["image"]["url"],
-                    "params": payload,
-                    "width": width,
-                    "height": height,
-                }
+                if "image" in result:
+                    return {
+                        "url": result["image"]["url"],
+                        "params": payload,
+                        "width": width,
+                        "height": height,
+                    }
 
-            raise Exception("No image returned from API")
+                raise Exception("No image returned from API")
 
-    async def _poll_result(self, client: httpx.AsyncClient, request_id: str) -> str:
+    async def _poll_result(
+        self, client: httpx.AsyncClient, request_id: str, provider: Provider
+    ) -> str:
         """轮询异步结果"""
-        status_url = f"{self.api_url}/requests/{request_id}/status"
+        status_url = f"{provider.image_api_url}/requests/{request_id}/status"
 
+        async def fetch_status() -> dict:
+            response = await client.get(status_url, headers=provider.headers())
+            raise_for_upstream(response, "image_status")
+            return response.json()
+
+        last_error: Optional[Exception] = None
         for _ in range(90):  # 最多等待 3 分钟
             await asyncio.sleep(2)
             
-            response = await client.get(
-                status_url, 
-                headers={"Authorization": f"Bearer {self.api_key}"}
-            )
-            response.raise_for_status()
-            result = response.json()
+            # 状态查询是幂等的，偶发错误直接重试；重试用尽时继续轮询同一个 request_id，
+            # 而不是放弃整张图
+            try:
+                result = await resilience.call("image_status", fetch_status, hedge=False)
+            except DeadlineExceeded:
+                raise
+            except (UpstreamError, httpx.HTTPError) as e:
+                if not is_retryable(e, idempotent=True):
+                    raise
+                last_error = e
+                continue
 
             status = result.get("status")
             if status == "COMPLETED":
@@ -144,10 +202,52 @@ class NanoBananaService:
                 raise Exception("No image in completed result")
             
             if status == "FAILED":
-                raise Exception(f"Image generation failed: {result.get('error', 'Unknown error')}")
+                # 上游已受理并结束了该任务，由调用方决定是否重新生成
+                raise UpstreamError(
+                    f"Image generation failed: {result.get('error', 'Unknown error')}"
+                )
 
+        if last_error is not None:
+            raise UpstreamError(f"Timeout waiting for image generation (last error: {last_error})")
         raise Exception("Timeout waiting for image generation")
 
+    async def generate_from_prompt(
+        self,
+        prompt_data: dict,
+        order: int,
+        base_image_url: Optional[str] = None,
+        aspect_ratio: str = "3:4",
+    ) -> dict:
+        """根据单条提示词数据生成图片（失败时抛出异常）
+        
+        Args:
+            prompt_data: 提示词数据，包含 prompt, negative_prompt, role 等
+            order: 图片序号
+            base_image_url: 基础产品图URL
+            aspect_ratio: 默认宽高比（prompt_data 中的 aspect_ratio 优先）
+        
+        Returns:
+            生成结果字典
+        """
+        # 获取单独的宽高比设置
+        item_ratio = prompt_data.get("aspect_ratio", aspect_ratio)
+        item_width, item_height = self._calculate_dimensions(item_ratio)
+        
+        result = await self.generate_image(
+            prompt=prompt_data.get("prompt", ""),
+            image_url=base_image_url,
+            negative_prompt=prompt_data.get("negative_prompt", ""),
+            width=item_width,
+            height=item_height,
+        )
+        
+        # 添加额外信息
+        result["order"] = order
+        result["role"] = prompt_data.get("role", "")
+        result["text_overlay"] = prompt_data.get("text_overlay", {})
+        result["success"] = True
+        return result
+
     async def generate_batch_with_progress(
         self,
         prompts: List[dict],
@@ -168,31 +268,26 @@ class NanoBananaService:
         """
         results = []
         total = len(prompts)
-        width, height = self._calculate_dimensions(aspect_ratio)
 
         for i, prompt_data in enumerate(prompts):
+            if expired():
+                # 截止时间已到：不再开始新的图片，已完成的结果照常返回
+                results.append({
+                    "order": i + 1,
+                    "role": prompt_data.get("role", ""),
+                    "error": "Deadline exceeded",
+                    "url": None,
+                    "success": False,
+                    "deadline_exceeded": True,
+                })
+                continue
             try:
-                # 获取提示词和负面提示词
-                prompt = prompt_data.get("prompt", "")
-                negative_prompt = prompt_data.get("negative_prompt", "")
-                
-                # 获取单独的宽高比设置
-                item_ratio = prompt_data.get("aspect_ratio", aspect_ratio)
-                item_width, item_height = self._calculate_dimensions(item_ratio)
-                
-                result = await self.generate_image(
-                    prompt=prompt,
-                    image_url=base_image_url,
-                    negative_prompt=negative_prompt,
-                    width=item_width,
-                    height=item_height,
+                result = await self.generate_from_prompt(
+                    prompt_data,
+                    order=i + 1,
+                    base_image_url=base_image_url,
+                    aspect_ratio=aspect_ratio,
                 )
-                
-                # 添加额外信息
-                result["order"] = i + 1
-                result["role"] = prompt_data.get("role", "")
-                result["text_overlay"] = prompt_data.get("text_overlay", {})
-                result["success"] = True
                 results.append(result)
 
                 # 进度回调
@@ -211,6 +306,7 @@ class NanoBananaService:
                     "error": str(e),
                     "url": None,
                     "success": False,
+                    "deadline_exceeded": isinstance(e, DeadlineExceeded),
                 })
                 
                 # 即使失败也通知进度
@@ -258,74 +354,6 @@ class NanoBananaService:
             height=height,
         )
 
-    async def batch_style_transfer(
-        self,
-        product_images: List[str],
-        style_prompt: str,
-        negative_prompt: str = "",
-        strength: float = 0.7,
-        aspect_ratio: str = "1:1",
-        on_progress: Optional[Callable] = None,
-    ) -> List[dict]:
-        """批量风格迁移
-        
-        Args:
-            product_images: 产品图URL列表
-            style_prompt: 统一的风格描述
-            negative_prompt: 负面提示词
-            strength: 风格迁移强度
-            aspect_ratio: 输出图片宽高比
-            on_progress: 进度回调
-        
-        Returns:
-            生成结果列表
-        """
-        results = []
-        total = len(product_images)
-        
-        for i, image_url in enumerate(product_images):
-            try:
-                result = await self.generate_style_transfer(
-                    product_image_url=image_url,
-                    style_prompt=style_prompt,
-                    negative_prompt=negative_prompt,
-                    strength=strength,
-                    aspect_ratio=aspect_ratio,
-                )
-                
-                result["order"] = i + 1
-                result["original_image"] = image_url
-                result["success"] = True
-                results.append(result)
-                
-                if on_progress:
-                    await on_progress(
-                        progress=int((i + 1) / total * 100),
-                        current=i + 1,
-                        total=total,
-                        image_url=result["url"],
-                    )
-                    
-            except Exception as e:
-                results.append({
-                    "order": i + 1,
-                    "original_image": image_url,
-                    "error": str(e),
-                    "url": None,
-                    "success": False,
-                })
-                
-                if on_progress:
-                    await on_progress(
-                        progress=int((i + 1) / total * 100),
-                        current=i + 1,
-                        total=total,
-                        image_url=None,
-                        error=str(e),
-                    )
-        
-        return results
-
     # ========== 兼容旧版方法 ==========
     
     async def generate_batch(
@@ -334,30 +362,48 @@ class NanoBananaService:
         base_image_url: str | None = None,
         on_progress: Callable | None = None,
     ) -> list[str]:
-        """兼容旧版 - 批量生成图片（返回URL列表）"""
-        results = []
+        """兼容旧版 - 批量生成图片（返回URL列表）
+
+        最多 BATCH_IMAGE_CONCURRENCY 张同时生成（仍受 self.limiter 约束）；
+        on_progress 按完成顺序逐个调用，current 为该图片在 prompts 中的序号（从 1 开始）
+        """
         total = len(prompts)
+        done = 0
+        # 回调通常会写数据库会话，不能并发执行
+        progress_lock = asyncio.Lock()
 
-        for i, prompt in enumerate(prompts):
+        async def generate(index: int) -> str | None:
+            nonlocal done
+            if expired():
+                # 截止时间已到：未开始的图片返回 None
+                return None
             try:
+                started = time.monotonic()
                 result = await self.generate_image(
-                    prompt=prompt,
+                    prompt=prompts[index],
                     image_url=base_image_url,
                 )
-                results.append(result["url"])
-
+                elapsed = time.monotonic() - started
                 if on_progress:
-                    await on_progress(
-                        progress=int((i + 1) / total * 100),
-                        current=i + 1,
-                        total=total,
-                        image_url=result["url"],
-                    )
+                    async with progress_lock:
+                        done += 1
+                        await on_progress(
+                            progress=int(done / total * 100),
+                            current=index + 1,
+                            total=total,
+                            image_url=result["url"],
+                            result=result,
+                            elapsed=elapsed,
+                        )
+                return result["url"]
             except Exception as e:
-                print(f"Failed to generate image {i + 1}: {e}")
-                results.append(None)
+                print(f"Failed to generate image {index + 1}: {e}")
+                return None
 
-        return [r for r in results if r is not None]
+        outcomes = await gather_bounded(
+            list(range(total)), generate, settings.BATCH_IMAGE_CONCURRENCY
+        )
+        return [url for url, _ in outcomes if url is not None]
 
 
 nano_banana_service = NanoBananaService()
@@ -0,0 +1,53 @@
+"""
+XC AI Design - 对象存储
+OSS 通过 S3 兼容接口访问；配置 STORAGE_LOCAL_DIR 或未配置 OSS 时写入本地目录
+"""
+
+import asyncio
+from pathlib import Path
+from typing import Optional
+import boto3
+from app.core.config import settings
+
+
+class ObjectStorage:
+    """按 key 读写二进制对象（boto3 为同步客户端，放到线程中执行）"""
+
+    def __init__(self):
+        self.bucket = settings.OSS_BUCKET
+        local_dir = settings.STORAGE_LOCAL_DIR or ("" if settings.OSS_ENDPOINT else "./storage")
+        self.local_dir: Optional[Path] = Path(local_dir) if local_dir else None
+        self._client = None
+
+    def _s3(self):
+        if self._client is None:
+            self._client = boto3.client(
+                "s3",
+                endpoint_url=settings.OSS_ENDPOINT,
+                aws_access_key_id=settings.OSS_ACCESS_KEY,
+                aws_secret_access_key=settings.OSS_SECRET_KEY,
+                region_name=settings.OSS_REGION,
+            )
+        return self._client
+
+    def _put_sync(self, key: str, data: bytes, content_type: str) -> None:
+        if self.local_dir is not None:
+            path = self.local_dir / key
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+            return
+        self._s3().put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type)
+
+    def _get_sync(self, key: str) -> bytes:
+        if self.local_dir is not None:
+            return (self.local_dir / key).read_bytes()
+        return self._s3().get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+    async def put(self, key: str, data: bytes, content_type: str = "application/octet-stream") -> None:
+        await asyncio.to_thread(self._put_sync, key, data, content_type)
+
+    async def get(self, key: str) -> bytes:
+        return await asyncio.to_thread(self._get_sync, key)
+
+
+object_storage = ObjectStorage()
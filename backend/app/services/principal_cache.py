@@ -0,0 +1,145 @@
+"""
+XC AI Design - 认证用户缓存
+已认证请求按用户 ID 解析出的用户摘要，先查进程内 LRU，再查 Redis，最后才查数据库
+"""
+
+import json
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.redis import get_redis
+from app.models.user import User
+
+
+@dataclass
+class Principal:
+    """认证用户摘要（非 ORM 对象，不能用于修改数据）"""
+
+    id: UUID
+    email: str
+    name: Optional[str]
+    credits: int
+    created_at: datetime
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(
+            id=user.id,
+            email=user.email,
+            name=user.name,
+            credits=user.credits,
+            created_at=user.created_at,
+        )
+
+    def dumps(self) -> str:
+        data = asdict(self)
+        data["id"] = str(self.id)
+        data["created_at"] = self.created_at.isoformat() if self.created_at else None
+        return json.dumps(data)
+
+    @classmethod
+    def loads(cls, raw: str) -> "Principal":
+        data = json.loads(raw)
+        data["id"] = UUID(data["id"])
+        if data["created_at"]:
+            data["created_at"] = datetime.fromisoformat(data["created_at"])
+        return cls(**data)
+
+
+def _key(user_id: str) -> str:
+    return f"principal:{user_id}"
+
+
+class PrincipalCache:
+    """短 TTL 的用户摘要缓存
+
+    - 进程内 LRU：TTL 很短，其他进程的失效通知不到这里，最多过期 local_ttl 秒
+    - Redis（可选）：跨进程共享，积分或资料变更时删除
+    - Redis 不可用时只用进程内缓存
+    """
+
+    def __init__(self):
+        self.enabled = settings.PRINCIPAL_CACHE_ENABLED
+        self.use_redis = settings.PRINCIPAL_CACHE_REDIS
+        self.ttl = settings.PRINCIPAL_CACHE_TTL_SECONDS
+        self.local_ttl = settings.PRINCIPAL_CACHE_LOCAL_TTL_SECONDS
+        self.max_entries = settings.PRINCIPAL_CACHE_MAX_ENTRIES
+        self._local: OrderedDict[str, tuple[float, Principal]] = OrderedDict()
+        metrics.set_gauge("principal_cache.entries", lambda: len(self._local))
+
+    def _remember(self, principal: Principal) -> None:
+        user_id = str(principal.id)
+        self._local[user_id] = (time.monotonic() + self.local_ttl, principal)
+        self._local.move_to_end(user_id)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    async def get(self, user_id: str) -> Optional[Principal]:
+        if not self.enabled:
+            return None
+
+        entry = self._local.get(user_id)
+        if entry is not None:
+            expires_at, principal = entry
+            if expires_at > time.monotonic():
+                self._local.move_to_end(user_id)
+                metrics.inc("principal_cache.hits", tier="local")
+                return principal
+            del self._local[user_id]
+
+        if self.use_redis:
+            try:
+                raw = await get_redis().get(_key(user_id))
+            except Exception:
+                raw = None
+            if raw:
+                principal = Principal.loads(raw)
+                self._remember(principal)
+                metrics.inc("principal_cache.hits", tier="redis")
+                return principal
+
+        metrics.inc("principal_cache.misses")
+        return None
+
+    async def put(self, user: User) -> Principal:
+        principal = Principal.from_user(user)
+        if not self.enabled:
+            return principal
+        self._remember(principal)
+        if self.use_redis:
+            try:
+                await get_redis().set(_key(str(principal.id)), principal.dumps(), ex=int(self.ttl))
+            except Exception:
+                pass
+        return principal
+
+    async def load(self, user_id: str, db: AsyncSession) -> Optional[Principal]:
+        """缓存未命中时从数据库读取并写入缓存；用户不存在时返回 None
+
+        调用方先 get，未命中才打开会话，命中时不产生任何数据库或副本路由开销
+        """
+        result = await db.execute(select(User).where(User.id == UUID(user_id)))
+        user = result.scalar_one_or_none()
+        if user is None:
+            return None
+        return await self.put(user)
+
+    async def invalidate(self, user_id) -> None:
+        """用户积分或资料变更后调用"""
+        user_id = str(user_id)
+        self._local.pop(user_id, None)
+        if self.enabled and self.use_redis:
+            try:
+                await get_redis().delete(_key(user_id))
+            except Exception as e:
+                print(f"Failed to invalidate principal cache for {user_id}: {e}")
+
+
+principal_cache = PrincipalCache()
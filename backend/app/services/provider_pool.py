@@ -0,0 +1,202 @@
+"""
+XC AI Design - 云雾 API 多 Key 负载均衡
+多个 Key / Base URL 按权重分摊请求，按延迟与在途请求数选路，异常 Key 暂时摘除
+"""
+
+import random
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional
+import httpx
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.upstream import UpstreamError
+
+
+
+@dataclass
+class Provider:
+    """一个上游 Key（及其 Base URL）"""
+
+    name: str
+    api_key: str
+    api_url: Optional[str] = None
+    image_api_url: Optional[str] = None
+    weight: float = 1.0
+    # 运行状态
+    outstanding: int = 0
+    latency: dict = field(default_factory=dict)
+    consecutive_failures: int = 0
+    ejections: int = 0
+    ejected_until: float = 0.0
+    requests: int = 0
+    failures: int = 0
+    rate_limited: int = 0
+
+    def url(self, kind: str) -> Optional[str]:
+        return self.api_url if kind == "chat" else self.image_api_url
+
+    def headers(self, extra: Optional[dict] = None) -> dict:
+        return {"Authorization": f"Bearer {self.api_key}", **(extra or {})}
+
+    def score(self, kind: str, default_latency: float) -> float:
+        """越小越优先：预计延迟 × (在途请求 + 1)"""
+        return self.latency.get(kind, default_latency) * (self.outstanding + 1)
+
+    def masked_key(self) -> str:
+        if len(self.api_key) <= 8:
+            return "***"
+        return f"{self.api_key[:4]}...{self.api_key[-4:]}"
+
+
+def _classify(error: BaseException) -> Optional[str]:
+    """判断错误是否归咎于该 Key：返回 "rate_limited" / "failure" / None"""
+    if isinstance(error, UpstreamError):
+        if error.upstream_status == 429:
+            return "rate_limited"
+        if error.upstream_status is not None and error.upstream_status >= 500:
+            return "failure"
+        return None
+    if isinstance(error, httpx.HTTPStatusError):
+        # Key 无效或被封禁
+        return "failure" if error.response.status_code in (401, 403) else None
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError)):
+        return "failure"
+    return None
+
+
+class ProviderPool:
+    """云雾 API Key 池
+
+    - 选路：在未被摘除的 Key 中按权重随机抽两个（可重复），取 预计延迟 × (在途请求 + 1)
+      较小者（power of two choices）；慢 Key 仍会按权重偶尔被抽中，延迟得以更新
+    - 延迟为成功调用的指数滑动平均；尚无样本的 Key 按当前最快的 Key 估计，保证先被试用
+    - 摘除：连续失败达到阈值后摘除一段时间（多次摘除按指数延长）；
+      上游 429 时按 Retry-After 暂停该 Key
+    - 所有 Key 都被摘除时仍选择最早恢复的一个，整体故障交给熔断器处理
+    - 按 Key 统计请求数、失败数、限流次数，供 /health 和 /metrics 查看
+    """
+
+    def __init__(self):
+        self.providers = self._load_providers()
+        for provider in self.providers:
+            metrics.set_gauge(
+                "provider.outstanding", lambda p=provider: p.outstanding, provider=provider.name
+            )
+            metrics.set_gauge(
+                "provider.ejected",
+                lambda p=provider: float(time.monotonic() < p.ejected_until),
+                provider=provider.name,
+            )
+
+    @staticmethod
+    def _load_providers() -> list[Provider]:
+        if not settings.YUNWU_PROVIDERS:
+            return [Provider(
+                name="default",
+                api_key=settings.YUNWU_API_KEY,
+                api_url=settings.YUNWU_API_URL,
+                image_api_url=settings.NANO_BANANA_API_URL,
+            )]
+        providers = []
+        for i, entry in enumerate(settings.YUNWU_PROVIDERS):
+            providers.append(Provider(
+                name=entry.get("name") or f"provider-{i}",
+                api_key=entry["api_key"],
+                api_url=entry.get("api_url"),
+                image_api_url=entry.get("image_api_url"),
+                weight=max(float(entry.get("weight", 1.0)), 0.01),
+            ))
+        return providers
+
+    def pick(self, kind: str) -> Provider:
+        """为一次调用选择 Key"""
+        candidates = [p for p in self.providers if p.url(kind)]
+        if not candidates:
+            raise UpstreamError(f"No provider configured for {kind}", status_code=503)
+        now = time.monotonic()
+        healthy = [p for p in candidates if p.ejected_until <= now]
+        if not healthy:
+            return min(candidates, key=lambda p: p.ejected_until)
+        known = [p.latency[kind] for p in healthy if kind in p.latency]
+        default_latency = min(known) if known else 1.0
+        first, second = random.choices(healthy, weights=[p.weight for p in healthy], k=2)
+        return min((first, second), key=lambda p: p.score(kind, default_latency))
+
+    @asynccontextmanager
+    async def lease(self, kind: str) -> AsyncIterator[Provider]:
+        """选择一个 Key 执行调用，并根据结果更新其健康状态
+
+        延迟包含在该 Key 限流队列中的等待，Key 配额吃紧时自然会少分到请求。
+        """
+        provider = self.pick(kind)
+        provider.outstanding += 1
+        provider.requests += 1
+        metrics.inc("provider.requests", provider=provider.name, kind=kind)
+        started = time.monotonic()
+        try:
+            yield provider
+        except BaseException as e:
+            self._on_error(provider, kind, e)
+            raise
+        else:
+            self._on_success(provider, kind, time.monotonic() - started)
+        finally:
+            provider.outstanding -= 1
+
+    def _on_success(self, provider: Provider, kind: str, elapsed: float) -> None:
+        alpha = settings.PROVIDER_LATENCY_DECAY
+        previous = provider.latency.get(kind)
+        provider.latency[kind] = elapsed if previous is None else alpha * elapsed + (1 - alpha) * previous
+        provider.consecutive_failures = 0
+        provider.ejections = 0
+
+    def _on_error(self, provider: Provider, kind: str, error: BaseException) -> None:
+        outcome = _classify(error)
+        if outcome is None:
+            return
+        if outcome == "rate_limited":
+            provider.rate_limited += 1
+            metrics.inc("provider.rate_limited", provider=provider.name)
+            pause = getattr(error, "retry_after", None) or settings.PROVIDER_EJECT_BASE_SECONDS
+            self._eject(provider, min(pause, settings.PROVIDER_EJECT_MAX_SECONDS))
+            return
+
+        provider.failures += 1
+        provider.consecutive_failures += 1
+        metrics.inc("provider.failures", provider=provider.name, kind=kind)
+        if provider.consecutive_failures >= settings.PROVIDER_EJECT_AFTER_FAILURES:
+            provider.consecutive_failures = 0
+            provider.ejections += 1
+            seconds = min(
+                settings.PROVIDER_EJECT_BASE_SECONDS * 2 ** (provider.ejections - 1),
+                settings.PROVIDER_EJECT_MAX_SECONDS,
+            )
+            self._eject(provider, seconds)
+
+    def _eject(self, provider: Provider, seconds: float) -> None:
+        provider.ejected_until = max(provider.ejected_until, time.monotonic() + seconds)
+        metrics.inc("provider.ejections", provider=provider.name)
+        print(f"Provider {provider.name} ejected for {seconds:.0f}s")
+
+    def usage(self) -> list[dict]:
+        """各 Key 的使用情况（Key 已脱敏）"""
+        now = time.monotonic()
+        return [
+            {
+                "name": p.name,
+                "key": p.masked_key(),
+                "weight": p.weight,
+                "outstanding": p.outstanding,
+                "requests": p.requests,
+                "failures": p.failures,
+                "rate_limited": p.rate_limited,
+                "latency": {kind: round(value, 3) for kind, value in p.latency.items()},
+                "ejected_for": max(0.0, round(p.ejected_until - now, 1)),
+            }
+            for p in self.providers
+        ]
+
+
+provider_pool = ProviderPool()
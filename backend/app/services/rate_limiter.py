@@ -0,0 +1,246 @@
+"""
+XC AI Design - 分布式限流
+基于 Redis 的令牌桶 + 并发上限，所有进程共享每个云雾 API Key 的配额
+"""
+
+import asyncio
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.redis import get_redis
+from app.services.upstream import UpstreamRateLimited
+
+# 令牌桶：返回 {是否放行, 需要等待的毫秒数}
+_TOKEN_BUCKET_LUA = """
+local key = KEYS[1]
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local state = redis.call('HMGET', key, 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate / 1000)
+local allowed = 0
+local wait_ms = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+else
+  wait_ms = math.ceil((cost - tokens) * 1000 / rate)
+end
+redis.call('HSET', key, 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', key, math.ceil(capacity * 1000 / rate) + 1000)
+return {allowed, wait_ms}
+"""
+
+# 并发租约：有序集合成员为租约 ID，分值为过期时间，进程崩溃后租约自动失效
+_SEMAPHORE_ACQUIRE_LUA = """
+local key = KEYS[1]
+local limit = tonumber(ARGV[1])
+local lease_id = ARGV[2]
+local ttl_ms = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now)
+if redis.call('ZCARD', key) < limit then
+  redis.call('ZADD', key, now + ttl_ms, lease_id)
+  redis.call('PEXPIRE', key, ttl_ms)
+  return 1
+end
+return 0
+"""
+
+
+@dataclass
+class EndpointLimits:
+    rps: float
+    burst: int
+    concurrency: int
+
+
+class _LocalBucket:
+    """Redis 不可用时的进程内令牌桶"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.ts = time.monotonic()
+
+    def take(self) -> float:
+        """取一个令牌，返回需要等待的秒数（0 表示已放行）"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """限流感知的调度器
+
+    - 请求速率：Redis 令牌桶，按 Key（scope）和 endpoint（chat / image）分别限制
+    - 并发上限：Redis 租约集合，跨进程共享
+    - 超出限制的请求排队等待而不是直接失败；进程内先经过本地信号量，
+      保证同一进程的等待者先到先得，也避免空转轮询 Redis
+    - Redis 不可用时退化为进程内限流
+    """
+
+    def __init__(self):
+        self.enabled = settings.RATE_LIMIT_ENABLED
+        self.max_wait = settings.RATE_LIMIT_MAX_WAIT_SECONDS
+        self.lease_ttl_ms = int(settings.RATE_LIMIT_LEASE_TTL_SECONDS * 1000)
+        self.limits = {
+            "chat": EndpointLimits(
+                settings.RATE_LIMIT_CHAT_RPS,
+                settings.RATE_LIMIT_CHAT_BURST,
+                settings.RATE_LIMIT_CHAT_CONCURRENCY,
+            ),
+            "image": EndpointLimits(
+                settings.RATE_LIMIT_IMAGE_RPS,
+                settings.RATE_LIMIT_IMAGE_BURST,
+                settings.RATE_LIMIT_IMAGE_CONCURRENCY,
+            ),
+        }
+        self._local_gates: dict[tuple[str, str], asyncio.Semaphore] = {}
+        self._local_buckets: dict[tuple[str, str], _LocalBucket] = {}
+        self._waiting = {name: 0 for name in self.limits}
+        self._redis_ok = True
+        for name in self.limits:
+            metrics.set_gauge("rate_limiter.waiting", lambda n=name: self._waiting[n], endpoint=name)
+
+    def _key(self, endpoint: str, scope: str, kind: str) -> str:
+        if scope == "default":
+            return f"ratelimit:{endpoint}:{kind}"
+        return f"ratelimit:{scope}:{endpoint}:{kind}"
+
+    def _local_gate(self, endpoint: str, scope: str) -> asyncio.Semaphore:
+        gate = self._local_gates.get((endpoint, scope))
+        if gate is None:
+            gate = self._local_gates[(endpoint, scope)] = asyncio.Semaphore(
+                self.limits[endpoint].concurrency
+            )
+        return gate
+
+    def _local_bucket(self, endpoint: str, scope: str) -> _LocalBucket:
+        bucket = self._local_buckets.get((endpoint, scope))
+        if bucket is None:
+            limits = self.limits[endpoint]
+            bucket = self._local_buckets[(endpoint, scope)] = _LocalBucket(limits.rps, limits.burst)
+        return bucket
+
+    async def _take_token(self, endpoint: str, scope: str) -> float:
+        limits = self.limits[endpoint]
+        if self._redis_ok:
+            try:
+                allowed, wait_ms = await get_redis().eval(
+                    _TOKEN_BUCKET_LUA, 1, self._key(endpoint, scope, "bucket"),
+                    limits.rps, limits.burst, 1,
+                )
+                return 0.0 if int(allowed) else int(wait_ms) / 1000
+            except Exception as e:
+                self._redis_unavailable(e)
+        return self._local_bucket(endpoint, scope).take()
+
+    async def _take_slot(self, endpoint: str, scope: str, lease_id: str) -> bool:
+        if not self._redis_ok:
+            # 进程内并发已由本地信号量保证
+            return True
+        try:
+            acquired = await get_redis().eval(
+                _SEMAPHORE_ACQUIRE_LUA, 1, self._key(endpoint, scope, "inflight"),
+                self.limits[endpoint].concurrency, lease_id, self.lease_ttl_ms,
+            )
+            return bool(int(acquired))
+        except Exception as e:
+            self._redis_unavailable(e)
+            return True
+
+    async def _release_slot(self, endpoint: str, scope: str, lease_id: str) -> None:
+        if not self._redis_ok:
+            return
+        try:
+            await get_redis().zrem(self._key(endpoint, scope, "inflight"), lease_id)
+        except Exception as e:
+            self._redis_unavailable(e)
+
+    def _redis_unavailable(self, error: Exception) -> None:
+        if self._redis_ok:
+            print(f"Rate limiter falling back to in-process limits: {error}")
+        self._redis_ok = False
+        # 稍后重新尝试 Redis
+        asyncio.get_running_loop().call_later(30, self._restore_redis)
+
+    def _restore_redis(self) -> None:
+        self._redis_ok = True
+
+    @asynccontextmanager
+    async def acquire(self, endpoint: str, scope: str = "default") -> AsyncIterator[None]:
+        """在限流配额内执行一次上游调用
+
+        scope 为上游 Key 名，每个 Key 有独立的配额。
+        排队超过 RATE_LIMIT_MAX_WAIT_SECONDS 时抛出 UpstreamRateLimited。
+        """
+        if not self.enabled:
+            yield
+            return
+
+        deadline = time.monotonic() + self.max_wait
+        lease_id = uuid.uuid4().hex
+        started = time.monotonic()
+        gate = self._local_gate(endpoint, scope)
+
+        self._waiting[endpoint] += 1
+        try:
+            try:
+                await asyncio.wait_for(gate.acquire(), timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                raise UpstreamRateLimited(f"{endpoint} queue wait exceeded", retry_after=5)
+            try:
+                await self._wait_for_capacity(endpoint, scope, lease_id, deadline)
+            except BaseException:
+                gate.release()
+                raise
+        finally:
+            self._waiting[endpoint] -= 1
+
+        metrics.observe("rate_limiter.queue_seconds", time.monotonic() - started, endpoint=endpoint)
+        try:
+            yield
+        finally:
+            await self._release_slot(endpoint, scope, lease_id)
+            gate.release()
+
+    async def _wait_for_capacity(
+        self, endpoint: str, scope: str, lease_id: str, deadline: float
+    ) -> None:
+        # 先拿并发租约，再拿速率令牌
+        while not await self._take_slot(endpoint, scope, lease_id):
+            await self._sleep_until_retry(endpoint, 0.25, deadline)
+        try:
+            while True:
+                wait = await self._take_token(endpoint, scope)
+                if wait <= 0:
+                    return
+                await self._sleep_until_retry(endpoint, wait, deadline)
+        except BaseException:
+            await self._release_slot(endpoint, scope, lease_id)
+            raise
+
+    async def _sleep_until_retry(self, endpoint: str, wait: float, deadline: float) -> None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            metrics.inc("rate_limiter.rejected", endpoint=endpoint)
+            raise UpstreamRateLimited(f"{endpoint} rate limit wait exceeded", retry_after=max(wait, 1))
+        await asyncio.sleep(min(wait, remaining))
+
+
+rate_limiter = RateLimiter()
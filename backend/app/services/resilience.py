@@ -0,0 +1,205 @@
+"""
+XC AI Design - 上游调用弹性层
+指数退避重试（遵循 Retry-After）、按 endpoint 的重试预算，以及可选的对冲请求
+"""
+
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, TypeVar
+import httpx
+from app.core.config import settings
+from app.core.deadline import remaining
+from app.core.metrics import Histogram, metrics
+from app.services.circuit_breaker import CircuitOpenError
+from app.services.upstream import UpstreamError
+
+T = TypeVar("T")
+
+# 非幂等请求（如提交生图任务）只在确定上游未处理时重试
+_SAFE_STATUS_CODES = {429, 502, 503, 504}
+
+
+def is_retryable(error: BaseException, idempotent: bool) -> bool:
+    """判断异常是否值得重试"""
+    if isinstance(error, CircuitOpenError):
+        # 熔断期间快速失败，由调用方稍后重试
+        return False
+    if isinstance(error, UpstreamError):
+        if not error.retryable:
+            return False
+        # upstream_status 为空表示错误由本地判定（如排队超时），请求未发出，重试是安全的；
+        # 上游受理后的失败由调用方转为不可重试
+        return (
+            idempotent
+            or error.upstream_status is None
+            or error.upstream_status in _SAFE_STATUS_CODES
+        )
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        # 请求尚未发出
+        return True
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError)):
+        return idempotent
+    return False
+
+
+class RetryBudget:
+    """滑动窗口内的重试预算：重试次数不超过请求数的一定比例
+
+    防止上游整体故障时重试把负载放大数倍。
+    """
+
+    def __init__(self, ratio: float, min_per_window: int, window_seconds: float = 10.0):
+        self.ratio = ratio
+        self.min_per_window = min_per_window
+        self.window = window_seconds
+        self._requests: deque[float] = deque()
+        self._retries: deque[float] = deque()
+
+    def _trim(self, now: float) -> None:
+        for log in (self._requests, self._retries):
+            while log and now - log[0] > self.window:
+                log.popleft()
+
+    def record_request(self) -> None:
+        self._requests.append(time.monotonic())
+
+    def try_spend(self) -> bool:
+        now = time.monotonic()
+        self._trim(now)
+        allowed = max(self.min_per_window, int(len(self._requests) * self.ratio))
+        if len(self._retries) >= allowed:
+            return False
+        self._retries.append(now)
+        return True
+
+
+class Resilience:
+    """按 endpoint 包装上游调用
+
+    - 可重试错误按指数退避 + 抖动重试，上游给出 Retry-After 时以其为准
+    - 每个 endpoint 有独立的重试预算和对冲预算
+    - 对冲：调用超过该 endpoint 近期 p95 仍未返回时，再发一个相同请求，
+      取先成功的结果并取消另一个；仅对 HEDGE_ENDPOINTS 中的 endpoint 开启
+    """
+
+    def __init__(self):
+        self.max_attempts = settings.RETRY_MAX_ATTEMPTS
+        self.base_delay = settings.RETRY_BASE_DELAY_SECONDS
+        self.max_delay = settings.RETRY_MAX_DELAY_SECONDS
+        self.hedge_endpoints = set(settings.HEDGE_ENDPOINTS)
+        self.hedge_min_delay = settings.HEDGE_MIN_DELAY_SECONDS
+        self._retry_budgets: dict[str, RetryBudget] = {}
+        self._hedge_budgets: dict[str, RetryBudget] = {}
+        self._latency: dict[str, Histogram] = {}
+
+    def _budget(self, table: dict, endpoint: str, ratio: float) -> RetryBudget:
+        budget = table.get(endpoint)
+        if budget is None:
+            budget = table[endpoint] = RetryBudget(ratio, settings.RETRY_BUDGET_MIN_PER_WINDOW)
+        return budget
+
+    def latency(self, endpoint: str) -> Histogram:
+        histogram = self._latency.get(endpoint)
+        if histogram is None:
+            histogram = self._latency[endpoint] = Histogram(reservoir=512)
+        return histogram
+
+    def _backoff(self, attempt: int, error: BaseException) -> float:
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        # full jitter
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(
+        self,
+        endpoint: str,
+        fn: Callable[[], Awaitable[T]],
+        idempotent: bool = True,
+        hedge: bool = True,
+    ) -> T:
+        """执行一次上游调用（含重试与对冲）
+
+        Args:
+            endpoint: 上游 endpoint 名，用于预算与延迟统计
+            fn: 无参协程工厂，每次尝试都会重新调用
+            idempotent: 非幂等请求只在确定未被处理时重试
+            hedge: 是否允许对冲（还需 endpoint 在 HEDGE_ENDPOINTS 中）；
+                非幂等请求一律不对冲，重复提交会产生两次副作用
+        """
+        retry_budget = self._budget(self._retry_budgets, endpoint, settings.RETRY_BUDGET_RATIO)
+        use_hedge = hedge and idempotent and endpoint in self.hedge_endpoints
+        attempt = 0
+        while True:
+            retry_budget.record_request()
+            if use_hedge:
+                self._budget(self._hedge_budgets, endpoint, settings.HEDGE_BUDGET_RATIO).record_request()
+            try:
+                if use_hedge:
+                    return await self._hedged(endpoint, fn)
+                return await self._timed(endpoint, fn)
+            except Exception as e:
+                attempt += 1
+                if attempt >= self.max_attempts or not is_retryable(e, idempotent):
+                    raise
+                if not retry_budget.try_spend():
+                    metrics.inc("upstream.retry_budget_exhausted", endpoint=endpoint)
+                    raise
+                delay = self._backoff(attempt, e)
+                left = remaining()
+                if left is not None and left <= delay:
+                    # 截止时间前等不到下一次尝试
+                    raise
+                metrics.inc("upstream.retries", endpoint=endpoint)
+                print(f"Retrying {endpoint} in {delay:.1f}s after: {e}")
+                await asyncio.sleep(delay)
+
+    async def _timed(self, endpoint: str, fn: Callable[[], Awaitable[T]]) -> T:
+        started = time.monotonic()
+        result = await fn()
+        elapsed = time.monotonic() - started
+        self.latency(endpoint).observe(elapsed)
+        metrics.observe("upstream.latency_seconds", elapsed, endpoint=endpoint)
+        return result
+
+    async def _hedged(self, endpoint: str, fn: Callable[[], Awaitable[T]]) -> T:
+        histogram = self.latency(endpoint)
+        p95 = histogram.quantile(0.95) if histogram.count >= 20 else None
+        if p95 is None:
+            return await self._timed(endpoint, fn)
+
+        primary = asyncio.ensure_future(self._timed(endpoint, fn))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=max(p95, self.hedge_min_delay))
+            if done:
+                return primary.result()
+
+            hedge_budget = self._budget(self._hedge_budgets, endpoint, settings.HEDGE_BUDGET_RATIO)
+            if not hedge_budget.try_spend():
+                return await primary
+
+            metrics.inc("upstream.hedges", endpoint=endpoint)
+            secondary = asyncio.ensure_future(self._timed(endpoint, fn))
+            tasks.append(secondary)
+            pending = {primary, secondary}
+            error: BaseException | None = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is secondary:
+                            metrics.inc("upstream.hedge_wins", endpoint=endpoint)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # 取消落后的请求（包括调用方被取消的情况）
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+
+resilience = Resilience()
@@ -0,0 +1,276 @@
+"""
+XC AI Design - 任务分区与归档
+tasks 按 created_at 月度分区；结束已久的任务连同图片产物压缩为 JSONL 写入对象存储，
+从数据库删除，API 按需从归档读取
+"""
+
+import asyncio
+import gzip
+import json
+import re
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from uuid import UUID
+from sqlalchemy import delete, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.database import async_session_maker, engine
+from app.core.metrics import metrics
+from app.core.redis import get_redis
+from app.models.task import ArchivedTask, Task, TaskArtifact, TaskCheckpoint, TaskStatus
+from app.services.object_storage import object_storage
+
+# 可以归档的终态；处理中的任务不动
+FINISHED_STATUSES = [
+    TaskStatus.COMPLETED.value,
+    TaskStatus.PARTIAL_COMPLETED.value,
+    TaskStatus.FAILED.value,
+    TaskStatus.CANCELLED.value,
+]
+
+_PARTITION_NAME = re.compile(r"^tasks_(\d{4})_(\d{2})$")
+# 接住没有对应月度分区的行；不会被 drop_empty_partitions 删除
+_DEFAULT_PARTITION = "tasks_default"
+
+_LOCK_KEY = "task_archive:lock"
+# 只续期 / 释放自己持有的锁
+_RENEW_LOCK = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then "
+    "return redis.call('expire', KEYS[1], ARGV[2]) else return 0 end"
+)
+_RELEASE_LOCK = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then "
+    "return redis.call('del', KEYS[1]) else return 0 end"
+)
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _row(obj) -> dict:
+    return {column.key: getattr(obj, column.key) for column in obj.__table__.columns}
+
+
+class TaskArchive:
+    """分区维护与冷数据归档
+
+    - ensure_partitions：创建 DEFAULT 分区及当月和之后 TASK_PARTITION_MONTHS_AHEAD 个月的分区（幂等）
+    - archive_batch：把超过 TASK_ARCHIVE_AFTER_DAYS 天的已结束任务写成一个 .jsonl.gz 对象，
+      登记到 archived_tasks 后删除任务、产物与检查点；先上传后删除，失败时最多留下孤立对象
+    - drop_empty_partitions：整月都已归档的旧分区先 DETACH ... CONCURRENTLY 再删除，
+      不长时间锁住 tasks，不再参与索引与 vacuum
+    - restore：按需读取归档中的单个任务（只读，不写回数据库）
+    - 后台循环由 Redis 锁避免多个进程同时归档；选中的任务行另加 FOR UPDATE SKIP LOCKED，
+      锁过期后即使两次归档重叠，也不会处理同一批任务
+    """
+
+    def __init__(self):
+        self.enabled = settings.TASK_ARCHIVE_ENABLED
+        self.batch_size = settings.TASK_ARCHIVE_BATCH_SIZE
+        self.interval = settings.TASK_ARCHIVE_INTERVAL_SECONDS
+        self._task: Optional[asyncio.Task] = None
+        # 最近读取的归档对象：object_key → {task_id: record}
+        self._objects: OrderedDict[str, dict[str, dict]] = OrderedDict()
+        self._object_limit = 8
+
+    def _cutoff(self) -> datetime:
+        return datetime.now(timezone.utc) - timedelta(days=settings.TASK_ARCHIVE_AFTER_DAYS)
+
+    async def ensure_partitions(self) -> None:
+        """创建 DEFAULT 分区，以及当月和之后 TASK_PARTITION_MONTHS_AHEAD 个月的分区（幂等）
+
+        启动时在开始服务前执行一次，之后由后台循环定期执行。有 DEFAULT 分区兜底，
+        月度分区没能按时创建时写入也不会失败；多个进程同时执行时由 advisory 锁串行化。
+        """
+        current = datetime.now(timezone.utc).date().replace(day=1)
+        async with engine.begin() as conn:
+            await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('tasks_partitions'))"))
+            await conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {_DEFAULT_PARTITION} PARTITION OF tasks DEFAULT"
+            ))
+            for offset in range(settings.TASK_PARTITION_MONTHS_AHEAD + 1):
+                start = _add_months(current, offset)
+                end = _add_months(start, 1)
+                try:
+                    async with conn.begin_nested():
+                        await conn.execute(text(
+                            f"CREATE TABLE IF NOT EXISTS tasks_{start:%Y_%m} PARTITION OF tasks "
+                            f"FOR VALUES FROM ('{start} 00:00:00+00') TO ('{end} 00:00:00+00')"
+                        ))
+                except Exception as e:
+                    # DEFAULT 分区里已有该月的行时无法创建该月分区，写入仍落在 DEFAULT 分区
+                    print(f"Failed to create task partition for {start:%Y-%m}: {e}")
+
+    async def archive_batch(self) -> int:
+        """归档一批任务；返回归档的数量"""
+        async with async_session_maker() as db:
+            # 行锁持有到提交（上传、登记、删除完成）；其他归档进程跳过这些行
+            result = await db.execute(
+                select(Task)
+                .where(Task.created_at < self._cutoff(), Task.status.in_(FINISHED_STATUSES))
+                .order_by(Task.created_at)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            tasks = list(result.scalars())
+            if not tasks:
+                return 0
+
+            ids = [task.id for task in tasks]
+            result = await db.execute(
+                select(TaskArtifact)
+                .where(TaskArtifact.task_id.in_(ids))
+                .order_by(TaskArtifact.task_id, TaskArtifact.position)
+            )
+            artifacts: dict[UUID, list[dict]] = {}
+            for artifact in result.scalars():
+                artifacts.setdefault(artifact.task_id, []).append(_row(artifact))
+
+            lines = [
+                json.dumps({"task": _row(task), "artifacts": artifacts.get(task.id, [])}, default=str)
+                for task in tasks
+            ]
+            data = await asyncio.to_thread(gzip.compress, "\n".join(lines).encode())
+            key = f"{settings.TASK_ARCHIVE_PREFIX}/{tasks[0].created_at:%Y/%m}/{uuid.uuid4()}.jsonl.gz"
+            await object_storage.put(key, data, "application/gzip")
+
+            db.add_all([
+                ArchivedTask(
+                    task_id=task.id, user_id=task.user_id, created_at=task.created_at, object_key=key
+                )
+                for task in tasks
+            ])
+            await db.execute(delete(TaskArtifact).where(TaskArtifact.task_id.in_(ids)))
+            await db.execute(delete(TaskCheckpoint).where(TaskCheckpoint.task_id.in_(ids)))
+            await db.execute(delete(Task).where(Task.id.in_(ids)))
+            await db.commit()
+
+        metrics.inc("tasks.archived", len(tasks))
+        return len(tasks)
+
+    async def drop_empty_partitions(self) -> list[str]:
+        """删除结束时间早于归档截止月、且已经没有数据的分区
+
+        DROP TABLE 会对父表 tasks 加 ACCESS EXCLUSIVE 锁，阻塞所有任务读写；
+        因此先 DETACH PARTITION ... CONCURRENTLY（不能在事务内执行，使用自动提交连接），
+        再删除已经脱离的表。上次中断在分离中途的分区用 FINALIZE 完成分离。
+        """
+        cutoff_month = self._cutoff().date().replace(day=1)
+        dropped = []
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            result = await conn.execute(text(
+                "SELECT c.relname, i.inhdetachpending FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = 'tasks'::regclass"
+            ))
+            for name, detach_pending in result.all():
+                match = _PARTITION_NAME.match(name)
+                if not match:
+                    continue
+                month = date(int(match.group(1)), int(match.group(2)), 1)
+                if _add_months(month, 1) > cutoff_month:
+                    continue
+                empty = await conn.scalar(text(f"SELECT NOT EXISTS (SELECT 1 FROM {name})"))
+                if not empty:
+                    continue
+                if detach_pending:
+                    await conn.execute(text(f"ALTER TABLE tasks DETACH PARTITION {name} FINALIZE"))
+                else:
+                    await conn.execute(text(f"ALTER TABLE tasks DETACH PARTITION {name} CONCURRENTLY"))
+                await conn.execute(text(f"DROP TABLE {name}"))
+                dropped.append(name)
+        return dropped
+
+    async def run_once(self) -> None:
+        try:
+            await self.ensure_partitions()
+        except Exception as e:
+            print(f"Task partition maintenance failed: {e}")
+
+        if not self.enabled:
+            return
+        token = str(uuid.uuid4())
+        try:
+            locked = await get_redis().set(_LOCK_KEY, token, nx=True, ex=int(self.interval))
+        except Exception:
+            locked = False
+        if not locked:
+            return
+
+        try:
+            archived = 0
+            while True:
+                count = await self.archive_batch()
+                archived += count
+                # 每批之后续期，长时间的归档不会让锁过期
+                await self._renew_lock(token)
+                if count < self.batch_size:
+                    break
+            dropped = await self.drop_empty_partitions()
+            if archived or dropped:
+                print(f"Archived {archived} tasks, dropped partitions: {dropped}")
+        finally:
+            await self._release_lock(token)
+
+    async def _renew_lock(self, token: str) -> None:
+        try:
+            await get_redis().eval(_RENEW_LOCK, 1, _LOCK_KEY, token, int(self.interval))
+        except Exception as e:
+            print(f"Failed to renew task archive lock: {e}")
+
+    async def _release_lock(self, token: str) -> None:
+        try:
+            await get_redis().eval(_RELEASE_LOCK, 1, _LOCK_KEY, token)
+        except Exception as e:
+            print(f"Failed to release task archive lock: {e}")
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"Task archival failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _load_object(self, key: str) -> dict[str, dict]:
+        records = self._objects.get(key)
+        if records is None:
+            data = await object_storage.get(key)
+            raw = await asyncio.to_thread(gzip.decompress, data)
+            records = {}
+            for line in raw.decode().splitlines():
+                record = json.loads(line)
+                records[record["task"]["id"]] = record
+            self._objects[key] = records
+            while len(self._objects) > self._object_limit:
+                self._objects.popitem(last=False)
+        self._objects.move_to_end(key)
+        return records
+
+    async def restore(self, db: AsyncSession, task_id: UUID, user_id: UUID) -> Optional[dict]:
+        """读取归档中的任务：{"task": 任务字段, "artifacts": [产物字段]}；未归档时返回 None"""
+        result = await db.execute(
+            select(ArchivedTask.object_key)
+            .where(ArchivedTask.task_id == task_id, ArchivedTask.user_id == user_id)
+        )
+        key = result.scalar_one_or_none()
+        if key is None:
+            return None
+        metrics.inc("tasks.archive_restores")
+        return (await self._load_object(key)).get(str(task_id))
+
+
+task_archive = TaskArchive()
@@ -0,0 +1,84 @@
+"""
+XC AI Design - 任务检查点
+每完成一个步骤（产品分析、提示词、单张图片）就持久化结果，恢复或重试时只执行缺失的步骤；
+图片作为任务产物写入 task_artifacts
+"""
+
+from typing import Optional
+from uuid import UUID
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.task import TaskArtifact, TaskCheckpoint
+
+# 旧版本把图片记为 image:{序号} 检查点（由 migrations/001 迁入 task_artifacts）
+_LEGACY_IMAGE_STEP = "image:"
+
+
+class TaskCheckpoints:
+    """单个任务的步骤检查点"""
+
+    def __init__(self, db: AsyncSession, task_id: str):
+        self.db = db
+        self.task_id = UUID(task_id)
+        self.steps: dict[str, dict] = {}
+        self.artifacts: dict[int, str] = {}
+
+    async def load(self) -> None:
+        result = await self.db.execute(
+            select(TaskCheckpoint.step, TaskCheckpoint.data)
+            .where(TaskCheckpoint.task_id == self.task_id)
+        )
+        self.steps = {step: data for step, data in result.all()}
+        result = await self.db.execute(
+            select(TaskArtifact.position, TaskArtifact.url)
+            .where(TaskArtifact.task_id == self.task_id)
+        )
+        self.artifacts = {position: url for position, url in result.all()}
+        # 迁移 001 执行前仍在的旧图片检查点
+        for step, data in self.steps.items():
+            if step.startswith(_LEGACY_IMAGE_STEP) and data.get("url"):
+                self.artifacts.setdefault(int(step[len(_LEGACY_IMAGE_STEP):]), data["url"])
+
+    def get(self, step: str) -> Optional[dict]:
+        return self.steps.get(step)
+
+    async def save(self, step: str, data: dict) -> None:
+        """保存步骤结果并立即提交，之后的失败不会丢失该步骤"""
+        stmt = insert(TaskCheckpoint).values(task_id=self.task_id, step=step, data=data)
+        await self.db.execute(stmt.on_conflict_do_update(
+            index_elements=[TaskCheckpoint.task_id, TaskCheckpoint.step],
+            set_={"data": stmt.excluded.data},
+        ))
+        await self.db.commit()
+        self.steps[step] = data
+
+    def images(self, total: int) -> list[Optional[str]]:
+        """按序号返回已生成的图片 URL，未完成的为 None"""
+        return [self.artifacts.get(i) for i in range(total)]
+
+    async def save_image(
+        self,
+        index: int,
+        url: str,
+        role: Optional[str] = None,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        seconds: Optional[float] = None,
+    ) -> None:
+        """追加一张图片产物并立即提交（同一序号只保留第一次写入）"""
+        stmt = insert(TaskArtifact).values(
+            task_id=self.task_id,
+            position=index,
+            role=role,
+            url=url,
+            width=width,
+            height=height,
+            generation_seconds=seconds,
+        )
+        await self.db.execute(stmt.on_conflict_do_nothing(
+            index_elements=[TaskArtifact.task_id, TaskArtifact.position],
+        ))
+        await self.db.commit()
+        self.artifacts.setdefault(index, url)
+
@@ -0,0 +1,189 @@
+"""
+XC AI Design - 后台任务运行器
+登记运行中的生成任务，支持跨进程取消；每个任务使用独立的数据库会话
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.database import async_session_maker
+from app.core.deadline import remaining
+from app.core.metrics import metrics
+from app.core.redis import get_redis
+
+
+def _cancel_key(task_id: str) -> str:
+    return f"task:{task_id}:cancel"
+
+
+def _owner_key(task_id: str) -> str:
+    return f"task:{task_id}:owner"
+
+
+class TaskRunner:
+    """运行中的后台任务注册表
+
+    - start：在独立会话中运行任务协程，并登记 asyncio.Task
+    - cancel：取消本进程内的任务；任务由其他进程运行时在 Redis 写入取消标记，
+      该进程轮询到标记后取消。运行中的任务在 Redis 中定期续期归属标记，
+      没有任何进程持有的任务由调用方直接结算
+    - 取消即 asyncio 取消：进行中的 HTTP 请求、轮询与排队都会在下一个 await 处中止，
+      任务协程捕获 CancelledError 后负责记录状态与退款；等待重试期间被取消时由 on_cancelled 负责
+    - 自动重试：任务失败但可恢复时，从检查点重新执行缺失的步骤
+    - 自动取消：任务的最后一个 WebSocket 观察者离开超过宽限期后取消（可选）
+    """
+
+    def __init__(self):
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._reasons: dict[str, str] = {}
+        self._abandon_timers: dict[str, asyncio.TimerHandle] = {}
+        # task_id → (当前第几次执行, 最多执行次数)
+        self._attempts: dict[str, tuple[int, int]] = {}
+        # task_id → 已决定的下一次重试等待秒数（None 表示不再重试）
+        self._planned: dict[str, Optional[float]] = {}
+        metrics.set_gauge("tasks.running", lambda: len(self._tasks))
+
+    def start(
+        self,
+        task_id: str,
+        run: Callable[[AsyncSession], Awaitable],
+        max_attempts: int = 1,
+        on_cancelled: Optional[Callable[[AsyncSession], Awaitable]] = None,
+    ) -> None:
+        """启动后台任务；run(db) 接收任务专用的数据库会话
+
+        run 返回 False 表示失败但可从检查点恢复：按指数退避重新执行，
+        每次使用新会话，最多 max_attempts 次。
+        等待重试期间没有 run 在执行，此时被取消由 on_cancelled(db) 负责记录状态与退款
+        """
+
+        async def runner():
+            watcher = asyncio.ensure_future(self._watch_remote_cancel(task_id))
+            try:
+                for attempt in range(1, max_attempts + 1):
+                    self._attempts[task_id] = (attempt, max_attempts)
+                    self._planned.pop(task_id, None)
+                    async with async_session_maker() as db:
+                        if await run(db) is not False:
+                            return
+                    delay = self.retry_delay(task_id)
+                    if delay is None:
+                        return
+                    metrics.inc("tasks.retries")
+                    try:
+                        await asyncio.sleep(delay)
+                    except asyncio.CancelledError:
+                        if on_cancelled:
+                            async with async_session_maker() as db:
+                                await on_cancelled(db)
+                        raise
+            finally:
+                watcher.cancel()
+                try:
+                    await get_redis().delete(_owner_key(task_id))
+                except Exception:
+                    pass
+
+        task = asyncio.create_task(runner())
+        self._tasks[task_id] = task
+        task.add_done_callback(lambda _: self._forget(task_id))
+
+    def retry_delay(self, task_id: str) -> Optional[float]:
+        """当前这次执行失败后，多少秒后自动重试；不会重试时返回 None
+
+        结果在本次执行内固定：任务据此向前端报告“即将重试”后，运行器一定会重试
+        """
+        if task_id in self._planned:
+            return self._planned[task_id]
+        attempt, max_attempts = self._attempts.get(task_id, (1, 1))
+        delay = None
+        if attempt < max_attempts:
+            delay = settings.TASK_RETRY_DELAY_SECONDS * 2 ** (attempt - 1)
+            left = remaining()
+            if left is not None and left <= delay:
+                delay = None
+        self._planned[task_id] = delay
+        return delay
+
+    def _forget(self, task_id: str) -> None:
+        self._tasks.pop(task_id, None)
+        self._reasons.pop(task_id, None)
+        self._attempts.pop(task_id, None)
+        self._planned.pop(task_id, None)
+        timer = self._abandon_timers.pop(task_id, None)
+        if timer:
+            timer.cancel()
+
+    def is_running(self, task_id: str) -> bool:
+        return task_id in self._tasks
+
+    def cancel_reason(self, task_id: str) -> str:
+        return self._reasons.get(task_id, "cancelled")
+
+    def _cancel_local(self, task_id: str, reason: str) -> bool:
+        task = self._tasks.get(task_id)
+        if task is None or task.done():
+            return False
+        self._reasons.setdefault(task_id, reason)
+        task.cancel()
+        metrics.inc("tasks.cancelled", reason=reason)
+        return True
+
+    async def cancel(self, task_id: str, reason: str = "user") -> bool:
+        """请求取消任务
+
+        Returns:
+            是否有运行器（本进程或其他进程）会处理这次取消；
+            False 表示没有进程持有该任务（从未启动或所在进程已退出），需由调用方直接结算
+        """
+        if self._cancel_local(task_id, reason):
+            return True
+        try:
+            redis = get_redis()
+            if not await redis.exists(_owner_key(task_id)):
+                return False
+            await redis.set(
+                _cancel_key(task_id), reason, ex=int(settings.TASK_DEADLINE_SECONDS) + 60
+            )
+            return True
+        except Exception as e:
+            # 无法确认归属时直接结算：即使其他进程仍在运行，退款也以任务持有的积分为上限
+            print(f"Failed to publish cancellation for task {task_id}: {e}")
+            return False
+
+    async def _watch_remote_cancel(self, task_id: str) -> None:
+        # 归属标记比轮询间隔多留两轮，进程退出后很快过期
+        owner_ttl = int(settings.TASK_CANCEL_POLL_SECONDS * 3) + 1
+        while True:
+            try:
+                await get_redis().set(_owner_key(task_id), 1, ex=owner_ttl)
+            except Exception:
+                pass
+            await asyncio.sleep(settings.TASK_CANCEL_POLL_SECONDS)
+            try:
+                reason = await get_redis().get(_cancel_key(task_id))
+            except Exception:
+                continue
+            if reason:
+                self._cancel_local(task_id, reason)
+                return
+
+    def watchers_left(self, task_id: str) -> None:
+        """最后一个 WebSocket 观察者离开：宽限期后仍无人观察则取消任务"""
+        if not settings.TASK_AUTO_CANCEL_ENABLED or task_id not in self._tasks:
+            return
+        self.watcher_joined(task_id)
+        loop = asyncio.get_running_loop()
+        self._abandon_timers[task_id] = loop.call_later(
+            settings.TASK_AUTO_CANCEL_GRACE_SECONDS,
+            lambda: self._cancel_local(task_id, "abandoned"),
+        )
+
+    def watcher_joined(self, task_id: str) -> None:
+        timer = self._abandon_timers.pop(task_id, None)
+        if timer:
+            timer.cancel()
+
+
+task_runner = TaskRunner()
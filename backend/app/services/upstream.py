@@ -0,0 +1,79 @@
+"""
+XC AI Design - 上游接口错误
+将云雾 API 的 HTTP 错误统一转换为可识别、可重试的异常
+"""
+
+from typing import Optional
+import httpx
+
+
+class UpstreamError(Exception):
+    """上游 AI 接口错误
+
+    Attributes:
+        status_code: 返回给客户端的 HTTP 状态码
+        retryable: 是否值得稍后重试
+        retry_after: 建议的重试等待秒数
+        upstream_status: 上游返回的原始 HTTP 状态码（如有）
+    """
+
+    def __init__(
+        self,
+        message: str,
+        status_code: int = 502,
+        retryable: bool = False,
+        retry_after: Optional[float] = None,
+        upstream_status: Optional[int] = None,
+    ):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.upstream_status = upstream_status
+
+
+class UpstreamRateLimited(UpstreamError):
+    """上游限流（429）或本地限流排队超时"""
+
+    def __init__(
+        self,
+        message: str,
+        retry_after: Optional[float] = None,
+        upstream_status: Optional[int] = None,
+    ):
+        super().__init__(
+            message,
+            status_code=429,
+            retryable=True,
+            retry_after=retry_after,
+            upstream_status=upstream_status,
+        )
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头（仅支持秒数形式）"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def raise_for_upstream(response: httpx.Response, endpoint: str) -> None:
+    """检查上游响应状态，429/5xx 转换为 UpstreamError，其余沿用 httpx 异常"""
+    if response.status_code == 429:
+        raise UpstreamRateLimited(
+            f"{endpoint} rate limited by upstream",
+            retry_after=parse_retry_after(response.headers.get("Retry-After")),
+            upstream_status=429,
+        )
+    if response.status_code >= 500:
+        raise UpstreamError(
+            f"{endpoint} upstream error: HTTP {response.status_code}",
+            status_code=502,
+            retryable=True,
+            retry_after=parse_retry_after(response.headers.get("Retry-After")),
+            upstream_status=response.status_code,
+        )
+    response.raise_for_status()
@@ -30,5 +30,41 @@ class WebSocketManager:
                 except Exception:
                     pass
 
+    def section_relay(
+        self,
+        task_id: str | None,
+        stage: str,
+        expected: int,
+        start: int = 0,
+        end: int = 100,
+        **extra,
+    ):
+        """Build an on_section callback that pushes streamed JSON sections.
+
+        Progress moves linearly from ``start`` to ``end`` as sections arrive.
+        Several concurrent streams can share one relay (and so one progress
+        range) by passing their own ``stage`` per call; ``relay.progress``
+        holds the last reported value.
+        Returns None when there is no task channel, which disables streaming.
+        """
+        if not task_id:
+            return None
+        received = 0
+
+        async def relay(section: str, value, stage: str = stage):
+            nonlocal received
+            received += 1
+            relay.progress = start + int((end - start) * min(received, expected) / expected)
+            await self.send_progress(task_id, {
+                **extra,
+                "stage": stage,
+                "progress": relay.progress,
+                "section": section,
+                "data": value,
+            })
+
+        relay.progress = start
+        return relay
+
 
 ws_manager = WebSocketManager()
@@ -0,0 +1,41 @@
+-- 001: move images stored before task_artifacts existed into task_artifacts
+--
+-- Copies tasks.output_images and the old image:{n} task checkpoints into
+-- task_artifacts at their original positions (failed slots stay empty), then
+-- drops the old column and checkpoints. Idempotent.
+--
+-- Run once, by hand, after every worker runs a version that reads
+-- task_artifacts. Until then the app still reads unmigrated image:{n}
+-- checkpoints, so running it late loses nothing.
+--
+--   psql -d picset_ai -v ON_ERROR_STOP=1 -f migrations/001_task_artifacts_backfill.sql
+
+BEGIN;
+
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'tasks' AND column_name = 'output_images'
+    ) THEN
+        INSERT INTO task_artifacts (id, task_id, position, url)
+        SELECT gen_random_uuid(), t.id, e.ordinality - 1, e.value #>> '{}'
+        FROM tasks t,
+             jsonb_array_elements(t.output_images -> 'images') WITH ORDINALITY e(value, ordinality)
+        WHERE jsonb_typeof(t.output_images -> 'images') = 'array'
+          AND jsonb_typeof(e.value) = 'string'
+        ON CONFLICT (task_id, position) DO NOTHING;
+
+        ALTER TABLE tasks DROP COLUMN output_images;
+    END IF;
+END $$;
+
+INSERT INTO task_artifacts (id, task_id, position, url)
+SELECT gen_random_uuid(), task_id, substring(step from 7)::int, data ->> 'url'
+FROM task_checkpoints
+WHERE step LIKE 'image:%' AND data ->> 'url' IS NOT NULL
+ON CONFLICT (task_id, position) DO NOTHING;
+
+DELETE FROM task_checkpoints WHERE step LIKE 'image:%';
+
+COMMIT;
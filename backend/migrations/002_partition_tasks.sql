@@ -0,0 +1,85 @@
+-- 002: convert an unpartitioned tasks table to monthly range partitions
+--
+-- For databases created before tasks was partitioned on created_at. Renames
+-- the old table, creates the partitioned tasks table with one partition per
+-- month that has rows (through two months ahead) plus tasks_default, copies
+-- the rows, and drops the old table. Foreign keys that other tables had to
+-- tasks.id are dropped: a partitioned table's keys include created_at, and
+-- the archiver deletes rows keyed by task_id itself. Does nothing when tasks
+-- is already partitioned.
+--
+-- Run it before deploying a version that partitions tasks: those workers
+-- create partitions at startup and refuse to start on an unpartitioned table.
+--
+-- Holds an ACCESS EXCLUSIVE lock on tasks for the whole copy. Stop every
+-- worker first and run it in a maintenance window:
+--
+--   psql -d picset_ai -v ON_ERROR_STOP=1 -f migrations/002_partition_tasks.sql
+
+BEGIN;
+
+DO $$
+DECLARE
+    month timestamp;
+    fk record;  -- also reused for the old primary key
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'tasks'::regclass) = 'p' THEN
+        RAISE NOTICE 'tasks is already partitioned';
+        RETURN;
+    END IF;
+
+    LOCK TABLE tasks IN ACCESS EXCLUSIVE MODE;
+
+    FOR fk IN
+        SELECT conrelid::regclass AS tbl, conname
+        FROM pg_constraint
+        WHERE confrelid = 'tasks'::regclass AND contype = 'f'
+    LOOP
+        EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', fk.tbl, fk.conname);
+    END LOOP;
+
+    ALTER TABLE tasks RENAME TO tasks_unpartitioned;
+    -- Free the index names the new table will use
+    FOR fk IN
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = 'tasks_unpartitioned'::regclass AND contype = 'p'
+    LOOP
+        EXECUTE format(
+            'ALTER TABLE tasks_unpartitioned RENAME CONSTRAINT %I TO tasks_unpartitioned_pkey', fk.conname
+        );
+    END LOOP;
+    ALTER INDEX IF EXISTS ix_tasks_user_created_id RENAME TO ix_tasks_unpartitioned_user_created_id;
+    ALTER INDEX IF EXISTS ix_tasks_parent_id RENAME TO ix_tasks_unpartitioned_parent_id;
+
+    -- created_at becomes part of the primary key
+    UPDATE tasks_unpartitioned SET created_at = coalesce(updated_at, now()) WHERE created_at IS NULL;
+
+    CREATE TABLE tasks (LIKE tasks_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+        PARTITION BY RANGE (created_at);
+    ALTER TABLE tasks ADD PRIMARY KEY (id, created_at);
+    ALTER TABLE tasks ADD FOREIGN KEY (user_id) REFERENCES users (id);
+    CREATE INDEX ix_tasks_user_created_id ON tasks (user_id, created_at, id);
+    CREATE INDEX ix_tasks_parent_id ON tasks (parent_id);
+
+    FOR month IN
+        SELECT generate_series(
+            date_trunc('month', coalesce(min(created_at), now()) AT TIME ZONE 'UTC'),
+            date_trunc('month', now() AT TIME ZONE 'UTC') + interval '2 months',
+            interval '1 month'
+        )
+        FROM tasks_unpartitioned
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF tasks FOR VALUES FROM (%L) TO (%L)',
+            'tasks_' || to_char(month, 'YYYY_MM'),
+            month::text || '+00',
+            (month + interval '1 month')::text || '+00'
+        );
+    END LOOP;
+    CREATE TABLE tasks_default PARTITION OF tasks DEFAULT;
+
+    INSERT INTO tasks SELECT * FROM tasks_unpartitioned;
+    DROP TABLE tasks_unpartitioned;
+END $$;
+
+COMMIT;
@@ -0,0 +1,15 @@
+import pytest
+from pydantic import ValidationError
+from app.api.routes.aesthetic_mirror import BatchFuseRequest
+
+
+def test_products_default_info():
+    request = BatchFuseRequest(style_dna={}, products=[{"image_url": "https://img/1"}])
+    assert request.products[0].image_url == "https://img/1"
+    assert request.products[0].info == {}
+
+
+def test_product_without_image_url_is_rejected():
+    # Rejected at validation, so the endpoint answers 422 instead of a KeyError 500
+    with pytest.raises(ValidationError):
+        BatchFuseRequest(style_dna={}, products=[{"info": {"name": "mug"}}])
@@ -0,0 +1,150 @@
+import asyncio
+import pytest
+from app.core.concurrency import gather_bounded, gather_stages, run_two_stage_pipeline
+
+
+def test_gather_stages_reports_in_completion_order():
+    events = []
+
+    async def stage(value, delay):
+        await asyncio.sleep(delay)
+        return value
+
+    async def on_stage_done(name, result, finished):
+        events.append((name, result, finished))
+
+    results = asyncio.run(gather_stages(
+        {"slow": stage("s", 0.03), "fast": stage("f", 0.0)},
+        on_stage_done=on_stage_done,
+    ))
+    assert results == {"slow": "s", "fast": "f"}
+    assert events == [("fast", "f", 1), ("slow", "s", 2)]
+
+
+def test_gather_stages_failure_cancels_the_rest():
+    cancelled = asyncio.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def broken():
+        raise ValueError("boom")
+
+    async def main():
+        with pytest.raises(ValueError):
+            await gather_stages({"slow": slow(), "broken": broken()})
+        await asyncio.sleep(0)
+        return cancelled.is_set()
+
+    assert asyncio.run(main())
+
+
+def test_pipeline_keeps_input_order_and_isolates_failures():
+    done = []
+
+    async def first(item):
+        await asyncio.sleep(0.01 * (5 - item))
+        if item == 1:
+            raise ValueError("prompt failed")
+        return item * 10
+
+    async def second(item, value):
+        if item == 3:
+            raise RuntimeError("image failed")
+        return value + 1
+
+    async def on_item_done(index, result, error):
+        done.append(index)
+
+    outcomes = asyncio.run(run_two_stage_pipeline(
+        [0, 1, 2, 3, 4], first, second,
+        first_concurrency=5, second_concurrency=2, queue_size=1,
+        on_item_done=on_item_done,
+    ))
+    assert [r for r, _ in outcomes] == [1, None, 21, None, 41]
+    assert isinstance(outcomes[1][1], ValueError)
+    assert isinstance(outcomes[3][1], RuntimeError)
+    assert sorted(done) == [0, 1, 2, 3, 4]
+    # Items finish in first-stage latency order, not input order
+    assert done[0] == 4
+
+
+def test_pipeline_respects_stage_concurrency():
+    running = {"first": 0, "second": 0}
+    peak = {"first": 0, "second": 0}
+
+    def tracked(stage):
+        async def run(*args):
+            running[stage] += 1
+            peak[stage] = max(peak[stage], running[stage])
+            await asyncio.sleep(0.005)
+            running[stage] -= 1
+            return args[0]
+        return run
+
+    outcomes = asyncio.run(run_two_stage_pipeline(
+        list(range(12)), tracked("first"), tracked("second"),
+        first_concurrency=3, second_concurrency=2, queue_size=2,
+    ))
+    assert [r for r, _ in outcomes] == list(range(12))
+    assert peak == {"first": 3, "second": 2}
+
+
+def test_pipeline_cancellation_stops_workers():
+    started = []
+    cancelled = []
+
+    async def first(item):
+        return item
+
+    async def second(item, value):
+        started.append(item)
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(item)
+            raise
+
+    async def main():
+        run = asyncio.ensure_future(run_two_stage_pipeline(
+            [0, 1, 2], first, second,
+            first_concurrency=1, second_concurrency=2, queue_size=1,
+        ))
+        await asyncio.sleep(0.02)
+        run.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await run
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert sorted(started) == [0, 1]
+    assert sorted(cancelled) == [0, 1]
+
+
+def test_gather_bounded_limits_concurrency_and_keeps_order():
+    running = 0
+    peak = 0
+    done = []
+
+    async def fn(item):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.001 * (6 - item))
+        running -= 1
+        if item == 2:
+            raise ValueError("bad item")
+        return item * 2
+
+    async def on_item_done(index, result, error):
+        done.append(index)
+
+    outcomes = asyncio.run(gather_bounded(list(range(6)), fn, 3, on_item_done=on_item_done))
+    assert [r for r, _ in outcomes] == [0, 2, None, 6, 8, 10]
+    assert isinstance(outcomes[2][1], ValueError)
+    assert peak == 3
+    assert sorted(done) == list(range(6))
@@ -0,0 +1,98 @@
+import asyncio
+import uuid
+import pytest
+from app.core.config import settings
+from app.models.task import Task, TaskType
+from app.services.credit_ledger import InsufficientCredits, credit_ledger
+
+
+class FakeResult:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar_one(self):
+        return self.value
+
+    def scalar_one_or_none(self):
+        return self.value
+
+
+class FakeSession:
+    """Plays the conditional UPDATE ... RETURNING against an in-memory balance."""
+
+    def __init__(self, balance):
+        self.balance = balance
+        self.entries = []
+
+    async def execute(self, stmt):
+        compiled = stmt.compile()
+        amount = compiled.params["credits_1"]
+        if ">=" in str(compiled):
+            # reserve: credits - amount, guarded by credits >= amount
+            if self.balance < amount:
+                return FakeResult(None)
+            self.balance -= amount
+        else:
+            self.balance += amount
+        return FakeResult(self.balance)
+
+    def add(self, obj):
+        if obj.__class__.__name__ == "CreditLedgerEntry":
+            self.entries.append(obj)
+
+
+def genesis_task(credits_used):
+    return Task(
+        id=uuid.uuid4(), user_id=uuid.uuid4(), type=TaskType.GENESIS.value, credits_used=credits_used
+    )
+
+
+def test_refund_undelivered_keeps_only_delivered_share(monkeypatch):
+    monkeypatch.setattr(settings, "CREDIT_COST_GENESIS", 10)
+    db = FakeSession(balance=0)
+    task = genesis_task(10)
+    # 3 of 4 delivered: the missing quarter (rounded down) comes back
+    assert asyncio.run(credit_ledger.refund_undelivered(db, task, 3, 4, "partial")) == 2
+    assert task.credits_used == 8
+    assert db.balance == 2
+    assert db.entries[-1].amount == 2
+
+
+def test_refunds_never_exceed_what_is_held(monkeypatch):
+    monkeypatch.setattr(settings, "CREDIT_COST_GENESIS", 10)
+    db = FakeSession(balance=0)
+    task = genesis_task(10)
+    assert asyncio.run(credit_ledger.refund_undelivered(db, task, 0, 4, "failed")) == 10
+    # Settling again (e.g. a cancel racing a failure) has nothing left to return
+    assert asyncio.run(credit_ledger.refund_undelivered(db, task, 0, 4, "cancelled")) == 0
+    assert asyncio.run(credit_ledger.refund(db, task, 50, "manual")) == 0
+    assert db.balance == 10
+    assert task.credits_used == 0
+
+
+def test_reserve_remaining_restores_the_refunded_credits(monkeypatch):
+    monkeypatch.setattr(settings, "CREDIT_COST_GENESIS", 10)
+    db = FakeSession(balance=100)
+    task = genesis_task(10)
+    asyncio.run(credit_ledger.refund_undelivered(db, task, 1, 4, "failed"))
+    assert task.credits_used == 3
+    assert asyncio.run(credit_ledger.reserve_remaining(db, task)) == 7
+    assert task.credits_used == 10
+    assert db.balance == 100
+
+
+def test_reserve_rejects_insufficient_balance():
+    db = FakeSession(balance=5)
+    task = genesis_task(0)
+    with pytest.raises(InsufficientCredits):
+        asyncio.run(credit_ledger.reserve(db, task.user_id, 10, task))
+    assert task.credits_used == 0
+    assert db.entries == []
+
+
+def test_batch_tasks_are_never_refunded():
+    db = FakeSession(balance=0)
+    task = Task(
+        id=uuid.uuid4(), user_id=uuid.uuid4(), type=TaskType.BATCH_FUSE.value, credits_used=0
+    )
+    assert asyncio.run(credit_ledger.refund_undelivered(db, task, 0, 3, "failed")) == 0
@@ -0,0 +1,43 @@
+import asyncio
+from app.services import genesis_pipeline as module
+from app.services.genesis_pipeline import GenesisPipeline
+
+
+def test_results_sorted_by_order_with_failures_marked(monkeypatch):
+    async def fake_prompt(img, product_info):
+        if img["role"] == "bad":
+            raise ValueError("no prompt")
+        await asyncio.sleep(0.001 * img["order"])
+        return {"prompt": img["role"]}
+
+    async def fake_image(prompt_data, order, base_image_url=None, aspect_ratio="3:4"):
+        return {"order": order, "url": f"https://img/{order}", "success": True}
+
+    monkeypatch.setattr(module.gemini_service, "generate_image_prompt", fake_prompt)
+    monkeypatch.setattr(module.nano_banana_service, "generate_from_prompt", fake_image)
+
+    events = []
+
+    async def on_progress(event):
+        events.append(event)
+
+    plan = {"image_sequence": [
+        {"order": 3, "role": "detail"},
+        {"order": 1, "role": "hero"},
+        {"order": 2, "role": "bad"},
+    ]}
+    pipeline = GenesisPipeline(prompt_concurrency=2, image_concurrency=2, queue_size=1)
+    results = asyncio.run(pipeline.run(plan, {}, on_progress=on_progress))
+
+    assert [r["order"] for r in results] == [1, 2, 3]
+    assert results[0]["url"] == "https://img/1"
+    assert results[1]["success"] is False
+    assert results[1]["deadline_exceeded"] is False
+    assert events[-1]["progress"] == 100
+    assert events[-1]["images_done"] == 3
+    progress = [e["progress"] for e in events]
+    assert progress == sorted(progress)
+
+
+def test_empty_plan_returns_nothing():
+    assert asyncio.run(GenesisPipeline().run({"image_sequence": []}, {})) == []
@@ -0,0 +1,99 @@
+import asyncio
+import io
+import random
+import pytest
+from PIL import Image
+from app.services.image_dedup_service import HammingIndex, compute_dhash, product_analysis_dedup
+
+
+def _png(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _gradient(size: int, flip: bool = False) -> Image.Image:
+    image = Image.new("L", (size, size))
+    for x in range(size):
+        for y in range(size):
+            value = (x * 7 + y * 3) % 256
+            image.putpixel((x, y), 255 - value if flip else value)
+    return image
+
+
+def _flip_bits(value: int, bits: list[int]) -> int:
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def test_dhash_survives_resize_and_reencode():
+    original = _gradient(128)
+    resized = original.resize((64, 64))
+    jpeg = io.BytesIO()
+    original.convert("RGB").save(jpeg, format="JPEG", quality=70)
+
+    base = compute_dhash(_png(original))
+    assert (base ^ compute_dhash(_png(resized))).bit_count() <= 4
+    assert (base ^ compute_dhash(jpeg.getvalue())).bit_count() <= 4
+
+
+def test_dhash_differs_for_different_images():
+    a = compute_dhash(_png(_gradient(64)))
+    b = compute_dhash(_png(_gradient(64, flip=True)))
+    assert (a ^ b).bit_count() > 20
+
+
+def test_band_layout_covers_all_bits():
+    for threshold in range(16):
+        bands = HammingIndex._build_bands(threshold)
+        assert len(bands) == threshold + 1
+        covered = 0
+        for shift, mask in bands:
+            covered |= mask << shift
+        assert covered == (1 << 64) - 1
+
+
+def test_find_within_threshold_across_bands():
+    index = HammingIndex(threshold=6, max_entries=100)
+    rng = random.Random(1)
+    stored = rng.getrandbits(64)
+    index.add(stored)
+    # Flip one bit in each of six different bands: every band but one differs
+    probe = _flip_bits(stored, [0, 10, 20, 30, 40, 50])
+    assert index.find(probe) == (stored, 6)
+
+
+def test_find_rejects_beyond_threshold():
+    index = HammingIndex(threshold=3, max_entries=100)
+    index.add(0)
+    assert index.find(_flip_bits(0, [1, 2, 3])) == (0, 3)
+    assert index.find(_flip_bits(0, [1, 2, 3, 4])) is None
+
+
+def test_large_threshold_falls_back_to_linear_scan():
+    index = HammingIndex(threshold=20, max_entries=100)
+    assert index._bands == []
+    index.add(0)
+    assert index.find(_flip_bits(0, list(range(20)))) == (0, 20)
+
+
+def test_ties_prefer_newest_and_eviction_drops_oldest():
+    index = HammingIndex(threshold=2, max_entries=10)
+    index.add(0b01)
+    index.add(0b10)
+    # Both are one bit away from 0: the newer one wins
+    assert index.find(0) == (0b10, 1)
+
+    for value in range(100, 110):
+        index.add(value << 20)
+    assert len(index) <= 10
+    assert index.find(0b01) is None
+    assert index.find(109 << 20) == (109 << 20, 0)
+
+
+def test_hash_image_url_only_fetches_upload_hosts():
+    with pytest.raises(ValueError):
+        asyncio.run(product_analysis_dedup.hash_image_url("http://169.254.169.254/latest/meta-data"))
+    with pytest.raises(ValueError):
+        asyncio.run(product_analysis_dedup.hash_image_url("file:///etc/passwd"))
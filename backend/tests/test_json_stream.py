@@ -0,0 +1,47 @@
+import json
+from app.core.json_stream import IncrementalJSONParser
+
+DOC = {
+    "title": 'He said "hi {there}"',
+    "path": "C:\\dir\\",
+    "count": 3,
+    "tags": ["a]", "b\"}"],
+    "style": {"color": "red", "nested": [1, {"x": "}"}]},
+    "done": True,
+}
+
+
+def feed_all(chunks):
+    parser = IncrementalJSONParser()
+    sections = []
+    for chunk in chunks:
+        sections.extend(parser.feed(chunk))
+    return sections
+
+
+def test_whole_document_in_one_chunk():
+    sections = feed_all(["```json\n" + json.dumps(DOC) + "\n```"])
+    assert dict(sections) == DOC
+    assert [key for key, _ in sections] == list(DOC)
+
+
+def test_every_chunk_boundary():
+    text = "Here you go:\n" + json.dumps(DOC, indent=2)
+    for size in (1, 2, 3, 7):
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        assert dict(feed_all(chunks)) == DOC, size
+
+
+def test_split_inside_escape_sequence():
+    text = json.dumps({"q": 'a\\"b', "n": 1})
+    cut = text.index("\\") + 1
+    assert dict(feed_all([text[:cut], text[cut:]])) == {"q": 'a\\"b', "n": 1}
+
+
+def test_sections_emitted_as_soon_as_complete():
+    parser = IncrementalJSONParser()
+    assert parser.feed('{"a": {"b": 1}') == [("a", {"b": 1})]
+    assert parser.feed(', "c": 2') == []
+    assert parser.feed("}") == [("c", 2)]
+    # Anything after the closing brace is ignored
+    assert parser.feed(', "d": 3}') == []
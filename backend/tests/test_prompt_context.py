@@ -0,0 +1,31 @@
+import json
+from app.core.prompt_context import PRODUCT_CONTEXT_FIELDS, fit_to_budget
+
+FIELDS = PRODUCT_CONTEXT_FIELDS["image_prompt"]
+
+
+def test_full_analysis_keeps_listed_paths():
+    analysis = {
+        "basic_info": {"product_name": "保温杯", "category": "厨具", "material": "不锈钢"},
+        "selling_points": {"core_usp": "24小时保温", "others": ["轻便"]},
+    }
+    context = json.loads(fit_to_budget(analysis, FIELDS, 500))
+    assert context == {
+        "basic_info": {"product_name": "保温杯", "category": "厨具"},
+        "selling_points": {"core_usp": "24小时保温"},
+    }
+
+
+def test_basic_info_only_matches_top_level_keys():
+    # The frontend sends productAnalysis.basic_info as product_info
+    basic_info = {"product_name": "保温杯", "category": "厨具", "material": "不锈钢"}
+    context = json.loads(fit_to_budget(basic_info, FIELDS, 500))
+    assert context == {"product_name": "保温杯", "category": "厨具"}
+
+
+def test_free_form_info_falls_back_to_whole_dict():
+    # Batch fusion passes whatever the client put in "info"
+    info = {"name": "保温杯", "notes": "x" * 2000}
+    text = fit_to_budget(info, FIELDS, 200)
+    assert text != "{}"
+    assert "保温杯" in text
@@ -0,0 +1,33 @@
+import asyncio
+from app.services.resilience import Resilience
+
+
+def make_resilience():
+    resilience = Resilience()
+    resilience.hedge_endpoints = {"image"}
+    resilience.hedge_min_delay = 0.01
+    for _ in range(20):
+        resilience.latency("image").observe(0.01)
+    return resilience
+
+
+def slow_call(calls):
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "ok"
+    return fn
+
+
+def test_idempotent_call_is_hedged_when_slow():
+    calls = []
+    result = asyncio.run(make_resilience().call("image", slow_call(calls)))
+    assert result == "ok"
+    assert len(calls) == 2
+
+
+def test_non_idempotent_call_is_never_hedged():
+    calls = []
+    result = asyncio.run(make_resilience().call("image", slow_call(calls), idempotent=False))
+    assert result == "ok"
+    assert len(calls) == 1
@@ -0,0 +1,56 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+from fastapi import Response
+from app.api.v1.tasks import _etag_matches, _task_version, get_task
+
+UPDATED = datetime(2026, 3, 1, 12, 0, 0, 1, tzinfo=timezone.utc)
+
+
+def test_version_changes_with_every_microsecond():
+    assert _task_version(UPDATED) != _task_version(UPDATED + timedelta(microseconds=1))
+    assert _task_version(UPDATED) == _task_version(UPDATED.astimezone(timezone(timedelta(hours=8))))
+    assert _task_version(None) == "0"
+
+
+def test_if_none_match_parsing():
+    etag = f'"{_task_version(UPDATED)}"'
+    assert _etag_matches(etag, etag)
+    assert _etag_matches(f"W/{etag}", etag)
+    assert _etag_matches(f'"stale", {etag}', etag)
+    assert _etag_matches("*", etag)
+    assert not _etag_matches('"stale"', etag)
+    assert not _etag_matches(None, etag)
+    assert not _etag_matches("", etag)
+
+
+class FakeResult:
+    def __init__(self, row):
+        self.row = row
+
+    def one_or_none(self):
+        return self.row
+
+
+class VersionOnlySession:
+    """Answers the updated_at probe; any further query means the 304 path was missed."""
+
+    def __init__(self, updated_at):
+        self.updated_at = updated_at
+        self.queries = 0
+
+    async def execute(self, stmt):
+        self.queries += 1
+        assert self.queries == 1, "full task loaded despite a matching ETag"
+        return FakeResult((self.updated_at,))
+
+
+def test_matching_etag_answers_304_without_loading_the_task():
+    db = VersionOnlySession(UPDATED)
+    etag = f'"{_task_version(UPDATED)}"'
+    response = asyncio.run(get_task(
+        uuid.uuid4(), Response(), db=db, user_id=uuid.uuid4(), if_none_match=etag
+    ))
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert db.queries == 1
@@ -0,0 +1,40 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+import pytest
+from fastapi import HTTPException
+from app.api.v1.tasks import _decode_cursor, _encode_cursor
+
+BASE = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def test_cursor_round_trip():
+    created_at = BASE.replace(microsecond=123456)
+    task_id = uuid.uuid4()
+    cursor = _encode_cursor(created_at, task_id)
+    assert "=" not in cursor
+    assert _decode_cursor(cursor) == (created_at, task_id)
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!", "aGVsbG8", _encode_cursor(BASE, uuid.uuid4())[:-4]])
+def test_invalid_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as raised:
+        _decode_cursor(cursor)
+    assert raised.value.status_code == 400
+
+
+def test_paging_breaks_created_at_ties_on_id():
+    # Many tasks share a created_at; seeking on (created_at, id) must neither skip nor repeat any
+    rows = [(BASE + timedelta(seconds=i // 4), uuid.uuid4()) for i in range(23)]
+    newest_first = sorted(rows, reverse=True)
+    seen = []
+    cursor = None
+    while True:
+        page = [
+            row for row in newest_first
+            if cursor is None or row < _decode_cursor(cursor)
+        ][:5]
+        seen.extend(page)
+        if len(page) < 5:
+            break
+        cursor = _encode_cursor(*page[-1])
+    assert seen == newest_first
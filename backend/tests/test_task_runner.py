@@ -0,0 +1,104 @@
+import asyncio
+from app.core.config import settings
+from app.services import task_runner as module
+from app.services.task_runner import TaskRunner
+
+
+class FakeSessionMaker:
+    def __init__(self):
+        self.sessions = []
+
+    def __call__(self):
+        return self
+
+    async def __aenter__(self):
+        session = object()
+        self.sessions.append(session)
+        return session
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeRedis:
+    def __init__(self, keys=()):
+        self.keys = dict.fromkeys(keys, 1)
+
+    async def exists(self, key):
+        return int(key in self.keys)
+
+    async def get(self, key):
+        return self.keys.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.keys[key] = value
+
+    async def delete(self, key):
+        self.keys.pop(key, None)
+
+
+def test_cancel_during_retry_backoff_settles_the_task(monkeypatch):
+    sessions = FakeSessionMaker()
+    monkeypatch.setattr(module, "async_session_maker", sessions)
+    monkeypatch.setattr(module, "get_redis", lambda: FakeRedis())
+    monkeypatch.setattr(settings, "TASK_RETRY_DELAY_SECONDS", 30.0)
+    runs = []
+    settled = []
+
+    async def run(db):
+        runs.append(db)
+        return False  # failed but resumable: the runner backs off before retrying
+
+    async def on_cancelled(db):
+        settled.append(db)
+
+    async def main():
+        runner = TaskRunner()
+        runner.start("t1", run, max_attempts=3, on_cancelled=on_cancelled)
+        await asyncio.sleep(0.01)
+        assert runner.is_running("t1")
+        assert await runner.cancel("t1", reason="user")
+        await asyncio.sleep(0.01)
+        return runner
+
+    runner = asyncio.run(main())
+    assert len(runs) == 1
+    # Settled in a fresh session of its own
+    assert settled == [sessions.sessions[1]]
+    assert not runner.is_running("t1")
+
+
+def test_cancel_during_run_leaves_settling_to_the_task(monkeypatch):
+    monkeypatch.setattr(module, "async_session_maker", FakeSessionMaker())
+    monkeypatch.setattr(module, "get_redis", lambda: FakeRedis())
+    settled = []
+
+    async def run(db):
+        await asyncio.sleep(10)
+
+    async def on_cancelled(db):
+        settled.append(db)
+
+    async def main():
+        runner = TaskRunner()
+        runner.start("t2", run, max_attempts=3, on_cancelled=on_cancelled)
+        await asyncio.sleep(0.01)
+        await runner.cancel("t2")
+        await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert settled == []
+
+
+def test_cancel_without_owner_is_left_to_the_caller(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(module, "get_redis", lambda: redis)
+    assert asyncio.run(TaskRunner().cancel("orphan")) is False
+    assert "task:orphan:cancel" not in redis.keys
+
+
+def test_cancel_of_remote_task_publishes_flag(monkeypatch):
+    redis = FakeRedis(["task:remote:owner"])
+    monkeypatch.setattr(module, "get_redis", lambda: redis)
+    assert asyncio.run(TaskRunner().cancel("remote", reason="user")) is True
+    assert redis.keys["task:remote:cancel"] == "user"